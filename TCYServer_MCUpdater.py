@@ -36,11 +36,33 @@ from datetime import datetime
 import webbrowser
 from multiprocessing import freeze_support
 from TCYNBTeditor import NbtIO, open_nbt_editor, open_nbt_editor_empty
+from apply_journal import ApplyJournal, load_journal
+from chunk_dedup import ChunkIndex, chunk_runs, copy_verified_chunk, locate_local_chunks, plan_chunk_assembly
+from content_store import STORE_DIR_NAME, ContentStore, copy_replacing, link_or_copy, link_replacing, move_replacing
+from delta_patch import apply_delta, select_patch
+from download_engine import DEFAULT_SEGMENT_COUNT, DOWNLOAD_BLOCK_SIZE, MAX_SEGMENT_COUNT, ChunkedStreamingDigest, DownloadAbortedError, StaleResumeError, StreamingDigest, chunk_table_size, contiguous_prefix_bytes, discard_part, find_damaged_chunks, finalize_part, hedge_path, load_part_state, new_part_state, normalize_chunk_table, parse_content_range, part_path, plan_segments, preallocate_file, resume_validator, resume_validator_from_probe, save_part_state, segment_remaining, segments_downloaded_bytes, should_start_hedge, should_use_segmented_download
+from download_scheduler import DownloadScheduler, TokenBucket
+from http_pool import HttpConnectionPool, get_ssl_context
+from file_hash_cache import FileHashCache
+from fs_snapshot import UpdateFsSnapshot
+from history_feed import (
+    HistoryFeedIndex,
+    normalize_pages,
+    pages_newer_than,
+    parse_history_page,
+    resolve_page_urls,
+)
+from install_verifier import parse_install_manifest, scan_install
+from json_cache import ConditionalJsonCache
 from jvm_advisor import build_jvm_recommendation, normalize_jvm_advisor_settings, JAVA_VERSION_NOTES
+from mirror_benchmark import BENCHMARK_RANGE_BYTES, BENCHMARK_TIME_LIMIT_SECONDS, MIN_THROUGHPUT_SAMPLE_BYTES, estimate_transfer_seconds, prune_mirror_history, rank_mirrors, update_mirror_history
 from mirror_catalog import DEFAULT_MIRROR_PREFIX, MIRROR_CATALOG, get_mirror_urls
 from system_overview import build_system_overview, get_available_memory_gb, get_disk_usage_for_path, get_windows_cpu_name, summarize_java_versions
-from updater_utils import bounded_worker_count, build_self_update_batch_script, build_url_list, classify_mirror_latency, collect_https_hosts, is_version_newer, resolve_relative_path, select_pending_updates, sort_versioned_items, ssl_mode_for_url, summarize_elapsed_ms, summarize_url_fetch_results, version_sort_key
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from update_planner import squash_update_manifests
+from update_session import STATE_PARTIAL, STATE_VERIFIED, UpdateSession
+from updater_utils import bounded_worker_count, build_self_update_batch_script, build_url_list, classify_mirror_latency, collect_https_hosts, is_version_newer, pick_freshest_document, record_url_health, resolve_relative_path, select_pending_updates, sort_versioned_items, ssl_mode_for_url, summarize_elapsed_ms, version_sort_key
+from zip_stream import StreamingZipExtractor, ZipStreamUnsupported
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, as_completed, wait
 
 # === 网络请求相关库 ===
 import urllib.request
@@ -112,6 +134,18 @@ def _try_import_pillow_image():
 
 TARGET_VERSION_NAME = "异界战斗幻想"
 CONFIG_FILE = "launcher_settings.json"
+JSON_CACHE_FILE = "version_check_cache.json"
+HISTORY_INDEX_FILE = "version_history_index.json"
+FILE_HASH_CACHE_FILE = "file_hash_cache.json"
+CHUNK_INDEX_FILE = "chunk_index.json"
+APPLY_JOURNAL_FILE = "update_apply.journal"
+UPDATE_SESSION_FILE = "update_session.json"
+# 后台预取检测游戏进程的间隔（秒），以及 Minecraft 游戏窗口的窗口类
+GAME_CHECK_INTERVAL_SECONDS = 5
+GAME_WINDOW_CLASSES = ("GLFW30", "LWJGL")
+INSTALL_REPORT_LIST_LIMIT = 200
+# 更新工作目录（骨架包解压目录, 暂存目录）；逐版本流水线更新时两组轮流使用，下一个版本预取到另一组
+UPDATE_WORK_DIRS = (("temp_update_tcy", "temp_staging"), ("temp_update_tcy_next", "temp_staging_next"))
 
 # ===整合包初始版本 (客户端内容版本) ===
 INITIAL_VERSION = "26.02.06.15.24"
@@ -161,14 +195,37 @@ class ConfigManager:
             "custom_latest_url": "",
             "custom_updater_url": "",
             # === 缓存的更新历史记录 (从 latest.json 拉取后写入本地) ===
-            "cached_history": [],
             "max_backups": 1,
             "parallel_downloads": 3,
+            "download_segments": 4,
+            "segmented_min_size_mb": 16,
+            "http_pool_max_per_host": 12,
+            "http_pool_idle_seconds": 30,
+            "hedged_downloads": True,
+            "hedge_delay_seconds": 4,
+            "hedge_min_kbps": 256,
+            "download_rate_limit_kbps": 0,
+            "adaptive_download_concurrency": True,
+            "content_store_enabled": True,
+            "content_store_path": "",
+            "content_store_budget_mb": 4096,
+            "delta_patches_enabled": True,
+            "chunk_dedup_enabled": True,
+            "stream_extract_skeleton": True,
+            "squash_batch_updates": True,
+            "pipeline_sequential_updates": True,
+            "background_prefetch_enabled": False,
+            "background_prefetch_rate_kbps": 1024,
+            "background_prefetch_source": "cn",
+            "install_manifest_url": "",
+            "version_poll_mode": "first_valid",
+            "version_poll_window_ms": 1500,
             "mod_presets": [],
             "mod_dep_ignores": {},
             "auto_select_mirror": True,
             "allow_insecure_mirror_ssl": True,
-            "mirror_speed_cache": {},
+            "mirror_history": {},
+            "mirror_benchmark_url": "",
             "activity_log": [],
             "ai_api_url": "",
             "ai_api_key": "",
@@ -221,9 +278,24 @@ class Api:
         self.game_root = self.find_game_root()
         self.cfg_mgr = ConfigManager()
         self.cancel_event = threading.Event()
+        self.http_pool = HttpConnectionPool(
+            max_per_host=self.cfg_mgr.config.get("http_pool_max_per_host", 12),
+            idle_timeout=self.cfg_mgr.config.get("http_pool_idle_seconds", 30),
+        )
+        self.download_scheduler = DownloadScheduler()
+        self.json_cache = ConditionalJsonCache(os.path.join(current_dir, JSON_CACHE_FILE))
+        self.file_hash_cache = FileHashCache(os.path.join(current_dir, FILE_HASH_CACHE_FILE))
+        self.chunk_index = ChunkIndex(os.path.join(current_dir, CHUNK_INDEX_FILE))
+        self.history_index = HistoryFeedIndex(os.path.join(current_dir, HISTORY_INDEX_FILE))
+        self._migrate_cached_history()
+        self.url_health = {}
+        self._url_health_lock = threading.Lock()
+        self._configure_download_scheduler()
         self.update_stage = 0  # 0: idle, 1: downloading, 2: applying
+        self._background_prefetch = None
         self._pending_update_preview = None
         self._preview_ttl_seconds = 600
+        self._install_report = None
         self.log(f"核心初始化完成，根目录定位: {self.game_root}")
 
     def cancel_current_update(self):
@@ -242,6 +314,23 @@ class Api:
         except Exception:
             pass
 
+    def _configure_download_scheduler(self):
+        """按当前设置刷新全局下载调度器的并发数和限速"""
+        cfg = self.cfg_mgr.config
+        try:
+            workers = max(1, int(cfg.get("parallel_downloads", 3)))
+        except Exception:
+            workers = 3
+        try:
+            rate_kbps = max(0.0, float(cfg.get("download_rate_limit_kbps", 0) or 0))
+        except Exception:
+            rate_kbps = 0.0
+        self.download_scheduler.configure(
+            workers=workers,
+            rate_limit_bytes_per_second=rate_kbps * 1024,
+            adaptive=bool(cfg.get("adaptive_download_concurrency", True)),
+        )
+
     def _is_network_timeout_error(self, err):
         s = str(err).lower()
         timeout_keywords = ['timed out', 'timeout', 'time out', 'stall timeout']
@@ -280,25 +369,37 @@ class Api:
 
     def _get_ssl_context_for_url(self, url):
         mode = ssl_mode_for_url(url, insecure_hosts=self._get_insecure_ssl_hosts())
-        if mode == "none":
-            return None, mode
-        if mode == "compat":
-            return ssl._create_unverified_context(), mode
-        return ssl.create_default_context(), mode
+        return get_ssl_context(mode), mode
 
-    def _urlopen_with_policy(self, req, timeout, url=None):
+    def _urlopen_with_policy(self, req, timeout, url=None, pooled=True):
         target_url = url or getattr(req, "full_url", None) or getattr(req, "get_full_url", lambda: "")()
-        context, mode = self._get_ssl_context_for_url(target_url)
+        _, mode = self._get_ssl_context_for_url(target_url)
         if mode == "strict":
             log_info(f"SSL策略[strict]: {target_url}")
         if mode == "compat":
             log_warning(f"SSL策略[compat]: {target_url}")
-        if context is None:
-            return urllib.request.urlopen(req, timeout=timeout)
-        return urllib.request.urlopen(req, timeout=timeout, context=context)
+        # GET/HEAD 走 keep-alive 连接池，同一镜像的多次请求复用 TCP/TLS 连接
+        return self.http_pool.urlopen(req, timeout=timeout, ssl_mode=mode, pooled=pooled)
+
+    def _release_idle_connections(self):
+        """一轮网络操作（版本检查、更新、修复、测速、后台预取）结束后关掉连接池里的空闲连接，不让 keep-alive 套接字整个会话都开着"""
+        try:
+            closed = self.http_pool.close_idle()
+        except Exception as e:
+            log_warning(f"关闭空闲连接失败: {e}")
+            return
+        if closed:
+            log_info(f"已关闭 {closed} 个空闲的 keep-alive 连接")
+
+    def _download_stop_check(self, abort_event=None):
+        """限速等待用的停止判断：用户取消，或这一路下载已被叫停"""
+        if abort_event is None:
+            return self.cancel_event.is_set
+        return lambda: self.cancel_event.is_set() or abort_event.is_set()
 
-    def _download_url_to_path(self, url, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15, allow_cancel=False):
+    def _download_url_to_path(self, url, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15, allow_cancel=False, digest=None, abort_event=None):
         req = urllib.request.Request(url, headers={'User-Agent': 'TCYClientUpdater/1.0'})
+        stop_check = self._download_stop_check(abort_event)
         dest_dir = os.path.dirname(dest_path)
         if dest_dir:
             os.makedirs(dest_dir, exist_ok=True)
@@ -314,11 +415,15 @@ class Api:
             block_num = 0
             block_size = 64 * 1024
             last_data_ts = time.time()
+            if digest is not None:
+                digest.reset()
 
             with open(dest_path, 'wb') as f:
                 while True:
                     if allow_cancel and self.cancel_event.is_set():
                         raise Exception("Update cancelled by user")
+                    if abort_event is not None and abort_event.is_set():
+                        raise DownloadAbortedError("Download aborted")
 
                     try:
                         chunk = resp.read(block_size)
@@ -332,14 +437,17 @@ class Api:
                         break
 
                     f.write(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
                     downloaded += len(chunk)
                     block_num += 1
                     last_data_ts = now
+                    self.download_scheduler.throttle(len(chunk), cancel_check=stop_check)
 
                     if progress_cb:
                         progress_cb(block_num, block_size, total_size if total_size > 0 else downloaded)
 
-    def _download_with_cancel(self, url, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15):
+    def _download_with_cancel(self, url, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15, digest=None, abort_event=None):
         self._download_url_to_path(
             url,
             dest_path,
@@ -347,6 +455,8 @@ class Api:
             connect_timeout=connect_timeout,
             stall_timeout=stall_timeout,
             allow_cancel=True,
+            digest=digest,
+            abort_event=abort_event,
         )
 
     def _probe_resume_feasibility(self, url, connect_timeout=8):
@@ -427,49 +537,6 @@ class Api:
         result["ok"] = bool(result["range_supported"] and isinstance(result["remote_size"], int) and result["remote_size"] > 0)
         return result
 
-    def _evaluate_resume_for_path(self, url, dest_path):
-        local_size = os.path.getsize(dest_path) if os.path.exists(dest_path) else 0
-        probe = self._probe_resume_feasibility(url)
-
-        decision = {
-            "resume_enabled": False,
-            "local_size": local_size,
-            "remote_size": probe.get("remote_size"),
-            "etag": probe.get("etag"),
-            "last_modified": probe.get("last_modified"),
-            "reasons": list(probe.get("reasons", [])),
-            "probe": probe
-        }
-
-        if local_size <= 0:
-            decision["reasons"].append({"code": "NO_LOCAL_PARTIAL", "msg": "本地无可续传分片"})
-            return decision
-
-        if not probe.get("ok"):
-            decision["reasons"].append({"code": "PROBE_NOT_OK", "msg": "远端续传探测不满足"})
-            return decision
-
-        remote_size = probe.get("remote_size")
-        if not isinstance(remote_size, int) or remote_size <= 0:
-            decision["reasons"].append({"code": "BAD_REMOTE_SIZE", "msg": "远端大小无效"})
-            return decision
-
-        if local_size >= remote_size:
-            decision["reasons"].append({"code": "LOCAL_TOO_LARGE", "msg": "本地文件不小于远端，禁用续传"})
-            return decision
-
-        if not (probe.get("etag") or probe.get("last_modified")):
-            decision["reasons"].append({"code": "NO_REMOTE_VALIDATOR", "msg": "远端缺少 ETag/Last-Modified"})
-            return decision
-
-        content_encoding = (probe.get("content_encoding") or '').lower()
-        if content_encoding and content_encoding not in ('identity',):
-            decision["reasons"].append({"code": "UNSAFE_ENCODING", "msg": f"不安全 Content-Encoding: {content_encoding}"})
-            return decision
-
-        decision["resume_enabled"] = True
-        return decision
-
     def _run_command_capture(self, command, shell=False):
         try:
             kwargs = {
@@ -1196,30 +1263,69 @@ class Api:
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def _download_with_resume(self, url, dest_path, local_size, remote_size, progress_cb=None, connect_timeout=8, stall_timeout=15):
+    def _download_with_resume(self, url, dest_path, state, progress_cb=None, connect_timeout=8, stall_timeout=15, digest=None, abort_event=None):
+        """按 .part.json 里记录的校验值发起 If-Range 条件续传；远端已变化时服务器返回 200，直接改为从头写入"""
+        data_path = part_path(dest_path)
+        stop_check = self._download_stop_check(abort_event)
+        local_size = os.path.getsize(data_path)
+        if local_size == state.get("size"):
+            # 上次已经收完但没来得及转正：不再联网，补算摘要后交给调用方转正，调用方照常按 sha256 校验
+            self.log(f"[{os.path.basename(dest_path)}] 分片已完整，直接使用")
+            if digest is not None:
+                digest.reset()
+                digest.catch_up_from_file(data_path, local_size)
+            if progress_cb:
+                progress_cb(1, local_size, local_size)
+            return
+        validator = resume_validator(state.get("etag"), state.get("last_modified"))
         req = urllib.request.Request(
             url,
             headers={
                 'User-Agent': 'TCYClientUpdater/1.0',
-                'Range': f'bytes={local_size}-'
+                'Range': f'bytes={local_size}-',
+                'If-Range': validator
             }
         )
 
         with self._urlopen_with_policy(req, timeout=connect_timeout, url=url) as resp:
             status = getattr(resp, 'status', None)
-            content_range = resp.headers.get('Content-Range', '')
-            if status != 206 or f'bytes {local_size}-' not in content_range:
-                raise Exception(f"Resume rejected by server: status={status}, content-range={content_range}")
+            content_range = parse_content_range(resp.headers.get('Content-Range', ''))
+            if status == 206:
+                if not content_range or content_range[0] != local_size or content_range[2] != state.get("size"):
+                    raise Exception(f"Resume rejected by server: status={status}, content-range={resp.headers.get('Content-Range', '')}")
+                remote_size = content_range[2]
+                file_mode = 'ab'
+            elif status == 200:
+                self.log(f"[{os.path.basename(dest_path)}] 远端文件已变化，放弃本地分片并重新下载")
+                local_size = 0
+                try:
+                    remote_size = int(resp.headers.get('Content-Length') or -1)
+                except Exception:
+                    remote_size = -1
+                file_mode = 'wb'
+            else:
+                raise Exception(f"Resume rejected by server: status={status}")
+
+            state = dict(state, url=url, size=remote_size if remote_size > 0 else state.get("size"),
+                         etag=resp.headers.get('ETag') or state.get("etag"),
+                         last_modified=resp.headers.get('Last-Modified') or state.get("last_modified"))
+            save_part_state(dest_path, state)
 
             block_num = max(1, local_size // (64 * 1024))
             block_size = 64 * 1024
             downloaded = local_size
             last_data_ts = time.time()
+            if digest is not None:
+                # 续传时只补算本地已有前缀的摘要，后续字节边下边算
+                digest.reset()
+                digest.catch_up_from_file(data_path, local_size)
 
-            with open(dest_path, 'ab') as f:
+            with open(data_path, file_mode) as f:
                 while True:
                     if self.cancel_event.is_set():
                         raise Exception("Update cancelled by user")
+                    if abort_event is not None and abort_event.is_set():
+                        raise DownloadAbortedError("Download aborted")
                     try:
                         chunk = resp.read(block_size)
                     except socket.timeout:
@@ -1232,66 +1338,308 @@ class Api:
                         break
 
                     f.write(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
                     downloaded += len(chunk)
                     block_num += 1
                     last_data_ts = now
+                    self.download_scheduler.throttle(len(chunk), cancel_check=stop_check)
 
                     if progress_cb:
-                        progress_cb(block_num, block_size, remote_size)
+                        progress_cb(block_num, block_size, remote_size if remote_size > 0 else downloaded)
+
+    def _get_segmented_download_policy(self):
+        try:
+            segment_count = int(self.cfg_mgr.config.get("download_segments", DEFAULT_SEGMENT_COUNT))
+        except Exception:
+            segment_count = DEFAULT_SEGMENT_COUNT
+        try:
+            min_size_mb = float(self.cfg_mgr.config.get("segmented_min_size_mb", 16))
+        except Exception:
+            min_size_mb = 16
+        return max(1, min(segment_count, MAX_SEGMENT_COUNT)), int(min_size_mb * 1024 * 1024)
+
+    def _fetch_download_segment(self, url, file_path, segment, on_bytes, connect_timeout=8, stall_timeout=15, max_retries=3, abort_event=None, validator=None):
+        """下载单个字节区间，失败时从该区间已完成的位置继续重试"""
+        attempt = 0
+        while segment_remaining(segment) > 0:
+            if self.cancel_event.is_set():
+                raise Exception("Update cancelled by user")
+            if abort_event is not None and abort_event.is_set():
+                raise Exception("Segment download aborted")
+
+            range_start = segment["start"] + segment["done"]
+            headers = {
+                'User-Agent': 'TCYClientUpdater/1.0',
+                'Range': f'bytes={range_start}-{segment["end"]}'
+            }
+            if validator:
+                headers['If-Range'] = validator
+            req = urllib.request.Request(url, headers=headers)
+            try:
+                with self._urlopen_with_policy(req, timeout=connect_timeout, url=url) as resp:
+                    status = getattr(resp, 'status', None)
+                    if status == 200 and validator:
+                        raise StaleResumeError("remote file changed since partial download")
+                    content_range = parse_content_range(resp.headers.get('Content-Range', ''))
+                    if status != 206 or not content_range or content_range[0] != range_start:
+                        raise Exception(f"Segment rejected by server: status={status}, content-range={resp.headers.get('Content-Range', '')}")
+
+                    last_data_ts = time.time()
+                    with open(file_path, 'r+b') as f:
+                        f.seek(range_start)
+                        while segment_remaining(segment) > 0:
+                            if self.cancel_event.is_set():
+                                raise Exception("Update cancelled by user")
+                            if abort_event is not None and abort_event.is_set():
+                                raise Exception("Segment download aborted")
+                            try:
+                                chunk = resp.read(min(DOWNLOAD_BLOCK_SIZE, segment_remaining(segment)))
+                            except socket.timeout:
+                                raise Exception("Segment stall timeout")
+
+                            now = time.time()
+                            if not chunk:
+                                if now - last_data_ts > stall_timeout:
+                                    raise Exception("Segment stall timeout")
+                                break
+
+                            f.write(chunk)
+                            f.flush()
+                            segment["done"] += len(chunk)
+                            last_data_ts = now
+                            on_bytes(len(chunk))
+                            self.download_scheduler.throttle(len(chunk), cancel_check=self._download_stop_check(abort_event))
+
+                if segment_remaining(segment) > 0:
+                    raise Exception("Segment ended early")
+            except StaleResumeError:
+                raise
+            except Exception as e:
+                if self.cancel_event.is_set() or "cancelled" in str(e).lower():
+                    raise
+                if abort_event is not None and abort_event.is_set():
+                    raise
+                attempt += 1
+                if attempt > max_retries:
+                    raise
+                log_warning(f"分段 {segment['index']} 下载中断，{attempt}/{max_retries} 次重试: {e}")
+                time.sleep(min(2 * attempt, 5))
+
+    def _download_segmented(self, url, dest_path, state, progress_cb=None, connect_timeout=8, stall_timeout=15, log_context=None, digest=None, conditional=False, abort_event=None):
+        """按字节区间并发下载到预分配的 .part 文件，区间进度随 .part.json 一起保存以便续传。
+
+        conditional=True 表示这是基于旧分片的续传，每个区间请求都带 If-Range，远端变化时抛 StaleResumeError。
+        abort_event 被置位时停止所有区间（等它们退出后）并抛 DownloadAbortedError。
+        """
+        context_name = log_context or os.path.basename(dest_path)
+        data_path = part_path(dest_path)
+        remote_size = state["size"]
+        segments = state["segments"]
+        validator = resume_validator(state.get("etag"), state.get("last_modified")) if conditional else None
+        state["url"] = url
+
+        pending = [seg for seg in segments if segment_remaining(seg) > 0]
+        self.log(f"[{context_name}] 分段下载: {len(segments)} 段，待下载 {len(pending)} 段，已完成 {segments_downloaded_bytes(segments)}/{remote_size}")
+
+        progress_lock = threading.Lock()
+        progress = {"done": segments_downloaded_bytes(segments)}
+        stop_segments = threading.Event()
+
+        def on_bytes(count):
+            with progress_lock:
+                progress["done"] += count
+                if progress_cb:
+                    progress_cb(progress["done"], 1, remote_size)
+
+        if digest is not None:
+            digest.reset()
+
+        try:
+            if pending:
+                with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                    futures = [
+                        executor.submit(
+                            self._fetch_download_segment,
+                            url,
+                            data_path,
+                            seg,
+                            on_bytes,
+                            connect_timeout,
+                            stall_timeout,
+                            abort_event=stop_segments,
+                            validator=validator,
+                        )
+                        for seg in pending
+                    ]
+                    first_error = None
+                    not_done = set(futures)
+                    last_state_save = time.time()
+                    while not_done:
+                        done, not_done = wait(not_done, timeout=0.5, return_when=FIRST_EXCEPTION)
+                        for future in done:
+                            err = future.exception()
+                            if err and first_error is None:
+                                # 任一区间重试耗尽即放弃整个文件，其余区间尽快停止并保留进度
+                                first_error = err
+                                stop_segments.set()
+                                log_warning(f"[{context_name}] 分段失败: {err}")
+                        if abort_event is not None and abort_event.is_set() and first_error is None:
+                            first_error = DownloadAbortedError("Download aborted")
+                            stop_segments.set()
+                        if digest is not None and first_error is None:
+                            # 主线程沿已连续落盘的前缀推进摘要，刚写入的数据仍在页缓存中
+                            digest.catch_up_from_file(data_path, contiguous_prefix_bytes(segments))
+                        if time.time() - last_state_save > 2:
+                            last_state_save = time.time()
+                            save_part_state(dest_path, state)
+                if first_error:
+                    raise first_error
+        except StaleResumeError:
+            raise
+        except BaseException:
+            try:
+                save_part_state(dest_path, state)
+            except Exception:
+                pass
+            raise
+
+        if digest is not None:
+            digest.catch_up_from_file(data_path, remote_size)
+
+    def _start_fresh_download(self, c_url, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15, log_context=None, digest=None, abort_event=None):
+        """没有可用分片时：探测一次远端能力，记录校验值到 .part.json，再选择分段或单流下载"""
+        context_name = log_context or os.path.basename(dest_path)
+        discard_part(dest_path)
+        probe = self._probe_resume_feasibility(c_url)
+        if abort_event is not None and abort_event.is_set():
+            raise DownloadAbortedError("Download aborted")
+        validator = resume_validator_from_probe(probe)
+        remote_size = probe.get("remote_size")
+
+        try:
+            self._add_activity_log("resume_probe_result", {
+                "context": context_name,
+                "url": c_url,
+                "resume_enabled": bool(probe.get("ok") and validator),
+                "remote_size": remote_size,
+                "reasons": probe.get("reasons", [])
+            })
+        except Exception:
+            pass
+
+        segment_count, segment_min_bytes = self._get_segmented_download_policy()
+        segmentable = should_use_segmented_download(probe, segment_count, segment_min_bytes)
+        if segmentable and not validator:
+            # 没有 ETag/Last-Modified 时各区间无法用 If-Range 确认来自同一份文件，拼起来可能是新旧混合的内容
+            self.log(f"[{context_name}] 远端未提供 ETag/Last-Modified，跳过分段下载，改用单流下载")
+        if validator and segmentable:
+            state = new_part_state(c_url, remote_size, probe.get("etag"), probe.get("last_modified"), plan_segments(remote_size, segment_count))
+            preallocate_file(part_path(dest_path), remote_size)
+            save_part_state(dest_path, state)
+            self._download_segmented(
+                c_url,
+                dest_path,
+                state,
+                progress_cb=progress_cb,
+                connect_timeout=connect_timeout,
+                stall_timeout=stall_timeout,
+                log_context=context_name,
+                digest=digest,
+                abort_event=abort_event
+            )
+            return
+
+        if probe.get("ok") and validator:
+            save_part_state(dest_path, new_part_state(c_url, remote_size, probe.get("etag"), probe.get("last_modified")))
+        else:
+            reason_items = probe.get('reasons', [])
+            reasons = '; '.join([f"{r.get('code', 'UNKNOWN')}({r.get('msg', '')})" for r in reason_items]) or 'NO_REMOTE_VALIDATOR'
+            self.log(f"[{context_name}] 远端不支持续传，本次失败后需重新下载: {reasons}")
+        self._download_with_cancel(
+            c_url,
+            part_path(dest_path),
+            progress_cb=progress_cb,
+            connect_timeout=connect_timeout,
+            stall_timeout=stall_timeout,
+            digest=digest,
+            abort_event=abort_event
+        )
 
-    def _download_with_candidates_resumable(self, candidates, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15, log_context=None):
+    def _download_with_candidates_resumable(self, candidates, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15, log_context=None, digest=None, abort_event=None, finalize=True):
+        """
+        依次尝试各下载源，能续传时续传。finalize=False 时下载完成后数据留在 dest_path 的 .part 里，
+        由调用方决定是否转正；此时失败也只清理 dest_path 自己的 .part，不碰 dest_path 本身。
+        abort_event 被置位时立即抛 DownloadAbortedError，不再换下一个下载源。
+        """
         last_error = None
         context_name = log_context or os.path.basename(dest_path)
 
         for idx, c_url in enumerate(candidates, start=1):
             if self.cancel_event.is_set():
                 raise Exception("Update cancelled by user")
+            if abort_event is not None and abort_event.is_set():
+                raise DownloadAbortedError("Download aborted")
 
             try:
-                self.log(f"[{context_name}] 评估续传能力 {idx}/{len(candidates)}: {c_url}")
-                self.log(f"[{context_name}] 当前下载地址: {c_url}")
-                decision = self._evaluate_resume_for_path(c_url, dest_path)
-
-                try:
-                    self._add_activity_log("resume_probe_result", {
-                        "context": context_name,
-                        "url": c_url,
-                        "resume_enabled": decision.get("resume_enabled"),
-                        "local_size": decision.get("local_size"),
-                        "remote_size": decision.get("remote_size"),
-                        "reasons": decision.get("reasons", [])
-                    })
-                except Exception:
-                    pass
-
-                if decision.get("resume_enabled"):
-                    self.log(f"[{context_name}] 续传已启用: local={decision['local_size']} remote={decision['remote_size']}")
-                    self._download_with_resume(
+                self.log(f"[{context_name}] 当前下载地址 {idx}/{len(candidates)}: {c_url}")
+                resumed = False
+                state = load_part_state(dest_path)
+                if state:
+                    # 有带校验值的分片：直接发 If-Range 条件请求，跳过 HEAD + Range 探测
+                    if state.get("url") != c_url:
+                        self.log(f"[{context_name}] 分片来自其他下载源，使用 If-Range 校验后续传: {state.get('url')}")
+                    self.log(f"[{context_name}] 条件续传: 已有 {os.path.getsize(part_path(dest_path))}/{state['size']} 字节")
+                    try:
+                        if state.get("mode") == "segmented":
+                            self._download_segmented(
+                                c_url,
+                                dest_path,
+                                state,
+                                progress_cb=progress_cb,
+                                connect_timeout=connect_timeout,
+                                stall_timeout=stall_timeout,
+                                log_context=context_name,
+                                digest=digest,
+                                conditional=True,
+                                abort_event=abort_event
+                            )
+                        else:
+                            self._download_with_resume(
+                                c_url,
+                                dest_path,
+                                state,
+                                progress_cb=progress_cb,
+                                connect_timeout=connect_timeout,
+                                stall_timeout=stall_timeout,
+                                digest=digest,
+                                abort_event=abort_event
+                            )
+                        resumed = True
+                    except StaleResumeError:
+                        self.log(f"[{context_name}] 远端文件已变化，丢弃旧分片重新下载")
+
+                if not resumed:
+                    self._start_fresh_download(
                         c_url,
                         dest_path,
-                        decision['local_size'],
-                        decision['remote_size'],
                         progress_cb=progress_cb,
                         connect_timeout=connect_timeout,
-                        stall_timeout=stall_timeout
+                        stall_timeout=stall_timeout,
+                        log_context=context_name,
+                        digest=digest,
+                        abort_event=abort_event
                     )
-                    return c_url
-
-                reason_items = decision.get('reasons', [])
-                reasons = '; '.join([f"{r.get('code', 'UNKNOWN')}({r.get('msg', '')})" for r in reason_items]) or 'UNKNOWN'
-                self.log(f"[{context_name}] 续传不可用，回退全量下载: {reasons}")
-                self._download_with_cancel(
-                    c_url,
-                    dest_path,
-                    progress_cb=progress_cb,
-                    connect_timeout=connect_timeout,
-                    stall_timeout=stall_timeout
-                )
+
+                if finalize:
+                    finalize_part(dest_path)
                 return c_url
 
             except Exception as e:
                 if self.cancel_event.is_set() or "cancelled" in str(e).lower():
                     raise
+                if isinstance(e, DownloadAbortedError) or (abort_event is not None and abort_event.is_set()):
+                    raise
                 last_error = e
                 self.log(f"[{context_name}] 下载失败: {c_url} -> {e}")
                 try:
@@ -1302,7 +1650,10 @@ class Api:
                     })
                 except Exception:
                     pass
-                if os.path.exists(dest_path):
+                # 带校验值的分片保留给下一个下载源续传，其余情况清理残留
+                if not load_part_state(dest_path):
+                    discard_part(dest_path)
+                if finalize and os.path.exists(dest_path):
                     try:
                         os.remove(dest_path)
                     except Exception:
@@ -1313,6 +1664,136 @@ class Api:
             raise last_error
         raise Exception("没有可用的下载源")
 
+    def _get_hedge_policy(self):
+        cfg = self.cfg_mgr.config
+        try:
+            delay = max(1.0, float(cfg.get("hedge_delay_seconds", 4)))
+        except Exception:
+            delay = 4.0
+        try:
+            min_kbps = max(0.0, float(cfg.get("hedge_min_kbps", 256)))
+        except Exception:
+            min_kbps = 256.0
+        return bool(cfg.get("hedged_downloads", True)), delay, min_kbps * 1024
+
+    def _download_with_hedging(self, candidates, dest_path, progress_cb=None, connect_timeout=8, stall_timeout=15, log_context=None, digest=None):
+        """
+        主下载源在 hedge_delay_seconds 后吞吐仍低于 hedge_min_kbps 时，并行启动下一个下载源，先完成者胜出。
+        两路各自只写自己的 .part（主路 dest_path.part，备用路 dest_path.hedge.part），都不自行转正；
+        决出胜者后叫停另一路并等它退出，再由这里把胜者的分片落到 dest_path、清理落败一路的残留。
+        """
+        enabled, delay, min_bytes_per_second = self._get_hedge_policy()
+        if not enabled or len(candidates) < 2:
+            return self._download_with_candidates_resumable(
+                candidates,
+                dest_path,
+                progress_cb=progress_cb,
+                connect_timeout=connect_timeout,
+                stall_timeout=stall_timeout,
+                log_context=log_context,
+                digest=digest
+            )
+
+        context_name = log_context or os.path.basename(dest_path)
+        race_lock = threading.Lock()
+        race = {"winner": None, "reported": 0}
+        racers = {
+            "primary": {"path": dest_path, "candidates": list(candidates), "digest": digest.spawn() if digest is not None else StreamingDigest(), "bytes": 0, "baseline": None, "started_at": time.time(), "abort": threading.Event()},
+            "hedge": {"path": hedge_path(dest_path), "candidates": list(candidates[1:]) + list(candidates[:1]), "digest": digest.spawn() if digest is not None else StreamingDigest(), "bytes": 0, "baseline": None, "started_at": None, "abort": threading.Event()},
+        }
+
+        def make_progress(name):
+            racer = racers[name]
+
+            def on_progress(block_num, block_size, total_size):
+                downloaded = block_num * block_size
+                with race_lock:
+                    if racer["baseline"] is None:
+                        racer["baseline"] = downloaded
+                    racer["bytes"] = downloaded - racer["baseline"]
+                    # 两路同时下载时进度取较快的一路，避免进度条来回跳
+                    best = max(downloaded, race["reported"])
+                    race["reported"] = best
+                if progress_cb:
+                    progress_cb(best, 1, total_size)
+            return on_progress
+
+        def run(name):
+            racer = racers[name]
+            return self._download_with_candidates_resumable(
+                racer["candidates"],
+                racer["path"],
+                progress_cb=make_progress(name),
+                connect_timeout=connect_timeout,
+                stall_timeout=stall_timeout,
+                log_context=f"{context_name}#{name}",
+                digest=racer["digest"],
+                abort_event=racer["abort"],
+                finalize=False
+            )
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        futures = {executor.submit(run, "primary"): "primary"}
+        started = ["primary"]
+        errors = {}
+        winner_url = None
+        try:
+            while futures:
+                done, _ = wait(list(futures), timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    try:
+                        url = future.result()
+                    except Exception as e:
+                        if self.cancel_event.is_set():
+                            raise
+                        if race["winner"] is None:
+                            errors[name] = e
+                        continue
+                    if race["winner"] is None:
+                        race["winner"] = name
+                        winner_url = url
+                if race["winner"]:
+                    break
+
+                primary = racers["primary"]
+                if racers["hedge"]["started_at"] is None and "primary" in futures.values():
+                    elapsed = time.time() - primary["started_at"]
+                    if should_start_hedge(elapsed, primary["bytes"], delay, min_bytes_per_second):
+                        speed_kb = primary["bytes"] / elapsed / 1024 if elapsed > 0 else 0
+                        self.log(f"[{context_name}] 主下载源 {elapsed:.0f}s 内仅 {speed_kb:.0f} KB/s，并行启动备用下载源: {racers['hedge']['candidates'][0]}")
+                        racers["hedge"]["started_at"] = time.time()
+                        started.append("hedge")
+                        futures[executor.submit(run, "hedge")] = "hedge"
+        finally:
+            # 叫停还在跑的一路并等它真正退出（读循环、限速等待和换源前都会检查叫停标记），
+            # 之后它不会再打开或改动任何文件，下面的转正和清理才是安全的
+            for name, racer in racers.items():
+                if name != race["winner"]:
+                    racer["abort"].set()
+            wait(list(futures))
+            executor.shutdown(wait=True)
+
+        winner = race["winner"]
+        if winner not in racers:
+            if self.cancel_event.is_set():
+                raise Exception("Update cancelled by user")
+            raise errors.get("primary") or errors.get("hedge") or Exception("没有可用的下载源")
+
+        loser = "hedge" if winner == "primary" else "primary"
+        if loser in started:
+            try:
+                discard_part(racers[loser]["path"])
+            except OSError as e:
+                log_warning(f"[{context_name}] 清理落败一路的分片失败: {e}")
+        finalize_part(racers[winner]["path"])
+        if winner == "hedge":
+            self.log(f"[{context_name}] 备用下载源先完成: {winner_url}")
+            os.replace(hedge_path(dest_path), dest_path)
+        if digest is not None:
+            digest.adopt(racers[winner]["digest"])
+        return winner_url
+
     def min_window(self):
         if global_window: global_window.minimize()
     def max_window(self):
@@ -2260,35 +2741,437 @@ class Api:
         except Exception:
             return False, ""
 
+    def _verify_download_digest(self, file_path, expected_hash, digest=None):
+        """优先使用下载过程中流式计算的摘要，摘要未覆盖整个文件时回退为完整读盘校验"""
+        if digest is not None and digest.covers_file(file_path):
+            actual = digest.hexdigest()
+            return actual == expected_hash.lower(), actual
+        return self._verify_sha256(file_path, expected_hash)
+
+    def _new_download_digest(self, item):
+        """manifest 条目带有效的 chunks 块表时返回逐块校验的摘要，否则返回普通流式摘要"""
+        chunks = normalize_chunk_table(item.get('chunks'), item.get('size'))
+        return ChunkedStreamingDigest(chunks) if chunks else StreamingDigest()
+
+    def _repair_download_chunks(self, item, file_path, candidates, digest=None, bad_source=None, cancel_check=None, log_context=None, on_bytes=None):
+        """
+        整文件 SHA256 不符时按 chunks 块表只重取损坏或缺失的块（HTTP Range），修好且整文件校验通过时返回 True。
+        没有块表、损坏超过一半或任何块取不回来时返回 False，由调用方退回整文件重下。on_bytes(字节数) 在每次读到数据后调用。
+        """
+        if isinstance(digest, ChunkedStreamingDigest):
+            chunks = digest.chunks
+        else:
+            chunks = normalize_chunk_table(item.get('chunks'), item.get('size'))
+        if not chunks or not item.get('sha256'):
+            return False
+        cancel_check = cancel_check or self.cancel_event.is_set
+        context_name = log_context or item.get('name') or os.path.basename(file_path)
+
+        if isinstance(digest, ChunkedStreamingDigest) and digest.covers_file(file_path):
+            damaged = digest.damaged_chunks()
+        else:
+            damaged = find_damaged_chunks(file_path, chunks)
+        total_size = chunk_table_size(chunks)
+        damaged_bytes = sum(chunk['size'] for chunk in damaged)
+        try:
+            received_size = os.path.getsize(file_path)
+        except OSError:
+            received_size = 0
+        # 响应体被截断时缺的尾部照常补齐；收到了但内容不对的块超过一半时说明整个响应都不可信
+        corrupted_bytes = sum(chunk['size'] for chunk in damaged if chunk['offset'] + chunk['size'] <= received_size)
+        if corrupted_bytes * 2 > total_size:
+            log_warning(f"[{context_name}] 损坏块过多 ({corrupted_bytes}/{total_size} 字节)，改为整文件重新下载")
+            return False
+
+        # 坏数据来自刚才胜出的下载源，先从其他源取
+        if bad_source in candidates and len(candidates) > 1:
+            candidates = [c for c in candidates if c != bad_source] + [bad_source]
+        self.log(f"[{context_name}] 整文件校验失败，按块修复 {len(damaged)}/{len(chunks)} 块 ({damaged_bytes / 1024:.0f} KB)")
+        try:
+            preallocate_file(file_path, total_size)
+            for run in chunk_runs(damaged):
+                if cancel_check():
+                    raise Exception("Update cancelled by user")
+                if not self._fetch_verified_chunks(candidates, file_path, run, cancel_check, on_bytes=on_bytes):
+                    log_warning(f"[{context_name}] 块 {run[0]['offset']}+{sum(c['size'] for c in run)} 在所有下载源均校验失败")
+                    return False
+        except Exception as e:
+            if cancel_check() or "cancelled" in str(e).lower():
+                raise
+            log_warning(f"[{context_name}] 按块修复失败: {e}")
+            return False
+
+        match, actual = self._verify_sha256(file_path, item['sha256'])
+        if match:
+            log_info(f"[{context_name}] 按块修复完成，重新下载 {damaged_bytes} 字节")
+        else:
+            log_warning(f"[{context_name}] 按块修复后整文件仍不匹配: {actual[:16]}")
+        return match
+
+    def _fetch_verified_chunks(self, candidates, file_path, chunks, cancel_check, connect_timeout=8, on_bytes=None):
+        """用一次 Range 请求取回首尾相接的一组块并写到各自的偏移处，每块哈希都匹配时返回 True，否则换下一个下载源"""
+        start = chunks[0]['offset']
+        end = chunks[-1]['offset'] + chunks[-1]['size'] - 1
+        for url in candidates:
+            req = urllib.request.Request(url, headers={
+                'User-Agent': 'TCYClientUpdater/1.0',
+                'Range': f'bytes={start}-{end}'
+            })
+            verified = 0
+            try:
+                with self._urlopen_with_policy(req, timeout=connect_timeout, url=url) as resp:
+                    status = getattr(resp, 'status', None)
+                    content_range = parse_content_range(resp.headers.get('Content-Range', ''))
+                    if status != 206 or not content_range or content_range[0] != start:
+                        log_warning(f"块请求被拒绝: {url}, status={status}, content-range={resp.headers.get('Content-Range', '')}")
+                        continue
+                    with open(file_path, 'r+b') as f:
+                        f.seek(start)
+                        for chunk in chunks:
+                            sha256 = hashlib.sha256()
+                            received = 0
+                            while received < chunk['size']:
+                                if cancel_check():
+                                    raise Exception("Update cancelled by user")
+                                data = resp.read(min(DOWNLOAD_BLOCK_SIZE, chunk['size'] - received))
+                                if not data:
+                                    break
+                                f.write(data)
+                                sha256.update(data)
+                                received += len(data)
+                                self.download_scheduler.throttle(len(data), cancel_check=cancel_check)
+                                if on_bytes:
+                                    on_bytes(len(data))
+                            if received != chunk['size'] or sha256.hexdigest() != chunk['sha256']:
+                                break
+                            verified += 1
+            except Exception as e:
+                if cancel_check() or "cancelled" in str(e).lower():
+                    raise
+                log_warning(f"块下载失败: {url}, {start}-{end}: {e}")
+                continue
+            if verified == len(chunks):
+                return True
+            log_warning(f"块校验失败: {url}, {start}-{end}, 第 {verified + 1}/{len(chunks)} 块不匹配")
+        return False
+
+    def _collect_local_chunks(self):
+        """从块索引找出本地仍然完好的文件（哈希索引确认未变化的安装位置，或本地文件库对象），返回可复用块的位置"""
+        store = self._get_content_store()
+        sources = []
+        for sha256, chunks, paths in self.chunk_index.entries():
+            path = next((p for p in paths if self.file_hash_cache.lookup(p) == sha256), None)
+            if path is None and store is not None:
+                path = store.lookup(sha256)
+            if path:
+                sources.append((path, chunks))
+        return locate_local_chunks(sources)
+
+    def _plan_local_chunk_assembly(self, item, located):
+        """条目带块表且本地能找到其中一部分块时返回拼装计划，否则返回 None"""
+        if not item.get('sha256'):
+            return None
+        chunks = normalize_chunk_table(item.get('chunks'), item.get('size'))
+        if not chunks:
+            return None
+        plan = plan_chunk_assembly(chunks, located)
+        if not plan['reused_bytes']:
+            return None
+        plan['chunks'] = chunks
+        return plan
+
+    def _stage_from_local_chunks(self, items, source_type, on_hit=None):
+        """条目带块表时，用本地已有文件中的相同块在暂存区拼出新文件，只下载缺少的块，返回仍需完整下载的条目"""
+        if not self.cfg_mgr.config.get("chunk_dedup_enabled", True):
+            return list(items)
+        if not any(item.get('chunks') for item in items):
+            return list(items)
+        located = self._collect_local_chunks()
+        remaining = []
+        assemblable = []
+        for item in items:
+            plan = self._plan_local_chunk_assembly(item, located) if located else None
+            if plan:
+                assemblable.append((item, plan))
+            else:
+                remaining.append(item)
+        if not assemblable:
+            return remaining
+
+        def assemble_one(entry):
+            item, plan = entry
+            return self._assemble_from_local_chunks(item, plan, source_type)
+
+        handled = set()
+        scheduled = self.download_scheduler.run(
+            assemblable,
+            assemble_one,
+            size_of=lambda entry: entry[1]['missing_bytes'],
+            cancel_check=self.cancel_event.is_set
+        )
+        for entry, future in scheduled:
+            item = entry[0]
+            handled.add(id(item))
+            try:
+                future.result()
+            except Exception as e:
+                remaining.append(item)
+                if not self.cancel_event.is_set():
+                    self.log(f"按块拼装失败，改为完整下载: {item['name']} - {e}")
+                    log_warning(f"按块拼装失败: {item['name']} - {e}")
+                continue
+            if on_hit:
+                on_hit(item)
+        remaining.extend(entry[0] for entry in assemblable if id(entry[0]) not in handled)
+        return remaining
+
+    def _assemble_from_local_chunks(self, item, plan, source_type):
+        """按计划复制本地块、下载缺少的块，拼好后用条目的 sha256 校验整个文件"""
+        staging_path = item['_staging_abs']
+        os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+        missing = list(plan['missing'])
+        try:
+            preallocate_file(staging_path, chunk_table_size(plan['chunks']))
+            with open(staging_path, 'r+b') as out:
+                for chunk, src_path, src_offset in plan['local']:
+                    if self.cancel_event.is_set():
+                        raise Exception("Update cancelled by user")
+                    try:
+                        copied = copy_verified_chunk(src_path, src_offset, out, chunk)
+                    except OSError:
+                        copied = False
+                    if not copied:
+                        # 来源文件在规划之后被改动，这一块改为下载
+                        missing.append(chunk)
+            fetched_bytes = sum(chunk['size'] for chunk in missing)
+            if missing:
+                candidates = self._build_download_candidates(item['url'], source_type)
+                for run in chunk_runs(missing):
+                    if self.cancel_event.is_set():
+                        raise Exception("Update cancelled by user")
+                    if not self._fetch_verified_chunks(candidates, staging_path, run, self.cancel_event.is_set):
+                        raise Exception(f"块 {run[0]['offset']}+{sum(c['size'] for c in run)} 下载失败")
+            match, actual = self._verify_sha256(staging_path, item['sha256'])
+            if not match:
+                raise Exception(f"拼装结果 SHA256 不匹配: {actual[:16]}")
+        except BaseException:
+            try:
+                os.remove(staging_path)
+            except OSError:
+                pass
+            raise
+        self._add_to_content_store(item, staging_path)
+        total = chunk_table_size(plan['chunks'])
+        self.log(f"按块拼装: {item['name']} (本地复用 {(total - fetched_bytes) / 1024 / 1024:.1f} MB，下载 {fetched_bytes / 1024:.0f} KB)")
+
+    def _record_installed_file(self, item, target_path):
+        """记下刚装入目标位置的外部文件：哈希写进哈希索引，带块表的再写进块索引供以后按块复用"""
+        if not item.get('sha256'):
+            return
+        self.file_hash_cache.record(target_path, item['sha256'])
+        chunks = normalize_chunk_table(item.get('chunks'), item.get('size'))
+        if chunks:
+            self.chunk_index.record(item['sha256'], chunks, target_path)
+
+    def _flush_local_indexes(self):
+        """一次更新/修复结束时把哈希索引、块索引和本地文件库索引的改动写盘"""
+        self.file_hash_cache.flush()
+        self.chunk_index.flush()
+        store = getattr(self, "_content_store", None)
+        if store is not None:
+            store.flush()
+
+    def _get_content_store(self):
+        """返回按 sha256 寻址的本地文件库；未启用时返回 None"""
+        cfg = self.cfg_mgr.config
+        if not cfg.get("content_store_enabled", True):
+            return None
+        root = str(cfg.get("content_store_path", "") or "").strip() or os.path.join(self.game_root, STORE_DIR_NAME)
+        try:
+            budget = max(0, int(cfg.get("content_store_budget_mb", 4096))) * 1024 * 1024
+        except Exception:
+            budget = 4096 * 1024 * 1024
+        store = getattr(self, "_content_store", None)
+        if store is None or store.root != root:
+            store = ContentStore(root, budget)
+            self._content_store = store
+        store.budget_bytes = budget
+        return store
+
+    def _stage_from_content_store(self, items, on_hit=None):
+        """下载前先查本地文件库，命中的文件直接链接/复制到暂存区，返回仍需联网下载的条目"""
+        store = self._get_content_store()
+        if store is None:
+            return list(items)
+        remaining = []
+        for item in items:
+            mode = None
+            if item.get('sha256'):
+                try:
+                    mode = store.materialize(item['sha256'], item['_staging_abs'])
+                except Exception as e:
+                    log_warning(f"本地文件库取用失败: {item['name']} - {e}")
+            if mode:
+                self.log(f"本地文件库命中({mode}): {item['name']}")
+                if on_hit:
+                    on_hit(item)
+            else:
+                remaining.append(item)
+        return remaining
+
+    def _add_to_content_store(self, item, staging_path):
+        store = self._get_content_store()
+        if store is None or not item.get('sha256'):
+            return
+        try:
+            store.add(item['sha256'], staging_path)
+        except Exception as e:
+            log_warning(f"写入本地文件库失败: {item['name']} - {e}")
+
+    def _stage_from_delta_patches(self, items, source_type, on_hit=None):
+        """manifest 条目带 patches 且本地有对应基准版本时，只下载差分并在暂存区还原，返回仍需完整下载的条目"""
+        if not self.cfg_mgr.config.get("delta_patches_enabled", True):
+            return list(items)
+        store = self._get_content_store()
+        remaining = []
+        patchable = []
+        for item in items:
+            patches = item.get('patches')
+            if not item.get('sha256') or not isinstance(patches, list) or not patches:
+                remaining.append(item)
+                continue
+            bases = {}
+            if item.get('_local_sha256'):
+                bases[item['_local_sha256']] = item['_target_abs']
+            for patch in patches:
+                if not isinstance(patch, dict):
+                    continue
+                base_sha = str(patch.get('base_sha256', '')).lower()
+                if not base_sha or base_sha in bases:
+                    continue
+                if store is not None:
+                    obj_path = store.lookup(base_sha)
+                    if obj_path:
+                        bases[base_sha] = obj_path
+                        continue
+                # 文件改名的场景（如 mod-1.1.jar -> mod-1.2.jar）由补丁的 base_path 指明旧文件位置
+                if patch.get('base_path'):
+                    try:
+                        base_path = resolve_relative_path(self.game_root, patch['base_path'])
+                    except ValueError:
+                        continue
+                    if os.path.isfile(base_path) and self._verify_local_sha256(base_path, base_sha)[0]:
+                        bases[base_sha] = base_path
+            patch = select_patch(patches, bases)
+            if patch:
+                patchable.append((item, patch, bases[str(patch['base_sha256']).lower()]))
+            else:
+                remaining.append(item)
+
+        if not patchable:
+            return remaining
+
+        def apply_one(entry):
+            item, patch, base_path = entry
+            return self._apply_delta_patch(item, patch, base_path, source_type)
+
+        handled = set()
+        scheduled = self.download_scheduler.run(patchable, apply_one, cancel_check=self.cancel_event.is_set)
+        for entry, future in scheduled:
+            item = entry[0]
+            handled.add(id(item))
+            try:
+                future.result()
+            except Exception as e:
+                remaining.append(item)
+                if not self.cancel_event.is_set():
+                    self.log(f"差分更新失败，改为完整下载: {item['name']} - {e}")
+                    log_warning(f"差分更新失败: {item['name']} - {e}")
+                continue
+            if on_hit:
+                on_hit(item)
+        # 取消后未派发的条目原样交回，由后续下载阶段统一按取消处理
+        remaining.extend(entry[0] for entry in patchable if id(entry[0]) not in handled)
+        return remaining
+
+    def _apply_delta_patch(self, item, patch, base_path, source_type):
+        """下载单个差分文件，应用到基准文件得到暂存文件，并用目标 sha256 校验结果"""
+        staging_path = item['_staging_abs']
+        patch_path = f"{staging_path}.delta"
+        os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+        digest = StreamingDigest()
+        try:
+            self._download_with_hedging(
+                self._build_download_candidates(patch['url'], source_type),
+                patch_path,
+                connect_timeout=8,
+                stall_timeout=12,
+                log_context=f"delta:{item['name']}",
+                digest=digest
+            )
+            if patch.get('sha256'):
+                match, _ = self._verify_download_digest(patch_path, patch['sha256'], digest)
+                if not match:
+                    raise Exception("差分文件 SHA256 校验失败")
+            actual = apply_delta(base_path, patch_path, staging_path)
+            if actual != item['sha256'].lower():
+                raise Exception("差分还原结果与目标 SHA256 不符")
+            self.log(f"差分更新: {item['name']} (下载 {digest.size / 1024:.0f} KB)")
+        except Exception:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+        finally:
+            if os.path.exists(patch_path):
+                os.remove(patch_path)
+        self._add_to_content_store(item, staging_path)
+        return True
+
+    def _trim_content_store(self):
+        store = self._get_content_store()
+        if store is None:
+            return
+        try:
+            evicted = store.enforce_budget()
+            if evicted:
+                self.log(f"本地文件库已淘汰 {evicted} 个最久未用的文件")
+        except Exception as e:
+            log_warning(f"本地文件库清理失败: {e}")
+
     def _get_backup_root(self):
         """获取备份根目录"""
         return os.path.join(self._get_game_version_dir(), ".update_backups")
 
     def _create_backup(self, version, affected_paths):
-        """备份受影响的文件。返回 backup_dir 路径，失败返回 None"""
+        """
+        备份受影响的文件。返回 backup_dir 路径，失败返回 None
+        备份优先用硬链接（同盘只写目录项，不复制数据），文件系统不支持时退回复制。
+        因此更新流程写入游戏目录时必须整体替换文件（copy_replacing/move_replacing），不能原地改写已有文件。
+        """
         backup_root = self._get_backup_root()
         backup_dir = os.path.join(backup_root, f"backup_{version}_{int(time.time())}")
         os.makedirs(backup_dir, exist_ok=True)
         game_dir = self._get_game_version_dir()
         backed_up = []
-        for abs_path in affected_paths:
-            if os.path.exists(abs_path):
+        copied = 0
+        for abs_path in dict.fromkeys(affected_paths):
+            if os.path.isfile(abs_path):
                 try:
                     rel = os.path.relpath(abs_path, game_dir)
                 except ValueError:
                     rel = os.path.basename(abs_path)
                 dest = os.path.join(backup_dir, rel)
-                os.makedirs(os.path.dirname(dest), exist_ok=True)
                 try:
-                    shutil.copy2(abs_path, dest)
+                    if link_or_copy(abs_path, dest) == "copy":
+                        copied += 1
                     backed_up.append(rel)
                 except Exception as e:
                     log_warning(f"备份文件失败 {rel}: {e}")
         manifest = {"version": version, "timestamp": time.time(), "files": backed_up}
         with open(os.path.join(backup_dir, "_backup_manifest.json"), 'w', encoding='utf-8') as f:
             json.dump(manifest, f, indent=2, ensure_ascii=False)
-        self.log(f"已备份 {len(backed_up)} 个文件到 {os.path.basename(backup_dir)}")
-        log_info(f"备份创建完成: {backup_dir}, 文件数: {len(backed_up)}")
+        self.log(f"已备份 {len(backed_up)} 个文件到 {os.path.basename(backup_dir)}" + (f"（其中 {copied} 个无法硬链接，已复制）" if copied else ""))
+        log_info(f"备份创建完成: {backup_dir}, 文件数: {len(backed_up)}, 复制: {copied}")
         self._cleanup_old_backups()
         return backup_dir
 
@@ -2320,9 +3203,9 @@ class Api:
                 log_error(f"跳过非法回滚路径 {rel_path}: {e}")
                 continue
             if os.path.exists(src):
-                os.makedirs(os.path.dirname(dest), exist_ok=True)
                 try:
-                    shutil.copy2(src, dest)
+                    # 硬链接回原位置并整体替换，备份本身保持完整，可以再次回滚
+                    link_replacing(src, dest)
                     restored += 1
                 except Exception as e:
                     log_error(f"回滚文件失败 {rel_path}: {e}")
@@ -2380,60 +3263,118 @@ class Api:
         return success
 
     def test_mirror_speeds(self):
-        """测试所有镜像延迟，后台线程执行"""
+        """测试所有镜像的首包延迟和持续吞吐，后台线程执行"""
         threading.Thread(target=self._test_mirrors_thread).start()
 
-    def _probe_single_mirror_speed(self, mirror, test_url_path, label_by_url, insecure_hosts):
+    def _resolve_mirror_benchmark_url(self):
+        """测速目标：优先用配置的地址，其次用最近一个版本的 GitHub 更新包，都没有时退回 latest.json"""
+        configured = str(self.cfg_mgr.config.get("mirror_benchmark_url", "") or "").strip()
+        if configured:
+            return configured
+        history = self.history_index.history()
+        if history:
+            for item in sort_versioned_items(history, reverse=True):
+                dl_urls = item.get("download_urls") if isinstance(item, dict) else None
+                if not isinstance(dl_urls, dict):
+                    continue
+                for key in ("global", "cn"):
+                    url = dl_urls.get(key)
+                    if isinstance(url, str) and "https://github.com/" in url:
+                        return url[url.index("https://github.com/"):]
+        return GITHUB_LATEST_JSON_URL
+
+    def _probe_mirror_latency(self, mirror, test_url_path, label_by_url, insecure_hosts):
+        """在新建的连接上取测速目标的第一个字节，延迟包含 TCP/TLS 握手，与一次新下载的首包等待一致"""
         test_url = mirror + test_url_path
         ssl_mode = ssl_mode_for_url(test_url, insecure_hosts=insecure_hosts)
+        result = {
+            "mirror": mirror,
+            "label": label_by_url.get(mirror, mirror),
+            "tested_url": test_url,
+            "method": "GET",
+            "latency": -1,
+            "throughput_bps": 0,
+            "bytes": 0,
+            "ok": False,
+            "ssl_mode": ssl_mode,
+        }
         try:
             start = time.time()
             req = urllib.request.Request(
                 test_url,
-                method='HEAD',
-                headers={'User-Agent': 'TCYClientUpdater/1.0'}
+                headers={
+                    'User-Agent': 'TCYClientUpdater/1.0',
+                    'Range': 'bytes=0-0',
+                    'Accept-Encoding': 'identity',
+                }
             )
-            with self._urlopen_with_policy(req, timeout=5, url=test_url) as resp:
+            with self._urlopen_with_policy(req, timeout=5, url=test_url, pooled=False) as resp:
+                resp.read(1)
                 latency = int((time.time() - start) * 1000)
-                result = {
-                    "mirror": mirror,
-                    "label": label_by_url.get(mirror, mirror),
-                    "tested_url": test_url,
-                    "method": "HEAD",
-                    "latency": latency,
-                    "ok": True,
-                    "ssl_mode": ssl_mode,
-                    "status_class": classify_mirror_latency(latency, True),
-                }
-                self.log(f"[测速] {mirror} -> {latency}ms")
-                return result
+            result.update({"latency": latency, "ok": True})
+            result["status_class"] = classify_mirror_latency(latency, True)
         except Exception as e:
             self.log(f"[测速] {mirror} -> 超时/失败")
-            return {
-                "mirror": mirror,
-                "label": label_by_url.get(mirror, mirror),
-                "tested_url": test_url,
-                "method": "HEAD",
-                "latency": -1,
-                "ok": False,
-                "ssl_mode": ssl_mode,
-                "status_class": classify_mirror_latency(-1, False),
-                "error": str(e),
-            }
+            result["status_class"] = classify_mirror_latency(-1, False)
+            result["error"] = str(e)
+        return result
+
+    def _measure_mirror_throughput(self, result):
+        """
+        在新建的连接上下载固定大小的区间测持续吞吐。测速时各镜像依次调用、独占用户的链路，
+        测出的才是单独拉一个大更新时能拿到的速度；区间中途断开记为失败。
+        """
+        mirror = result["mirror"]
+        test_url = result["tested_url"]
+        try:
+            req = urllib.request.Request(
+                test_url,
+                headers={
+                    'User-Agent': 'TCYClientUpdater/1.0',
+                    'Range': f'bytes=0-{BENCHMARK_RANGE_BYTES - 1}',
+                    'Accept-Encoding': 'identity',
+                }
+            )
+            with self._urlopen_with_policy(req, timeout=5, url=test_url, pooled=False) as resp:
+                first_byte_ts = time.time()
+                received = 0
+                hit_time_limit = False
+                # 在固定字节数或时间上限内持续读取，用持续吞吐而不是单次握手评估镜像
+                while received < BENCHMARK_RANGE_BYTES:
+                    if time.time() - first_byte_ts >= BENCHMARK_TIME_LIMIT_SECONDS:
+                        hit_time_limit = True
+                        break
+                    chunk = resp.read(min(DOWNLOAD_BLOCK_SIZE, BENCHMARK_RANGE_BYTES - received))
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                elapsed = max(time.time() - first_byte_ts, 0.001)
+            # 目标文件太小时样本只反映握手开销，不计入吞吐
+            sampled = hit_time_limit or received >= MIN_THROUGHPUT_SAMPLE_BYTES
+            throughput = received / elapsed if sampled and received > 0 else 0
+            result.update({"throughput_bps": int(throughput), "bytes": received})
+            speed_note = f", {throughput / 1024 / 1024:.2f} MB/s" if throughput else ""
+            self.log(f"[测速] {mirror} -> {result['latency']}ms{speed_note}")
+        except Exception as e:
+            self.log(f"[测速] {mirror} -> {result['latency']}ms，吞吐测试中断")
+            result.update({"ok": False, "error": str(e)})
+            result["status_class"] = classify_mirror_latency(-1, False)
+        return result
 
     def _test_mirrors_thread(self):
         try:
             self.log("正在测试镜像速度...")
-            test_url_path = "https://github.com/KanameMadoka520/TCY-Client-Updater/releases/download/versions/latest.json"
+            test_url_path = self._resolve_mirror_benchmark_url()
+            self.log(f"镜像测速目标: {test_url_path}")
             results = []
             label_by_url = {item["url"]: item["label"] for item in MIRROR_CATALOG}
             insecure_hosts = self._get_insecure_ssl_hosts()
             max_workers = bounded_worker_count(len(MIRROR_LIST), MIRROR_SPEED_MAX_WORKERS)
-            self.log(f"镜像测速并发数: {max_workers}")
+            self.log(f"镜像延迟测试并发数: {max_workers}")
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
                 futures = {
                     executor.submit(
-                        self._probe_single_mirror_speed,
+                        self._probe_mirror_latency,
                         mirror,
                         test_url_path,
                         label_by_url,
@@ -2443,16 +3384,35 @@ class Api:
                 }
                 for future in as_completed(futures):
                     results.append(future.result())
-            results.sort(key=lambda r: r['latency'] if r['ok'] else 99999)
-            cache = {r['mirror']: r['latency'] for r in results}
-            self.cfg_mgr.save_config({"mirror_speed_cache": cache})
+
+            # 吞吐逐个镜像测：并发测时各镜像平分用户带宽，测出的不是单独下载一个大更新时的速度
+            reachable = sorted((r for r in results if r['ok']), key=lambda r: r['latency'])
+            self.log(f"依次测试 {len(reachable)} 个可用镜像的吞吐")
+            for r in reachable:
+                self._measure_mirror_throughput(r)
+
+            # 每个镜像的延迟/吞吐/失败率按指数加权累积，选择时看历史而不是单次样本
+            history = prune_mirror_history(self.cfg_mgr.config.get("mirror_history", {}), MIRROR_LIST)
+            for r in results:
+                update_mirror_history(history, r['mirror'], r['ok'], latency_ms=r['latency'], throughput_bps=r['throughput_bps'])
+            ranking = rank_mirrors(history, MIRROR_LIST)
+            for r in results:
+                estimate = estimate_transfer_seconds(history.get(r['mirror']))
+                r['est_seconds_per_gb'] = int(estimate) if estimate is not None else None
+            order = {mirror: i for i, mirror in enumerate(ranking)}
+            results.sort(key=lambda r: (0 if r['ok'] else 1, order.get(r['mirror'], len(order))))
+            self.cfg_mgr.config.pop("mirror_speed_cache", None)
+            self.cfg_mgr.save_config({"mirror_history": history})
+
             if self.cfg_mgr.config.get("auto_select_mirror", True):
-                best = next((r for r in results if r['ok']), None)
+                best = next((m for m in ranking if history[m].get("last_ok")), None)
                 if best:
-                    self.cfg_mgr.save_config({"mirror_prefix": best['mirror']})
-                    self.log(f"自动选择最快镜像: {best['mirror']} ({best['latency']}ms)")
+                    self.cfg_mgr.save_config({"mirror_prefix": best})
+                    estimate = estimate_transfer_seconds(history[best])
+                    detail = f"约 {estimate:.0f} 秒/GB" if estimate is not None else f"{history[best]['latency_ms']:.0f}ms"
+                    self.log(f"自动选择最快镜像: {best} ({detail})")
                     if global_window:
-                        global_window.evaluate_js(f"applyMirrorPrefixFromBackend({json.dumps(best['mirror'])})")
+                        global_window.evaluate_js(f"applyMirrorPrefixFromBackend({json.dumps(best)})")
             selected_mirror = self.cfg_mgr.config.get("mirror_prefix", DEFAULT_MIRROR_PREFIX)
             for item in results:
                 item["selected"] = item.get("mirror") == selected_mirror
@@ -2464,6 +3424,8 @@ class Api:
             self.log(f"镜像测速异常: {e}")
             if global_window:
                 global_window.evaluate_js(f"setMirrorSpeedTestState('failed', {json.dumps('测速线程异常')})")
+        finally:
+            self._release_idle_connections()
 
     def select_update_zip(self):
         """打开文件选择对话框选择 zip 更新包"""
@@ -2526,15 +3488,82 @@ class Api:
                 with zf.open(item, 'r') as src, open(target_path, 'wb') as dst:
                     shutil.copyfileobj(src, dst)
 
-    def _prepare_update_manifest_paths(self, actions, external_files, temp_dir, staging_dir):
-        """Resolve manifest paths once and keep every operation under its base."""
-        if not isinstance(actions, list):
-            raise ValueError("manifest actions 必须是列表")
-        if not isinstance(external_files, list):
-            raise ValueError("manifest external_files 必须是列表")
-
-        prepared_actions = []
-        for action in actions:
+    def _stream_extract_zip_from_candidates(self, candidates, dest_dir, progress_cb=None, connect_timeout=8, stall_timeout=15, on_entry=None):
+        """边下载边解压 zip 到 dest_dir，不在磁盘上保留压缩包；结构不适合流式解压时抛出 ZipStreamUnsupported"""
+        last_error = None
+        for c_url in candidates:
+            if self.cancel_event.is_set():
+                raise Exception("Update cancelled by user")
+            extractor = StreamingZipExtractor(dest_dir, resolve_relative_path, on_entry=on_entry)
+            try:
+                req = urllib.request.Request(c_url, headers={'User-Agent': 'TCYClientUpdater/1.0', 'Accept-Encoding': 'identity'})
+                with self._urlopen_with_policy(req, timeout=connect_timeout, url=c_url) as resp:
+                    try:
+                        total_size = int(resp.headers.get('Content-Length') or -1)
+                    except Exception:
+                        total_size = -1
+                    downloaded = 0
+                    while True:
+                        if self.cancel_event.is_set():
+                            raise Exception("Update cancelled by user")
+                        try:
+                            chunk = resp.read(DOWNLOAD_BLOCK_SIZE)
+                        except socket.timeout:
+                            raise Exception("Download stall timeout")
+                        if not chunk:
+                            break
+                        extractor.feed(chunk)
+                        downloaded += len(chunk)
+                        self.download_scheduler.throttle(len(chunk), cancel_check=self.cancel_event.is_set)
+                        if progress_cb:
+                            progress_cb(downloaded, 1, total_size)
+                extractor.finish()
+                self.log(f"骨架包已流式解压: {c_url} ({len(extractor.local_names)} 个条目)")
+                return c_url
+            except (ZipStreamUnsupported, ValueError):
+                extractor.abort()
+                raise
+            except Exception as e:
+                extractor.abort()
+                if self.cancel_event.is_set() or "cancelled" in str(e).lower():
+                    raise
+                last_error = e
+                self.log(f"流式下载失败: {c_url} - {e}")
+                if os.path.exists(dest_dir):
+                    shutil.rmtree(dest_dir, ignore_errors=True)
+        raise last_error or Exception("没有可用的下载源")
+
+    def _prehash_manifest_targets(self, manifest_path):
+        """后台预先计算 manifest 中外部文件在本地已有版本的 SHA256，结果写入持久化哈希索引"""
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            targets = []
+            for item in manifest.get('external_files', []) or []:
+                if not isinstance(item, dict) or not item.get('sha256'):
+                    continue
+                try:
+                    targets.append(resolve_relative_path(self.game_root, item.get('path')))
+                except ValueError:
+                    continue
+            self.file_hash_cache.hash_many(targets, cancel_check=self.cancel_event.is_set)
+        except Exception as e:
+            log_warning(f"预先校验本地文件失败: {e}")
+
+    def _verify_local_sha256(self, file_path, expected_hash):
+        """校验本地已有文件，文件没变化时直接用哈希索引里的摘要，返回 (是否匹配, 实际hash)"""
+        actual = self.file_hash_cache.hash_file(file_path)
+        return bool(actual) and actual == expected_hash.lower(), actual
+
+    def _prepare_update_manifest_paths(self, actions, external_files, temp_dir, staging_dir):
+        """Resolve manifest paths once and keep every operation under its base."""
+        if not isinstance(actions, list):
+            raise ValueError("manifest actions 必须是列表")
+        if not isinstance(external_files, list):
+            raise ValueError("manifest external_files 必须是列表")
+
+        prepared_actions = []
+        for action in actions:
             if not isinstance(action, dict):
                 raise ValueError("manifest actions 条目必须是对象")
 
@@ -2565,31 +3594,33 @@ class Api:
 
         return prepared_actions, prepared_files
 
-    def _collect_action_affected_paths(self, actions):
-        """Collect existing files that should be backed up before applying actions."""
+    def _collect_action_affected_paths(self, actions, snapshot=None):
+        """Collect existing files that should be backed up before applying actions.
+
+        snapshot 是 UpdateFsSnapshot；应用阶段要传入同一个快照，备份与实际删除的文件集合才一致。
+        copy_folder/copy_file 只收集内容确实会变的已有文件，与源相同的文件既不复制也不备份。
+        """
+        if snapshot is None:
+            snapshot = self._build_update_fs_snapshot(actions)
         affected_paths = []
         for action in actions:
             if action.get('type') == 'delete_keyword':
-                t_folder = action.get('_folder_abs', '')
-                keyword = action.get('keyword', '')
-                if os.path.exists(t_folder) and keyword:
-                    for f in os.listdir(t_folder):
-                        if keyword.lower() in f.lower():
-                            affected_paths.append(os.path.join(t_folder, f))
+                affected_paths.extend(snapshot.keyword_matches(action.get('_folder_abs', ''), action.get('keyword', '')))
             elif action.get('type') == 'delete':
                 affected_paths.append(action.get('_path_abs', ''))
             elif action.get('type') == 'copy_folder':
-                dest = action.get('_dest_abs', '')
-                if os.path.exists(dest):
-                    for root, dirs, files in os.walk(dest):
-                        for f in files:
-                            affected_paths.append(os.path.join(root, f))
+                plan = snapshot.folder_copy_plan(action.get('_src_abs', ''), action.get('_dest_abs', ''))
+                if plan:
+                    affected_paths.extend(dest for _, dest, existed in plan['copy'] if existed)
             elif action.get('type') == 'copy_file':
                 dest = action.get('_dest_abs', '')
-                if os.path.exists(dest):
+                if os.path.exists(dest) and not snapshot.file_unchanged(dest):
                     affected_paths.append(dest)
         return affected_paths
 
+    def _build_update_fs_snapshot(self, actions):
+        return UpdateFsSnapshot.from_actions(actions, hash_dest=self.file_hash_cache.hash_file)
+
     def _get_update_action_label(self, action):
         action_type = action.get('type')
         if action_type == 'delete_keyword':
@@ -2602,21 +3633,20 @@ class Api:
             return "覆盖文件"
         return "处理更新"
 
-    def _apply_update_action(self, action):
+    def _apply_update_action(self, action, snapshot=None):
         """Apply one manifest action. copy_file is strict to catch incomplete packages."""
         action_type = action.get('type')
+        if snapshot is None:
+            snapshot = self._build_update_fs_snapshot([action])
         if action_type == 'delete_keyword':
-            t_folder = action.get('_folder_abs', '')
-            keyword = action.get('keyword', '')
-            if os.path.exists(t_folder) and keyword:
-                for f in os.listdir(t_folder):
-                    if keyword.lower() in f.lower():
-                        try:
-                            os.remove(os.path.join(t_folder, f))
-                            self.log(f"删: {f}")
-                            log_info(f"删除文件: {f}")
-                        except:
-                            pass
+            for path in snapshot.keyword_matches(action.get('_folder_abs', ''), action.get('keyword', '')):
+                f = os.path.basename(path)
+                try:
+                    os.remove(path)
+                    self.log(f"删: {f}")
+                    log_info(f"删除文件: {f}")
+                except:
+                    pass
         elif action_type == 'delete':
             try:
                 target = action.get('_path_abs', '')
@@ -2627,11 +3657,15 @@ class Api:
         elif action_type == 'copy_folder':
             src = action.get('_src_abs', '')
             dest = action.get('_dest_abs', '')
-            if os.path.exists(src):
+            plan = snapshot.folder_copy_plan(src, dest)
+            if plan:
                 try:
-                    shutil.copytree(src, dest, dirs_exist_ok=True)
-                    self.log(f"合并配置: {action.get('src')} -> {dest}")
-                    log_info(f"合并配置文件夹: {action.get('src')} -> {dest}")
+                    for dest_dir in plan['dirs']:
+                        os.makedirs(dest_dir, exist_ok=True)
+                    for src_file, dest_file, _ in plan['copy']:
+                        copy_replacing(src_file, dest_file)
+                    self.log(f"合并配置: {action.get('src')} -> {dest}（更新 {len(plan['copy'])} 个，内容相同跳过 {plan['unchanged']} 个）")
+                    log_info(f"合并配置文件夹: {action.get('src')} -> {dest}, 复制 {len(plan['copy'])}, 跳过 {plan['unchanged']}")
                 except Exception as e:
                     self.log(f"合并失败: {e}")
                     log_error(f"合并文件夹失败: {e}")
@@ -2642,11 +3676,219 @@ class Api:
                 raise FileNotFoundError(f"copy_file 源文件不存在: {action.get('src')}")
             if os.path.isdir(dest):
                 raise IsADirectoryError(f"copy_file 目标路径是目录: {action.get('dest')}")
-            os.makedirs(os.path.dirname(dest), exist_ok=True)
-            shutil.copy2(src, dest)
+            if snapshot.file_unchanged(dest):
+                log_info(f"内容相同，跳过: {action.get('dest')}")
+                return
+            copy_replacing(src, dest)
             self.log(f"覆盖文件: {action.get('src')} -> {dest}")
             log_info(f"覆盖文件: {action.get('src')} -> {action.get('dest')}")
 
+    def _expand_update_action(self, action, snapshot):
+        """把 action 按快照展开成应用日志里的基本操作，与 _apply_update_action 实际执行的一致，可以重复执行"""
+        action_type = action.get('type')
+        if action_type == 'delete_keyword':
+            return [{"op": "rm", "path": p} for p in snapshot.keyword_matches(action.get('_folder_abs', ''), action.get('keyword', ''))]
+        if action_type == 'delete':
+            return [{"op": "rm", "path": action['_path_abs']}] if action.get('_path_abs') else []
+        if action_type == 'copy_folder':
+            plan = snapshot.folder_copy_plan(action.get('_src_abs', ''), action.get('_dest_abs', ''))
+            if not plan:
+                return []
+            return ([{"op": "mkdir", "path": d} for d in plan['dirs']]
+                    + [{"op": "copy", "src": src, "dst": dest} for src, dest, _ in plan['copy']])
+        if action_type == 'copy_file':
+            dest = action.get('_dest_abs', '')
+            if snapshot.file_unchanged(dest):
+                return []
+            return [{"op": "copy", "src": action.get('_src_abs', ''), "dst": dest}]
+        return []
+
+    def _begin_apply_journal(self, label, versions, backup_dir, work_dirs, save_paths, actions, snapshot, files_to_install):
+        """
+        阶段2改动游戏目录前写应用日志：前 len(actions) 步对应 actions，之后每个暂存文件一步。
+        日志写不了时只记警告并返回 None，更新照常进行（只是中途退出后无法自动恢复）。
+        """
+        steps = [{"label": self._get_update_action_label(action), "ops": self._expand_update_action(action, snapshot)} for action in actions]
+        for item in files_to_install:
+            steps.append({
+                "label": f"安装 {item['name']}",
+                "ops": [{"op": "move", "src": item['_staging_abs'], "dst": item['_target_abs'], "sha256": str(item.get('sha256') or '').lower()}],
+            })
+        journal = ApplyJournal(os.path.join(self.game_root, APPLY_JOURNAL_FILE))
+        try:
+            journal.begin({
+                "label": label,
+                "versions": [v for v in versions if v],
+                "backup_dir": backup_dir,
+                "work_dirs": list(work_dirs),
+                "save_paths": list(save_paths),
+                "steps": steps,
+            })
+        except Exception as e:
+            journal.discard()
+            log_warning(f"写入应用日志失败，本次更新中途退出后无法自动恢复: {e}")
+            return None
+        return journal
+
+    def _replay_apply_op(self, op):
+        kind = op.get("op")
+        if kind == "rm":
+            try:
+                os.remove(op["path"])
+            except OSError:
+                pass
+        elif kind == "mkdir":
+            os.makedirs(op["path"], exist_ok=True)
+        elif kind == "copy":
+            copy_replacing(op["src"], op["dst"])
+        elif kind == "move":
+            if os.path.exists(op["src"]):
+                move_replacing(op["src"], op["dst"])
+            if op.get("sha256"):
+                self.file_hash_cache.record(op["dst"], op["sha256"])
+        else:
+            raise ValueError(f"未知的应用日志操作: {kind}")
+
+    def _apply_journal_blocker(self, steps, pending):
+        """检查剩余步骤能否继续完成，返回第一个问题的说明，全部可以继续时返回 None"""
+        root = os.path.realpath(self.game_root)
+        for index in pending:
+            for op in steps[index].get("ops", []):
+                paths = [op.get(k) for k in ("path", "src", "dst") if k in op]
+                for path in paths:
+                    try:
+                        inside = isinstance(path, str) and os.path.commonpath([root, os.path.realpath(path)]) == root
+                    except ValueError:
+                        inside = False
+                    if not inside:
+                        return f"路径不在游戏目录内: {path}"
+                kind = op.get("op")
+                if kind == "copy" and not os.path.isfile(op["src"]):
+                    return f"复制源已不存在: {op['src']}"
+                if kind == "move" and not os.path.isfile(op["src"]):
+                    # 已经移入的文件按哈希确认
+                    dst = op["dst"]
+                    if not os.path.isfile(dst) or (op.get("sha256") and self.file_hash_cache.hash_file(dst) != op["sha256"]):
+                        return f"暂存文件已不存在: {os.path.basename(op['src'])}"
+                if kind not in ("rm", "mkdir", "copy", "move"):
+                    return f"未知的应用日志操作: {kind}"
+        return None
+
+    def _remove_files_added_by_apply(self, steps, backup_dir):
+        """回滚时删除日志里复制/移入、但不在备份清单中的文件（更新前不存在），返回删除的数量"""
+        game_dir = self._get_game_version_dir()
+        backed_up = set()
+        if backup_dir:
+            try:
+                with open(os.path.join(backup_dir, "_backup_manifest.json"), 'r', encoding='utf-8') as f:
+                    backed_up = {os.path.normcase(os.path.normpath(os.path.join(game_dir, rel))) for rel in json.load(f).get("files", [])}
+            except Exception:
+                return 0
+        root = os.path.realpath(self.game_root)
+        removed = 0
+        for step in steps:
+            for op in step.get("ops", []):
+                dst = op.get("dst") if op.get("op") in ("copy", "move") else None
+                if not isinstance(dst, str) or os.path.normcase(os.path.normpath(dst)) in backed_up:
+                    continue
+                try:
+                    if os.path.commonpath([root, os.path.realpath(dst)]) != root:
+                        continue
+                    os.remove(dst)
+                    removed += 1
+                except (OSError, ValueError):
+                    pass
+        return removed
+
+    def _recover_interrupted_apply(self):
+        """
+        启动时处理上次在阶段2中途退出留下的应用日志：暂存文件和复制源都还在就继续完成剩余步骤，
+        否则从日志记下的备份回滚。之后清理工作目录和下载文件，不需要重新下载。
+        """
+        journal_path = os.path.join(self.game_root, APPLY_JOURNAL_FILE)
+        if not os.path.exists(journal_path):
+            return None
+        state = load_journal(journal_path)
+        if state is None:
+            log_warning("应用日志无法解析，已忽略")
+            try: os.remove(journal_path)
+            except OSError: pass
+            return None
+
+        plan = state["plan"]
+        steps = plan["steps"]
+        label = plan.get("label") or "未知"
+        result = None
+        if state["committed"]:
+            result = "completed"
+            log_info(f"应用日志已提交，补做清理: {label}")
+        else:
+            pending = [i for i in range(len(steps)) if i not in state["done"]]
+            self.log(f"检测到版本 {label} 上次在应用阶段中断（已完成 {len(steps) - len(pending)}/{len(steps)} 步），正在恢复...")
+            blocker = self._apply_journal_blocker(steps, pending)
+            if blocker is None:
+                try:
+                    for index in pending:
+                        for op in steps[index].get("ops", []):
+                            self._replay_apply_op(op)
+                    result = "rolled_forward"
+                    self.log(f"已从暂存区继续完成剩余 {len(pending)} 步")
+                except Exception as e:
+                    self.log(f"继续应用失败: {e}，改为从备份回滚")
+                    log_error(f"应用日志重放失败: {traceback.format_exc()}")
+            else:
+                self.log(f"无法继续完成更新（{blocker}），改为从备份回滚")
+            if result is None:
+                backup_dir = plan.get("backup_dir")
+                if not backup_dir or self._restore_backup(backup_dir):
+                    result = "rolled_back"
+                    removed = self._remove_files_added_by_apply(steps, backup_dir)
+                    if removed:
+                        self.log(f"已删除本次更新新增的 {removed} 个文件")
+                else:
+                    result = "failed"
+
+        # 清理工作目录和下载文件（与 _perform_update_batch 的 finally 一致）
+        for name in plan.get("work_dirs", []):
+            d = os.path.join(self.game_root, os.path.basename(str(name)))
+            if os.path.exists(d):
+                try: shutil.rmtree(d)
+                except: pass
+        root = os.path.realpath(self.game_root)
+        for save_path in plan.get("save_paths", []):
+            # 只清理更新器自己下载到游戏目录里的文件，不在游戏目录内的路径一律不碰
+            try:
+                real_path = os.path.realpath(str(save_path))
+                inside = real_path != root and os.path.commonpath([root, real_path]) == root
+            except ValueError:
+                inside = False
+            if not inside:
+                log_warning(f"应用日志记录的下载文件不在游戏目录内，跳过清理: {save_path}")
+                continue
+            if os.path.exists(save_path):
+                try: os.remove(save_path)
+                except: pass
+            try: discard_part(save_path)
+            except: pass
+        self._flush_local_indexes()
+
+        versions = [str(v) for v in plan.get("versions", []) if v]
+        if result in ("completed", "rolled_forward") and versions:
+            newest_ver = max(versions, key=version_sort_key)
+            if is_version_newer(newest_ver, self.get_local_version()):
+                self.cfg_mgr.save_config({"current_version": newest_ver})
+                self.log(f"客户端版本已更新为: {newest_ver}")
+            skipped = [v for v in self.cfg_mgr.config.get("skipped_versions", []) if v not in versions]
+            self.cfg_mgr.save_config({"skipped_versions": skipped})
+            if global_window:
+                global_window.evaluate_js(f"document.getElementById('current-ver-display').innerText = {json.dumps(self.get_local_version())}")
+        if result != "completed":
+            self._add_activity_log("update_recovered", {"version": label, "result": result})
+        log_info(f"应用日志恢复完成: {label}, 结果: {result}")
+        try: os.remove(journal_path)
+        except OSError: pass
+        return result
+
     def install_from_zip(self, zip_path, source_type='global'):
         """从本地 zip 安装更新（后台线程）"""
         def _run():
@@ -2674,8 +3916,12 @@ class Api:
         staging_dir = os.path.join(self.game_root, "temp_staging")
         temp_dir = os.path.join(self.game_root, "temp_update_tcy")
         backup_dir = None
+        journal = None
 
         try:
+            # 本地包占用同一组工作目录，上次没下完的在线更新不能再续
+            self._stop_background_prefetch()
+            self._drop_update_session()
             for d in [staging_dir, temp_dir]:
                 if os.path.exists(d):
                     shutil.rmtree(d)
@@ -2706,13 +3952,18 @@ class Api:
             # 下载 external_files 到暂存区
             mirror_prefix = self.cfg_mgr.config.get("mirror_prefix", DEFAULT_MIRROR_PREFIX)
             files_to_download = []
+            self.file_hash_cache.hash_many(
+                [item['_target_abs'] for item in external_files if item.get('sha256')],
+                cancel_check=self.cancel_event.is_set
+            )
 
             for item in external_files:
                 target_path = item['_target_abs']
                 expected_sha = item.get('sha256', '')
                 if os.path.exists(target_path):
                     if expected_sha:
-                        match, _ = self._verify_sha256(target_path, expected_sha)
+                        match, actual = self._verify_local_sha256(target_path, expected_sha)
+                        item['_local_sha256'] = actual
                         if match:
                             report_step(f"跳过(hash匹配): {item['name']}")
                             continue
@@ -2721,12 +3972,24 @@ class Api:
                         continue
                 files_to_download.append(item)
 
-            # 下载需要的 external_files
-            if files_to_download:
-                max_workers = self.cfg_mgr.config.get("parallel_downloads", 3)
-                from concurrent.futures import ThreadPoolExecutor, as_completed
+            files_to_fetch = self._stage_from_content_store(
+                files_to_download,
+                on_hit=lambda item: report_step(f"本地文件库命中: {item['name']}")
+            )
+            files_to_fetch = self._stage_from_delta_patches(
+                files_to_fetch,
+                source_type,
+                on_hit=lambda item: report_step(f"差分更新: {item['name']}")
+            )
+            files_to_fetch = self._stage_from_local_chunks(
+                files_to_fetch,
+                source_type,
+                on_hit=lambda item: report_step(f"按块拼装: {item['name']}")
+            )
 
-                self.log(f"下载 {len(files_to_download)} 个外部文件...")
+            # 下载需要的 external_files
+            if files_to_fetch:
+                self.log(f"下载 {len(files_to_fetch)} 个外部文件...")
                 dl_errors = []
 
                 def dl_single(item):
@@ -2738,12 +4001,16 @@ class Api:
                             d_url = mirror_prefix + d_url
                     staging_path = item['_staging_abs']
                     os.makedirs(os.path.dirname(staging_path), exist_ok=True)
-                    self._download_url_to_path(d_url, staging_path, connect_timeout=15, stall_timeout=20)
+                    digest = self._new_download_digest(item)
+                    self._download_url_to_path(d_url, staging_path, connect_timeout=15, stall_timeout=20, digest=digest)
                     expected_sha = item.get('sha256', '')
                     if expected_sha:
-                        match, actual = self._verify_sha256(staging_path, expected_sha)
+                        match, actual = self._verify_download_digest(staging_path, expected_sha, digest)
+                        if not match and self._repair_download_chunks(item, staging_path, [d_url], digest):
+                            match = True
                         if not match:
                             raise Exception(f"SHA256校验失败: {item['name']}")
+                        self._add_to_content_store(item, staging_path)
                     self.log(f"已下载: {item['name']}")
                     report_step(f"下载完成: {item['name']}")
                     return True
@@ -2751,15 +4018,19 @@ class Api:
                 self.update_stage = 1
                 self.cancel_event.clear()
 
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    futures = {executor.submit(dl_single, item): item for item in files_to_download}
-                    for future in as_completed(futures):
-                        if self.cancel_event.is_set():
-                            break
-                        try:
-                            future.result()
-                        except Exception as e:
-                            dl_errors.append(str(e))
+                scheduled = self.download_scheduler.run(
+                    files_to_fetch,
+                    dl_single,
+                    size_of=lambda f: f.get('size', 0),
+                    cancel_check=self.cancel_event.is_set
+                )
+                for item, future in scheduled:
+                    if self.cancel_event.is_set():
+                        break
+                    try:
+                        future.result()
+                    except Exception as e:
+                        dl_errors.append(str(e))
 
                 if self.cancel_event.is_set():
                     self.log("本地更新下载阶段被取消。")
@@ -2775,7 +4046,8 @@ class Api:
                 global_window.evaluate_js("disableCancelButton()")
 
             # 收集受影响的文件并备份
-            affected_paths = self._collect_action_affected_paths(actions)
+            fs_snapshot = self._build_update_fs_snapshot(actions)
+            affected_paths = self._collect_action_affected_paths(actions, fs_snapshot)
 
             for item in files_to_download:
                 tp = item['_target_abs']
@@ -2786,22 +4058,30 @@ class Api:
             if affected_paths:
                 backup_dir = self._create_backup(version_str, affected_paths)
 
+            files_to_install = [item for item in files_to_download if os.path.exists(item['_staging_abs'])]
+            journal = self._begin_apply_journal(
+                version_str, [data.get('version')], backup_dir, UPDATE_WORK_DIRS[0], [],
+                actions, fs_snapshot, files_to_install
+            )
+
             try:
                 # 执行 actions
-                for action in actions:
+                for index, action in enumerate(actions):
                     report_step(self._get_update_action_label(action))
-                    self._apply_update_action(action)
+                    self._apply_update_action(action, fs_snapshot)
+                    if journal: journal.mark_done(index)
 
                 # 移动暂存文件
-                for item in files_to_download:
-                    sp = item['_staging_abs']
+                for index, item in enumerate(files_to_install, len(actions)):
                     tp = item['_target_abs']
-                    if os.path.exists(sp):
-                        os.makedirs(os.path.dirname(tp), exist_ok=True)
-                        shutil.move(sp, tp)
-                        self.log(f"已安装: {item['name']}")
+                    move_replacing(item['_staging_abs'], tp)
+                    self._record_installed_file(item, tp)
+                    if journal: journal.mark_done(index)
+                    self.log(f"已安装: {item['name']}")
 
+                if journal: journal.commit()
                 self.log("本地更新包应用完成")
+                self._trim_content_store()
             except Exception as e:
                 self.log(f"应用失败，正在回滚: {e}")
                 if backup_dir:
@@ -2809,6 +4089,8 @@ class Api:
                 raise
 
         finally:
+            self._flush_local_indexes()
+            self._release_idle_connections()
             for d in [temp_dir, staging_dir]:
                 if os.path.exists(d):
                     try: shutil.rmtree(d)
@@ -2816,11 +4098,14 @@ class Api:
             if os.path.exists(zip_path):
                 try: os.remove(zip_path)
                 except: pass
+            if journal:
+                journal.discard()
 
     def save_settings(self, settings_json):
         try:
             data = json.loads(settings_json)
             self.cfg_mgr.save_config(data)
+            self._configure_download_scheduler()
             return True
         except: return False
 
@@ -2917,6 +4202,8 @@ class Api:
             from http.server import BaseHTTPRequestHandler
             from socketserver import ThreadingTCPServer
 
+            api = self
+
             blocked_headers = {'content-security-policy', 'x-frame-options',
                                'content-security-policy-report-only'}
 
@@ -2954,7 +4241,7 @@ class Api:
                                 fwd_headers['Accept-Encoding'] = ae
 
                         req = urllib.request.Request(proxy_url, headers=fwd_headers)
-                        with urllib.request.urlopen(req, timeout=15) as resp:
+                        with api._urlopen_with_policy(req, timeout=15, url=proxy_url) as resp:
                             body = resp.read()
                             ct = resp.headers.get('Content-Type', '')
                             is_html = 'text/html' in ct
@@ -4679,12 +5966,27 @@ class Api:
     def _fetch_single_json_url(self, url):
         started_at = time.time()
         try:
-            req = urllib.request.Request(
-                url,
-                headers={'User-Agent': 'TCYClientUpdater/1.0'}
-            )
-            with self._urlopen_with_policy(req, timeout=8, url=url) as resp:
-                data = json.loads(resp.read().decode('utf-8'))
+            # 带上次的 ETag/Last-Modified 做条件请求，没有新版本时服务器只回 304
+            headers = {'User-Agent': 'TCYClientUpdater/1.0'}
+            headers.update(self.json_cache.request_headers(url))
+            req = urllib.request.Request(url, headers=headers)
+            try:
+                with self._urlopen_with_policy(req, timeout=8, url=url) as resp:
+                    data = json.loads(resp.read().decode('utf-8'))
+                    etag = resp.headers.get('ETag')
+                    last_modified = resp.headers.get('Last-Modified')
+            except urllib.error.HTTPError as e:
+                cached = self.json_cache.cached_data(url)
+                if e.code != 304 or cached is None:
+                    raise
+                e.close()
+                return {
+                    "ok": True,
+                    "data": cached,
+                    "not_modified": True,
+                    "elapsed_ms": int((time.time() - started_at) * 1000),
+                }
+            self.json_cache.store(url, etag, last_modified, data)
             return {
                 "ok": True,
                 "data": data,
@@ -4700,44 +6002,85 @@ class Api:
 
     def _fetch_json_from_urls(self, url_list, fetch_label="版本信息"):
         """
-        检查 url_list 中的每个地址，全部都尝试，收集所有结果。
-        返回 (data, success_urls, failed_urls)
-        data 取第一个成功的结果，None 表示全部失败。
+        并发检查 url_list 中的地址，返回 (data, success_urls, failed_urls)，data 为 None 表示全部失败。
+        默认 first_valid 模式：第一个有效文档到达后只再等 version_poll_window_ms，
+        期间若有来源报告更高版本则改用它，之后放弃仍未返回的地址；all 模式等待全部地址。
         """
         urls = list(url_list or [])
         if not urls:
             return None, [], []
 
+        poll_mode = self.cfg_mgr.config.get("version_poll_mode", "first_valid")
+        try:
+            window_seconds = max(0, int(self.cfg_mgr.config.get("version_poll_window_ms", 1500))) / 1000.0
+        except Exception:
+            window_seconds = 1.5
         max_workers = bounded_worker_count(len(urls), JSON_FETCH_MAX_WORKERS)
         started_at = time.time()
-        self.log(f"[轮询阶段] {fetch_label}：开始检查 {len(urls)} 个地址（并发={max_workers}）")
+        self.log(f"[轮询阶段] {fetch_label}：开始检查 {len(urls)} 个地址（并发={max_workers}，模式={poll_mode}）")
         results_by_url = {}
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {
-                executor.submit(self._fetch_single_json_url, url): url
-                for url in urls
-            }
-            for future in as_completed(futures):
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {
+            executor.submit(self._fetch_single_json_url, url): url
+            for url in urls
+        }
+        pending = set(futures)
+        deadline = None
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0, deadline - time.time())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    url = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {
+                            "ok": False,
+                            "error": str(e),
+                            "elapsed_ms": None,
+                            "timeout": self._is_network_timeout_error(e),
+                        }
+                    results_by_url[url] = result
+                    self._record_url_health(url, result)
+                    elapsed_ms = result.get("elapsed_ms")
+                    elapsed_text = f"{elapsed_ms}ms" if isinstance(elapsed_ms, int) else "unknown"
+                    if result.get("ok"):
+                        status = "304" if result.get("not_modified") else "OK"
+                        self.log(f"[轮询][{fetch_label}][{status}][{elapsed_text}] {url}")
+                        if poll_mode != "all" and deadline is None:
+                            deadline = time.time() + window_seconds
+                    else:
+                        status = "TIMEOUT" if result.get("timeout") else "FAIL"
+                        self.log(f"[轮询][{fetch_label}][{status}][{elapsed_text}] {url} -> {result.get('error', 'unknown')}")
+        finally:
+            def record_straggler(future):
+                # 被放弃的请求只记一次：已经在跑的等它在后台结束后记真实结果，还没开始就被取消的记为 abandoned
                 url = futures[future]
-                try:
-                    result = future.result()
-                except Exception as e:
-                    result = {
-                        "ok": False,
-                        "error": str(e),
-                        "elapsed_ms": None,
-                        "timeout": self._is_network_timeout_error(e),
-                    }
-                results_by_url[url] = result
-                elapsed_ms = result.get("elapsed_ms")
-                elapsed_text = f"{elapsed_ms}ms" if isinstance(elapsed_ms, int) else "unknown"
-                if result.get("ok"):
-                    self.log(f"[轮询][{fetch_label}][OK][{elapsed_text}] {url}")
+                if future.cancelled():
+                    self._record_url_health(url, {"abandoned": True})
+                    return
+                err = future.exception()
+                if err is not None:
+                    self._record_url_health(url, {"ok": False, "error": str(err), "elapsed_ms": None, "timeout": self._is_network_timeout_error(err)})
                 else:
-                    status = "TIMEOUT" if result.get("timeout") else "FAIL"
-                    self.log(f"[轮询][{fetch_label}][{status}][{elapsed_text}] {url} -> {result.get('error', 'unknown')}")
-
-        first_data, success_urls, failed_urls = summarize_url_fetch_results(urls, results_by_url)
+                    self._record_url_health(url, future.result())
+
+            for future in pending:
+                future.add_done_callback(record_straggler)
+                # 还没开始的请求直接取消（shutdown 的 cancel_futures 参数要 Python 3.9）
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        if pending:
+            self.log(f"[轮询阶段] {fetch_label}：已拿到有效结果，放弃 {len(pending)} 个未返回的地址")
+        first_data, best_url = pick_freshest_document(urls, results_by_url)
+        if best_url and best_url != next((u for u in urls if results_by_url.get(u, {}).get("ok")), None):
+            self.log(f"[轮询阶段] {fetch_label}：{best_url} 报告了更高的版本，采用该结果")
+        success_urls = [u for u in urls if results_by_url.get(u, {}).get("ok")]
+        failed_urls = [u for u in urls if u in results_by_url and not results_by_url[u].get("ok")]
         timing_stats = summarize_elapsed_ms([item.get("elapsed_ms") for item in results_by_url.values()])
         total_elapsed_ms = int((time.time() - started_at) * 1000)
         if timing_stats["count"] > 0:
@@ -4750,6 +6093,60 @@ class Api:
         )
         return first_data, success_urls, failed_urls
 
+    def _fetch_history_page(self, page, base_urls):
+        last_error = None
+        for url in resolve_page_urls(page["url"], base_urls):
+            try:
+                req = urllib.request.Request(url, headers={'User-Agent': 'TCYClientUpdater/1.0'})
+                with self._urlopen_with_policy(req, timeout=15, url=url) as resp:
+                    raw = resp.read()
+                return parse_history_page(raw, page.get("sha256"))
+            except Exception as e:
+                last_error = e
+                self.log(f"[历史分页] {url} 获取失败: {e}")
+        raise Exception(f"历史分页获取失败: {page['url']} ({last_error})")
+
+    def _sync_history_feed(self, head_data, base_urls, local_version=None):
+        """
+        合并头文档的 history 与 history_pages 归档分页，返回从旧到新的完整历史；
+        给出 local_version 时只补拉可能含有更新版本的分页。需要的分页拿不到时返回 None，
+        避免在缺少中间版本的情况下生成更新队列。
+        """
+        head_history = head_data.get("history") if isinstance(head_data.get("history"), list) else []
+        head_history = [item for item in head_history if isinstance(item, dict)]
+        pages = normalize_pages(head_data.get("history_pages"))
+        if self.history_index.update_head(head_history, pages):
+            self.log(f"已缓存 {len(head_history)} 条最近更新历史到本地索引")
+        else:
+            self.log("更新历史未变化，跳过写入本地缓存")
+
+        missing = [page for page in pages_newer_than(pages, local_version) if not self.history_index.has_page(page)]
+        complete = True
+        if missing:
+            self.log(f"[历史分页] 需要补拉 {len(missing)}/{len(pages)} 个归档分页")
+            with ThreadPoolExecutor(max_workers=bounded_worker_count(len(missing), JSON_FETCH_MAX_WORKERS)) as executor:
+                futures = {executor.submit(self._fetch_history_page, page, base_urls): page for page in missing}
+                for future in as_completed(futures):
+                    page = futures[future]
+                    try:
+                        self.history_index.store_page(page, future.result())
+                    except Exception as e:
+                        complete = False
+                        self.log(str(e))
+        if not complete:
+            return None
+        # 比本地版本旧的分页不影响更新队列，本地索引里有就一并返回，没有也不必为它联网
+        return self.history_index.history()
+
+    def _record_url_health(self, url, result):
+        with self._url_health_lock:
+            record_url_health(self.url_health, url, result)
+
+    def get_version_source_health(self):
+        """返回本次运行中各版本检查地址的成功/失败/超时/放弃次数和平均耗时，供诊断使用"""
+        with self._url_health_lock:
+            return json.dumps(self.url_health, ensure_ascii=False)
+
     def _build_url_list(self, default_url, github_url, custom_url=""):
         """
         构建轮询列表：自定义URL（若有）> 默认URL > GitHub原始URL > GitHub加速URL
@@ -4795,7 +6192,8 @@ class Api:
                     percent = min(100, int(block_num * block_size * 100 / total_size))
                     if percent % 10 == 0: self.log(f"自更新下载中... {percent}%")
 
-            self._download_url_to_path(url, temp_download_path, progress_cb=report, connect_timeout=15, stall_timeout=20)
+            with self.download_scheduler.slot():
+                self._download_url_to_path(url, temp_download_path, progress_cb=report, connect_timeout=15, stall_timeout=20)
             if not os.path.exists(temp_download_path):
                 raise FileNotFoundError(f"未找到已下载的临时更新文件: {temp_download_path}")
             temp_size = os.path.getsize(temp_download_path)
@@ -4881,6 +6279,13 @@ class Api:
             pass
 
     def _check_update_thread(self, startup_mode=False):
+        if self.update_stage == 0:
+            # 上次在应用阶段中途退出时，先把游戏目录恢复到一致状态再检查更新
+            try:
+                self._recover_interrupted_apply()
+            except Exception as e:
+                self.log(f"恢复中断的更新失败: {e}")
+                log_error(f"恢复中断的更新失败: {traceback.format_exc()}")
         self.log("正在从多个来源获取版本信息，请稍候...")
         self._show_update_island_loading("正在并发检查客户端版本和更新器版本…")
 
@@ -4962,24 +6367,28 @@ class Api:
                     "url": updater_data.get("url", "")
                 }
 
-        # === 缓存更新历史到本地 (供更新日志时间线视图使用) ===
-        if client_data and 'history' in client_data and isinstance(client_data['history'], list):
-            self.cfg_mgr.save_config({"cached_history": client_data['history']})
-            self.log(f"已缓存 {len(client_data['history'])} 条更新历史到本地")
+        # === 同步更新历史到本地索引 (供更新日志时间线视图使用)，只补拉比本地版本新的归档分页 ===
+        client_history = None
+        if client_data and (isinstance(client_data.get('history'), list) or client_data.get('history_pages')):
+            client_history = self._sync_history_feed(client_data, client_ok_urls, local_version=self.get_local_version())
+            if client_history is None:
+                self.log("部分历史分页获取失败，本次不生成客户端更新队列")
 
         # === 处理客户端更新队列 ===
         updates_queue = []
-        if client_data:
+        if client_history is not None:
             local_ver = self.get_local_version()
             original_skipped = self.cfg_mgr.config.get("skipped_versions", [])
-            if 'history' in client_data and isinstance(client_data['history'], list):
-                updates_queue, cleaned_skipped = select_pending_updates(
-                    client_data['history'],
-                    local_ver,
-                    original_skipped,
-                )
-                if cleaned_skipped != sorted(set(original_skipped), key=version_sort_key):
-                    self.cfg_mgr.save_config({"skipped_versions": cleaned_skipped})
+            updates_queue, cleaned_skipped = select_pending_updates(
+                client_history,
+                local_ver,
+                original_skipped,
+            )
+            if cleaned_skipped != sorted(set(original_skipped), key=version_sort_key):
+                self.cfg_mgr.save_config({"skipped_versions": cleaned_skipped})
+
+        # 版本检查的网络请求到此结束
+        self._release_idle_connections()
 
         # === 将版本信息发给前端展示 ===
         modal_payload = {
@@ -4998,13 +6407,19 @@ class Api:
                     if updater_found:
                         island_text_parts.append("检测到更新器有更新")
                     if client_found:
-                        island_text_parts.append("检测到客户端版本有更新")
+                        resumable = self._describe_resumable_update([u.get('version') for u in updates_queue if isinstance(u, dict)])
+                        if resumable:
+                            island_text_parts.append(f"客户端更新上次未完成（已下载 {resumable['verified']}/{resumable['total']} 个文件），可继续")
+                        else:
+                            island_text_parts.append("检测到客户端版本有更新")
                     island_text = " / ".join(island_text_parts)
                     try:
                         global_window.evaluate_js(f"setPendingVersionModal({json.dumps(modal_payload)})")
                         global_window.evaluate_js(f"showUpdateIslandReady({json.dumps(island_text)})")
                     except Exception:
                         pass
+                    if client_found:
+                        self._start_background_prefetch(updates_queue)
                 else:
                     try:
                         global_window.evaluate_js("hideUpdateIslandSoon('当前已是最新版本')")
@@ -5139,6 +6554,7 @@ class Api:
             "file_count": summary["file_count"],
             "total_bytes": summary["total_bytes"],
             "affected_paths": summary["affected_paths"],
+            "resume": self._describe_resumable_update(summary["versions"]),
             "plan_token": token,
             "created_at": created_at
         }, ensure_ascii=False)
@@ -5208,6 +6624,8 @@ class Api:
 
     def _sequence_thread(self, update_list_json, source_type):
         try:
+            # 后台预取停下并写好会话后，正式更新才能沿用它下载好的内容
+            self._stop_background_prefetch()
             updates = json.loads(update_list_json)
             total_updates = len(updates)
             
@@ -5218,35 +6636,75 @@ class Api:
             # 更精确的逻辑在循环结束后处理。
             
             successful_versions = []
-            
-            for i, update_item in enumerate(updates):
+
+            def report_failure(ver, e):
+                self.log(f"版本 {ver} 更新失败: {e}")
+                if self.cancel_event.is_set():
+                    self._add_activity_log("update_cancelled", {"version": ver, "reason": "user_cancelled"})
+                else:
+                    self._add_activity_log("update_failed", {"version": ver, "error": str(e)})
+                if self._is_network_timeout_error(e):
+                    self._safe_js_alert(f"版本 {ver} 下载超时/阻塞，已中止。可切换全球节点重试。")
+                else:
+                    self._safe_js_alert(f"版本 {ver} 更新失败，流程中止。")
+
+            entries = []
+            for update_item in updates:
                 ver = update_item.get('version')
-                self.log(f"=== 正在处理版本 {ver} ({i+1}/{total_updates}) ===")
-                
                 # 获取下载链接
                 dl_urls = update_item.get('download_urls', {})
                 url = dl_urls.get(source_type)
-                
                 if not url:
                     self.log(f"错误: 版本 {ver} 缺少 {source_type} 下载链接，跳过。")
                     continue
-                
-                # 执行单次更新 (复用之前的逻辑，稍作修改以抛出异常)
+                entries.append({"version": ver, "url": url})
+
+            if len(entries) > 1 and self.cfg_mgr.config.get("squash_batch_updates", True):
+                # 合并成一次更新：被后续版本覆盖的文件不再下载，只做一次备份，失败时整体回滚
+                versions_label = f"{entries[0]['version']} ~ {entries[-1]['version']}"
+                self.log(f"=== 合并更新 {len(entries)} 个版本 ({versions_label}) ===")
                 try:
-                    self._perform_single_update(url, source_type)
+                    if self._perform_update_batch(entries, source_type):
+                        for entry in entries:
+                            successful_versions.append(entry['version'])
+                            self._add_activity_log("update_success", {"version": entry['version']})
+                    else:
+                        self._add_activity_log("update_cancelled", {"version": versions_label, "reason": "user_cancelled"})
+                except Exception as e:
+                    report_failure(versions_label, e)
+            else:
+                # 流水线：当前版本下载校验完、开始备份应用时，后台预取下一个版本到另一组工作目录
+                pipeline = len(entries) > 1 and self.cfg_mgr.config.get("pipeline_sequential_updates", True)
+                prefetched = None
+                for i, entry in enumerate(entries):
+                    ver = entry['version']
+                    self.log(f"=== 正在处理版本 {ver} ({i+1}/{len(entries)}) ===")
+                    prefetch = [None]
+                    on_staged = None
+                    if pipeline and i + 1 < len(entries):
+                        current_dirs = prefetched["work_dirs"] if prefetched else UPDATE_WORK_DIRS[0]
+                        next_dirs = UPDATE_WORK_DIRS[1] if current_dirs == UPDATE_WORK_DIRS[0] else UPDATE_WORK_DIRS[0]
+                        next_entry = entries[i + 1]
+
+                        def on_staged():
+                            prefetch[0] = self._start_update_prefetch(next_entry, source_type, next_dirs)
+
+                    try:
+                        ok = self._perform_single_update(entry['url'], source_type, prefetched=prefetched, on_staged=on_staged, version=ver)
+                        error = None
+                    except Exception as e:
+                        ok, error = False, e
+                    prefetched = self._finish_update_prefetch(prefetch[0]) if prefetch[0] else None
+
+                    if not ok:
+                        self._discard_prefetched_update(prefetched)
+                        if error is not None:
+                            report_failure(ver, error)
+                        else:
+                            self._add_activity_log("update_cancelled", {"version": ver, "reason": "user_cancelled"})
+                        break # 中断后续更新
                     successful_versions.append(ver)
                     self._add_activity_log("update_success", {"version": ver})
-                except Exception as e:
-                    self.log(f"版本 {ver} 更新失败: {e}")
-                    if self.cancel_event.is_set():
-                        self._add_activity_log("update_cancelled", {"version": ver, "reason": "user_cancelled"})
-                    else:
-                        self._add_activity_log("update_failed", {"version": ver, "error": str(e)})
-                    if self._is_network_timeout_error(e):
-                        self._safe_js_alert(f"版本 {ver} 下载超时/阻塞，已中止。可切换全球节点重试。")
-                    else:
-                        self._safe_js_alert(f"版本 {ver} 更新失败，流程中止。")
-                    break # 中断后续更新
             
             # 更新完成后，处理版本号和跳过列表
             if successful_versions:
@@ -5292,14 +6750,14 @@ class Api:
             if global_window: global_window.evaluate_js("resetUpdateModalState()")
         finally:
             self.update_stage = 0
+            self._release_idle_connections()
 
-    def _perform_single_update(self, url, source_type):
+    def _fetch_update_skeleton(self, url, source_type, temp_dir, save_paths, prehash_threads, label="正在获取配置包...", cancel_check=None, progress_hook=None):
         """
-        原子性更新：
-        阶段1 - 下载所有文件到暂存区并校验
-        阶段2 - 备份旧文件 → 执行 actions → 移动新文件
-        失败时自动回滚
+        下载并解出一个版本的骨架包到 temp_dir，返回其中的 manifest（没有时为空字典）；label 为 None 时不更新进度条。
+        progress_hook 与下载进度回调同签名，每个数据块都会调用，后台预取用它限速。
         """
+        should_stop = cancel_check or self.cancel_event.is_set
         candidates = self._build_download_candidates(url, source_type)
         primary_url = candidates[0] if candidates else url
 
@@ -5307,48 +6765,69 @@ class Api:
         filename = os.path.basename(path)
         if not filename.lower().endswith(".zip"):
             filename = "update_temp.zip"
+        # 下载文件名带上工作目录前缀：流水线预取的下一个版本用另一组工作目录，两边的骨架包和 .part 互不相干
+        work_prefix = os.path.relpath(os.path.abspath(temp_dir), os.path.abspath(self.game_root)).replace(os.sep, "_")
+        save_path = os.path.join(self.game_root, f"{work_prefix}_{filename}")
+        save_paths.append(save_path)
 
-        save_path = os.path.join(self.game_root, filename)
-        staging_dir = os.path.join(self.game_root, "temp_staging")
-        temp_dir = os.path.join(self.game_root, "temp_update_tcy")
-        backup_dir = None
-
-        try:
-            # 清理旧的暂存目录
-            for d in [staging_dir, temp_dir]:
-                if os.path.exists(d):
-                    shutil.rmtree(d)
-            os.makedirs(staging_dir, exist_ok=True)
-
-            # ======== 阶段1：下载骨架包 ========
-            self.log("=== 阶段1：下载并校验 ===")
-            log_info(f"开始下载骨架包: {primary_url}")
+        log_info(f"开始下载骨架包: {primary_url}")
+        dl_state = {'start': time.time(), 'last_update': 0}
 
-            dl_state = {'start': time.time(), 'last_update': 0}
+        def report_dl(block_num, block_size, total_size):
+            if should_stop():
+                raise Exception("Update cancelled by user")
+            if progress_hook:
+                progress_hook(block_num, block_size, total_size)
+            if total_size > 0 and label:
+                downloaded = block_num * block_size
+                percent = min(100, int(downloaded * 100 / total_size))
+                elapsed = time.time() - dl_state['start']
+                speed_str = "0 KB/s"
+                if elapsed > 0.1:
+                    speed = downloaded / elapsed
+                    if speed > 1024*1024: speed_str = f"{speed/1024/1024:.1f} MB/s"
+                    else: speed_str = f"{speed/1024:.0f} KB/s"
+                if time.time() - dl_state['last_update'] > 0.1 or percent >= 100:
+                    dl_state['last_update'] = time.time()
+                    if global_window:
+                        global_window.evaluate_js(f"updateProgressDetails({percent}, '{speed_str}', '{label}')")
 
-            def report_dl(block_num, block_size, total_size):
-                if self.cancel_event.is_set():
-                    raise Exception("Update cancelled by user")
-                if total_size > 0:
-                    downloaded = block_num * block_size
-                    percent = min(100, int(downloaded * 100 / total_size))
-                    elapsed = time.time() - dl_state['start']
-                    speed_str = "0 KB/s"
-                    if elapsed > 0.1:
-                        speed = downloaded / elapsed
-                        if speed > 1024*1024: speed_str = f"{speed/1024/1024:.1f} MB/s"
-                        else: speed_str = f"{speed/1024:.0f} KB/s"
-                    if time.time() - dl_state['last_update'] > 0.1 or percent >= 100:
-                        dl_state['last_update'] = time.time()
-                        if global_window:
-                            global_window.evaluate_js(f"updateProgressDetails({percent}, '{speed_str}', '正在获取配置包...')")
-
-            self.log(f"下载配置包: {filename}")
+        self.log(f"下载配置包: {filename}")
 
-            self.update_stage = 1
-            self.cancel_event.clear()
+        def on_skeleton_entry(name, path):
+            if name == "manifest.json":
+                t = threading.Thread(target=self._prehash_manifest_targets, args=(path,), daemon=True)
+                t.start()
+                prehash_threads.append(t)
 
-            self._download_with_candidates_resumable(
+        streamed = False
+        if self.cfg_mgr.config.get("stream_extract_skeleton", True):
+            try:
+                self._stream_extract_zip_from_candidates(
+                    candidates,
+                    temp_dir,
+                    progress_cb=report_dl,
+                    connect_timeout=8,
+                    stall_timeout=15,
+                    on_entry=on_skeleton_entry
+                )
+                streamed = True
+            except ZipStreamUnsupported as e:
+                self.log(f"骨架包无法流式解压（{e}），改为下载后解压")
+            except ValueError:
+                raise
+            except Exception as e:
+                if should_stop() or "cancelled" in str(e).lower():
+                    raise
+                self.log(f"骨架包流式下载失败（{e}），改为可续传下载")
+            if not streamed:
+                for t in prehash_threads:
+                    t.join()
+                if os.path.exists(temp_dir):
+                    shutil.rmtree(temp_dir)
+
+        if not streamed:
+            self._download_with_hedging(
                 candidates,
                 save_path,
                 progress_cb=report_dl,
@@ -5360,15 +6839,553 @@ class Api:
             # 解压骨架包
             self._safe_extract_zip(os.path.abspath(save_path), temp_dir)
 
-            manifest_path = os.path.join(temp_dir, "manifest.json")
-            data = {}
-            if os.path.exists(manifest_path):
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+        manifest_path = os.path.join(temp_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _fetch_update_manifests(self, entries, source_type, temp_dir, staging_dir, save_paths, prehash_threads, cancel_check=None, quiet=False, progress_hook=None):
+        """依次取回 entries 的骨架包并解析 manifest 路径，返回 [{"version", "actions", "external_files"}]"""
+        manifests = []
+        for index, entry in enumerate(entries):
+            entry_temp_dir = temp_dir if len(entries) == 1 else os.path.join(temp_dir, f"{index:03d}")
+            if quiet:
+                label = None
+            elif len(entries) == 1:
+                label = "正在获取配置包..."
+            else:
+                label = f"正在获取配置包 ({index + 1}/{len(entries)})..."
+            data = self._fetch_update_skeleton(
+                entry["url"], source_type, entry_temp_dir, save_paths, prehash_threads,
+                label=label, cancel_check=cancel_check, progress_hook=progress_hook
+            )
+            entry_actions, entry_files = self._prepare_update_manifest_paths(
+                data.get('actions', []), data.get('external_files', []), entry_temp_dir, staging_dir
+            )
+            manifests.append({
+                "version": data.get('version') or entry.get("version"),
+                "actions": entry_actions,
+                "external_files": entry_files,
+            })
+        return manifests
 
-            actions = data.get('actions', [])
-            external_files = data.get('external_files', [])
-            actions, external_files = self._prepare_update_manifest_paths(actions, external_files, temp_dir, staging_dir)
+    def _start_update_prefetch(self, entry, source_type, work_dirs):
+        """后台预取下一个版本，返回句柄，交给 _finish_update_prefetch() 停止并取结果"""
+        handle = {"stop": threading.Event(), "result": None}
+
+        def run():
+            handle["result"] = self._prefetch_update(entry, source_type, work_dirs, handle["stop"])
+
+        handle["thread"] = threading.Thread(target=run, daemon=True)
+        handle["thread"].start()
+        return handle
+
+    def _finish_update_prefetch(self, handle):
+        handle["stop"].set()
+        handle["thread"].join()
+        return handle["result"]
+
+    def _prefetch_update(self, entry, source_type, work_dirs, stop_event):
+        """
+        在当前版本备份/应用期间预取下一个版本：骨架包解到另一组工作目录，本地（目标位置、本地文件库）
+        找不到的外部文件下载进该组的暂存区并按 sha256 校验。是否跳过、是否需要差分等决定
+        仍由正式更新时按应用后的磁盘状态重新判断；预取被停止时留下的 .part 会在正式下载时续传。
+        """
+        temp_dir = os.path.join(self.game_root, work_dirs[0])
+        staging_dir = os.path.join(self.game_root, work_dirs[1])
+        result = {"work_dirs": work_dirs, "save_paths": [], "manifests": None, "staged": set()}
+
+        def stopped():
+            return stop_event.is_set() or self.cancel_event.is_set()
+
+        try:
+            for d in [staging_dir, temp_dir]:
+                if os.path.exists(d):
+                    shutil.rmtree(d)
+            os.makedirs(staging_dir, exist_ok=True)
+            self.log(f"[预取] 开始预取版本 {entry['version']}")
+            prehash_threads = []
+            try:
+                manifests = self._fetch_update_manifests(
+                    [entry], source_type, temp_dir, staging_dir, result["save_paths"], prehash_threads,
+                    cancel_check=stopped, quiet=True
+                )
+            finally:
+                for t in prehash_threads:
+                    t.join()
+            result["manifests"] = manifests
+
+            store = self._get_content_store()
+            wanted = []
+            for item in manifests[0]["external_files"]:
+                expected_sha = item.get('sha256', '')
+                if not expected_sha:
+                    continue
+                target_path = item['_target_abs']
+                if os.path.isfile(target_path) and self._verify_local_sha256(target_path, expected_sha)[0]:
+                    continue
+                if store is not None and store.lookup(expected_sha):
+                    continue
+                wanted.append(item)
+            if self.cfg_mgr.config.get("chunk_dedup_enabled", True) and any(item.get('chunks') for item in wanted):
+                # 能用本地块拼装的文件留给正式更新处理，预取时整文件下载反而浪费流量
+                located = self._collect_local_chunks()
+                wanted = [item for item in wanted if not (located and self._plan_local_chunk_assembly(item, located))]
+
+            def prefetch_single(item):
+                def report(block_num, block_size, total_size):
+                    if stopped():
+                        raise Exception("Update cancelled by user")
+
+                staging_path = item['_staging_abs']
+                os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+                candidates_for_file = self._build_download_candidates(item['url'], source_type)
+                digest = self._new_download_digest(item)
+                source_url = self._download_with_hedging(
+                    candidates_for_file,
+                    staging_path,
+                    progress_cb=report,
+                    connect_timeout=8,
+                    stall_timeout=12,
+                    log_context=f"prefetch:{item['name']}",
+                    digest=digest
+                )
+                match, _ = self._verify_download_digest(staging_path, item['sha256'], digest)
+                if not match:
+                    match = self._repair_download_chunks(item, staging_path, candidates_for_file, digest, bad_source=source_url, cancel_check=stopped)
+                if not match:
+                    os.remove(staging_path)
+                    raise Exception(f"SHA256校验失败: {item['name']}")
+
+            scheduled = self.download_scheduler.run(
+                wanted,
+                prefetch_single,
+                size_of=lambda f: f.get('size', 0),
+                cancel_check=stopped
+            )
+            for item, future in scheduled:
+                try:
+                    future.result()
+                    result["staged"].add(item['_staging_abs'])
+                except Exception as e:
+                    if not stopped():
+                        self.log(f"[预取] {item['name']} 预取失败，正式更新时重新下载: {e}")
+            self.log(f"[预取] 版本 {entry['version']}：已预取 {len(result['staged'])}/{len(wanted)} 个外部文件")
+        except Exception as e:
+            if not stopped():
+                self.log(f"[预取] 版本 {entry['version']} 预取中断: {e}")
+                log_warning(f"预取版本 {entry['version']} 失败: {traceback.format_exc()}")
+        return result
+
+    def _discard_prefetched_update(self, prefetched):
+        if not prefetched:
+            return
+        for name in prefetched["work_dirs"]:
+            d = os.path.join(self.game_root, name)
+            if os.path.exists(d):
+                try: shutil.rmtree(d)
+                except: pass
+        for save_path in prefetched["save_paths"]:
+            if os.path.exists(save_path):
+                try: os.remove(save_path)
+                except: pass
+            try: discard_part(save_path)
+            except: pass
+
+    def _is_game_running(self):
+        """
+        检测 Minecraft 是否在运行。Windows 上枚举顶层窗口，找 GLFW/LWJGL 创建、标题含 Minecraft 的游戏窗口
+        （启动器窗口不是这两个窗口类）；比 tasklist /V 逐进程查窗口标题快得多。其他系统看 java 进程的命令行。
+        """
+        if os.name == 'nt':
+            found = []
+            enum_proc_type = ctypes.WINFUNCTYPE(ctypes.c_bool, ctypes.c_void_p, ctypes.c_void_p)
+
+            def on_window(hwnd, _):
+                if not windll.user32.IsWindowVisible(hwnd):
+                    return True
+                class_name = ctypes.create_unicode_buffer(64)
+                windll.user32.GetClassNameW(hwnd, class_name, 64)
+                if class_name.value not in GAME_WINDOW_CLASSES:
+                    return True
+                length = windll.user32.GetWindowTextLengthW(hwnd)
+                title = ctypes.create_unicode_buffer(length + 1)
+                windll.user32.GetWindowTextW(hwnd, title, length + 1)
+                if "minecraft" in title.value.lower():
+                    found.append(hwnd)
+                    return False
+                return True
+
+            try:
+                windll.user32.EnumWindows(enum_proc_type(on_window), 0)
+            except Exception as e:
+                log_warning(f"枚举窗口检测游戏进程失败: {e}")
+            return bool(found)
+        result = self._run_command_capture(["ps", "-eo", "args"])
+        return any("java" in line and "minecraft" in line.lower() for line in result.get("stdout", "").splitlines())
+
+    def _start_background_prefetch(self, updates_queue):
+        """
+        开启 background_prefetch_enabled 时，把启动检查发现的待更新版本在后台做完阶段1，结果存进更新会话；
+        用户点更新时 _open_update_session() 沿用它，只剩应用阶段。合并更新时预取全部版本，逐版本更新时只预取第一个。
+        """
+        cfg = self.cfg_mgr.config
+        if not cfg.get("background_prefetch_enabled", False) or not updates_queue or self.update_stage != 0:
+            return
+        if self._background_prefetch and self._background_prefetch["thread"].is_alive():
+            return
+        source_type = cfg.get("background_prefetch_source", "cn")
+        entries = []
+        for item in updates_queue:
+            url = (item.get('download_urls') or {}).get(source_type) if isinstance(item, dict) else None
+            if not url:
+                log_info(f"后台预取跳过：版本缺少 {source_type} 下载链接")
+                return
+            entries.append({"version": item.get('version'), "url": url})
+        if len(entries) > 1 and not cfg.get("squash_batch_updates", True):
+            entries = entries[:1]
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self._background_prefetch_thread, args=(entries, source_type, stop_event), daemon=True)
+        self._background_prefetch = {"stop": stop_event, "thread": thread}
+        thread.start()
+
+    def _stop_background_prefetch(self):
+        handle = self._background_prefetch
+        if not handle:
+            return
+        handle["stop"].set()
+        handle["thread"].join()
+        self._background_prefetch = None
+
+    def _background_prefetch_thread(self, entries, source_type, stop_event):
+        """后台预取：限速 background_prefetch_rate_kbps，检测到游戏运行时中断当前下载并等游戏退出，.part 留着之后续传"""
+        label = entries[0]['version'] if len(entries) == 1 else f"{entries[0]['version']} ~ {entries[-1]['version']}"
+        work_dirs = UPDATE_WORK_DIRS[0]
+        temp_dir = os.path.join(self.game_root, work_dirs[0])
+        staging_dir = os.path.join(self.game_root, work_dirs[1])
+        rate_kbps = max(0.0, float(self.cfg_mgr.config.get("background_prefetch_rate_kbps", 1024) or 0))
+        limiter = TokenBucket(rate_kbps * 1024)
+        game_running = threading.Event()
+        finished = threading.Event()
+
+        def stopped():
+            return stop_event.is_set() or self.update_stage != 0
+
+        def interrupted():
+            return stopped() or game_running.is_set()
+
+        def throttled_report():
+            """给一次下载用的进度回调：按新增字节扣限速令牌，游戏运行时中断下载。骨架包、外部文件都走它"""
+            progress = {"last": None}
+
+            def report(block_num, block_size, total_size):
+                if stopped():
+                    raise Exception("Prefetch cancelled")
+                if game_running.is_set():
+                    raise Exception("Prefetch cancelled: game running")
+                downloaded = block_num * block_size
+                # 续传时首次回调的进度包含已有部分，从那里开始计；换一路重新下载时进度会变小，从新位置重新计
+                if progress["last"] is not None and downloaded > progress["last"]:
+                    limiter.consume(downloaded - progress["last"], cancel_check=interrupted)
+                progress["last"] = downloaded
+            return report
+
+        def throttled_bytes(count):
+            if game_running.is_set():
+                raise Exception("Prefetch cancelled: game running")
+            limiter.consume(count, cancel_check=interrupted)
+
+        def watch_game():
+            while not finished.is_set() and not stopped():
+                if self._is_game_running():
+                    game_running.set()
+                else:
+                    game_running.clear()
+                stop_event.wait(GAME_CHECK_INTERVAL_SECONDS)
+
+        def wait_for_game_exit():
+            if game_running.is_set():
+                self.log("[后台预取] 检测到游戏正在运行，暂停预取")
+                while game_running.is_set() and not stopped():
+                    stop_event.wait(1)
+                if not stopped():
+                    self.log("[后台预取] 游戏已退出，继续预取")
+
+        session = None
+        try:
+            session = self._open_update_session(entries, work_dirs)
+            os.makedirs(staging_dir, exist_ok=True)
+            if self._is_game_running():
+                game_running.set()
+            threading.Thread(target=watch_game, daemon=True).start()
+            wait_for_game_exit()
+            if stopped():
+                return
+            self.log(f"[后台预取] 开始预取版本 {label}（限速 {rate_kbps:.0f} KB/s）" if rate_kbps else f"[后台预取] 开始预取版本 {label}")
+
+            while session.manifests is None:
+                save_paths = []
+                prehash_threads = []
+                try:
+                    manifests = self._fetch_update_manifests(
+                        entries, source_type, temp_dir, staging_dir, save_paths, prehash_threads,
+                        cancel_check=interrupted, quiet=True, progress_hook=throttled_report()
+                    )
+                except Exception:
+                    if stopped() or not game_running.is_set():
+                        raise
+                    # 骨架包下载被游戏运行打断：等游戏退出后重新获取，已下载的 .part 会续传
+                    wait_for_game_exit()
+                    if stopped():
+                        return
+                    continue
+                finally:
+                    for t in prehash_threads:
+                        t.join()
+                session.set_manifests(manifests, save_paths)
+            manifests = session.manifests
+            external_files = manifests[0]["external_files"] if len(manifests) == 1 else squash_update_manifests(manifests)["external_files"]
+
+            store = self._get_content_store()
+            wanted = []
+            for item in external_files:
+                expected_sha = item.get('sha256', '')
+                if not expected_sha:
+                    continue
+                target_path = item['_target_abs']
+                if not item.get('_deleted_by_plan') and os.path.isfile(target_path) and self._verify_local_sha256(target_path, expected_sha)[0]:
+                    continue
+                if store is not None and store.lookup(expected_sha):
+                    continue
+                wanted.append(item)
+            if self.cfg_mgr.config.get("chunk_dedup_enabled", True) and any(item.get('chunks') for item in wanted):
+                # 能用本地块拼装的文件留给正式更新处理
+                located = self._collect_local_chunks()
+                wanted = [item for item in wanted if not (located and self._plan_local_chunk_assembly(item, located))]
+            session.track(wanted)
+
+            def fetch_single(item):
+                staging_path = item['_staging_abs']
+                os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+                session.set_file_state(item, STATE_PARTIAL)
+                candidates_for_file = self._build_download_candidates(item['url'], source_type)
+                digest = self._new_download_digest(item)
+                source_url = self._download_with_hedging(
+                    candidates_for_file,
+                    staging_path,
+                    progress_cb=throttled_report(),
+                    connect_timeout=8,
+                    stall_timeout=12,
+                    log_context=f"background_prefetch:{item['name']}",
+                    digest=digest
+                )
+                match, _ = self._verify_download_digest(staging_path, item['sha256'], digest)
+                if not match:
+                    match = self._repair_download_chunks(
+                        item, staging_path, candidates_for_file, digest, bad_source=source_url,
+                        cancel_check=interrupted, on_bytes=throttled_bytes
+                    )
+                if not match:
+                    os.remove(staging_path)
+                    raise Exception(f"SHA256校验失败: {item['name']}")
+                self._add_to_content_store(item, staging_path)
+                session.set_file_state(item, STATE_VERIFIED)
+
+            pending = [item for item in wanted if not self._session_file_verified(session, item)]
+            failures = {}
+            while pending and not stopped():
+                wait_for_game_exit()
+                if stopped():
+                    break
+                scheduled = self.download_scheduler.run(
+                    pending,
+                    fetch_single,
+                    size_of=lambda f: f.get('size', 0),
+                    cancel_check=interrupted
+                )
+                round_failed = False
+                for item, future in scheduled:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        if stopped() or game_running.is_set() or "cancelled" in str(e).lower():
+                            continue
+                        round_failed = True
+                        failures[item['_staging_abs']] = failures.get(item['_staging_abs'], 0) + 1
+                        if failures[item['_staging_abs']] >= 3:
+                            self.log(f"[后台预取] {item['name']} 多次失败，留给正式更新下载: {e}")
+                # 被游戏运行打断、还没派发或失败次数未满的文件留到下一轮
+                pending = [item for item in pending
+                           if failures.get(item['_staging_abs'], 0) < 3 and not self._session_file_verified(session, item)]
+                if pending and round_failed and not game_running.is_set():
+                    # 网络出错时歇一会儿再试，不和前台抢连接
+                    stop_event.wait(30)
+
+            progress = session.progress()
+            if not stopped():
+                self.log(f"[后台预取] 版本 {label}：已就绪 {progress['verified']}/{progress['total']} 个外部文件")
+                if global_window and progress['verified'] == progress['total']:
+                    try:
+                        global_window.evaluate_js(f"showUpdateIslandReady({json.dumps('客户端更新已在后台下载完成，点我安装')})")
+                    except Exception:
+                        pass
+        except Exception as e:
+            if not stopped():
+                self.log(f"[后台预取] 版本 {label} 预取中断: {e}")
+                log_warning(f"后台预取失败: {traceback.format_exc()}")
+        finally:
+            finished.set()
+            if session is not None:
+                if session.manifests is None:
+                    self._drop_update_session(session)
+                else:
+                    session.flush(force=True)
+            self._flush_local_indexes()
+            self._release_idle_connections()
+
+    def _load_resumable_session(self):
+        """读取上次没完成的更新会话；骨架包没取完、工作目录或骨架包里的源文件已不在时返回 None"""
+        session = UpdateSession.load(os.path.join(self.game_root, UPDATE_SESSION_FILE))
+        if session is None or not session.versions or session.manifests is None or len(session.work_dirs) != 2:
+            return None
+        if not all(os.path.isdir(os.path.join(self.game_root, os.path.basename(d))) for d in session.work_dirs):
+            return None
+        for manifest in session.manifests:
+            for action in manifest.get("actions", []):
+                src = action.get("_src_abs")
+                if src and not os.path.exists(src):
+                    return None
+        return session
+
+    def _drop_update_session(self, session=None):
+        """丢弃更新会话，连同它的工作目录和骨架包下载残留"""
+        session = session or UpdateSession.load(os.path.join(self.game_root, UPDATE_SESSION_FILE))
+        if session is None:
+            return
+        for name in session.work_dirs:
+            d = os.path.join(self.game_root, os.path.basename(str(name)))
+            if os.path.exists(d):
+                try: shutil.rmtree(d)
+                except: pass
+        for save_path in session.save_paths:
+            save_path = os.path.join(self.game_root, os.path.basename(str(save_path)))
+            if os.path.exists(save_path):
+                try: os.remove(save_path)
+                except: pass
+            try: discard_part(save_path)
+            except: pass
+        session.discard()
+
+    def _open_update_session(self, entries, work_dirs):
+        """上次同样版本、同一组工作目录的更新没下完时沿用它；否则丢弃旧会话、清空工作目录，开一个新会话"""
+        versions = [e.get("version") for e in entries]
+        session = self._load_resumable_session()
+        if session is not None and session.matches(versions, work_dirs):
+            return session
+        self._drop_update_session(session)
+        for name in work_dirs:
+            d = os.path.join(self.game_root, name)
+            if os.path.exists(d):
+                shutil.rmtree(d)
+        return UpdateSession.create(os.path.join(self.game_root, UPDATE_SESSION_FILE), versions, work_dirs)
+
+    def _session_file_verified(self, session, item):
+        """上次已校验过、之后没被动过（或重新核对哈希仍一致）的暂存文件可以直接使用"""
+        entry = session.file_state(item['_staging_abs'])
+        staging_path = item['_staging_abs']
+        if not entry or entry.get("state") != STATE_VERIFIED or not os.path.isfile(staging_path):
+            return False
+        if entry.get("sha256") != str(item.get('sha256') or '').lower():
+            return False
+        st = os.stat(staging_path)
+        if entry.get("stat") == [st.st_size, st.st_mtime_ns]:
+            return True
+        return bool(item.get('sha256')) and self._verify_sha256(staging_path, item['sha256'])[0]
+
+    def _describe_resumable_update(self, versions):
+        """versions 中包含上次没下完的更新时返回其进度，供前端提示可以继续"""
+        session = self._load_resumable_session()
+        if session is None or not set(session.versions) <= {str(v) for v in versions if v}:
+            return None
+        return dict(session.progress(), versions=session.versions)
+
+    def discard_update_session(self):
+        """供前端调用：放弃上次没下完的更新，下次从头下载"""
+        if self.update_stage != 0:
+            return {"success": False, "error": "正在更新，无法清理"}
+        self._stop_background_prefetch()
+        self._drop_update_session()
+        self.log("已清理上次未完成的更新下载")
+        return {"success": True}
+
+    def _perform_single_update(self, url, source_type, prefetched=None, on_staged=None, version=None):
+        return self._perform_update_batch([{"version": version, "url": url}], source_type, prefetched=prefetched, on_staged=on_staged)
+
+    def _perform_update_batch(self, entries, source_type, prefetched=None, on_staged=None):
+        """
+        原子性更新：
+        阶段1 - 下载所有文件到暂存区并校验
+        阶段2 - 备份旧文件 → 执行 actions → 移动新文件
+        失败时自动回滚
+        entries 为按版本从旧到新排列的 {"version", "url"}；多于一个时先下载全部骨架包，
+        用 squash_update_manifests() 合并成一次更新，只下载、备份和应用一次。
+        成功返回 True，用户取消返回 False，其他失败抛出异常。
+        prefetched 是 _prefetch_update() 的结果：直接使用其中的骨架包和已校验的暂存文件。
+        on_staged 在阶段1完成、开始备份和应用之前调用，流水线更新借此开始预取下一个版本。
+        """
+        work_dirs = prefetched["work_dirs"] if prefetched else UPDATE_WORK_DIRS[0]
+        temp_dir = os.path.join(self.game_root, work_dirs[0])
+        staging_dir = os.path.join(self.game_root, work_dirs[1])
+        backup_dir = None
+        journal = None
+        session = None
+        save_paths = list(prefetched["save_paths"]) if prefetched else []
+        use_prefetched = bool(prefetched and prefetched.get("manifests"))
+
+        try:
+            # 上次同样版本的更新没下完时沿用其工作目录，否则清理旧的暂存目录（预取成功时保留其中的骨架包和暂存文件）
+            if use_prefetched:
+                session = UpdateSession.create(os.path.join(self.game_root, UPDATE_SESSION_FILE), [e.get("version") for e in entries], work_dirs)
+            else:
+                session = self._open_update_session(entries, work_dirs)
+            os.makedirs(staging_dir, exist_ok=True)
+
+            self.log("=== 阶段1：下载并校验 ===")
+            self.update_stage = 1
+            self.cancel_event.clear()
+
+            # manifest.json 一解出就在后台开始校验本地已有文件，与骨架包剩余部分的下载重叠
+            prehash_threads = []
+            if session.manifests is not None:
+                manifests = session.manifests
+                save_paths = session.save_paths
+                progress = session.progress()
+                self.log(f"继续上次未完成的更新：已校验 {progress['verified']}/{progress['total']} 个外部文件，下载到一半的文件将续传")
+            else:
+                if use_prefetched:
+                    manifests = prefetched["manifests"]
+                    self.log("使用预取的配置包")
+                else:
+                    manifests = self._fetch_update_manifests(
+                        entries, source_type, temp_dir, staging_dir, save_paths, prehash_threads
+                    )
+                session.set_manifests(manifests, save_paths)
+
+            if len(manifests) == 1:
+                actions = manifests[0]["actions"]
+                external_files = manifests[0]["external_files"]
+                version_str = manifests[0]["version"] or time.strftime('%y.%m.%d.%H.%M')
+            else:
+                plan = squash_update_manifests(manifests)
+                actions = plan["actions"]
+                external_files = plan["external_files"]
+                version_str = manifests[-1]["version"] or time.strftime('%y.%m.%d.%H.%M')
+                self.log(
+                    f"已合并 {len(manifests)} 个版本：{len(external_files)} 个外部文件、{len(actions)} 个操作，"
+                    f"{plan['superseded_files']} 个外部文件被后续版本覆盖或删除，无需下载"
+                )
+                log_info(f"合并更新计划: versions={[m['version'] for m in manifests]}, dropped_writes={plan['dropped_writes']}")
             total_ops = len(actions) + len(external_files)
             current_op = [0]
             progress_lock = threading.Lock()
@@ -5421,6 +7438,8 @@ class Api:
 
             # 下载 external_files 到暂存区
             files_to_download = []
+            for t in prehash_threads:
+                t.join()
 
             for item in external_files:
                 target_path = item['_target_abs']
@@ -5437,8 +7456,12 @@ class Api:
                 expected_sha = item.get('sha256', '')
                 if os.path.exists(target_path):
                     if expected_sha:
-                        match, _ = self._verify_sha256(target_path, expected_sha)
-                        if match:
+                        match, actual = self._verify_local_sha256(target_path, expected_sha)
+                        item['_local_sha256'] = actual
+                        if match and item.get('_deleted_by_plan'):
+                            # 合并计划里更早的删除会先删掉它，收入本地文件库后照常暂存，不必重新下载
+                            self._add_to_content_store(item, target_path)
+                        elif match:
                             current_op[0] += 1
                             dl_status[item['name']]['state'] = 'skipped'
                             dl_status[item['name']]['percent'] = 100
@@ -5446,7 +7469,7 @@ class Api:
                             report_step(f"跳过(hash匹配): {item['name']}")
                             log_info(f"跳过已存在文件(SHA256匹配): {item['name']}")
                             continue
-                    elif abs(os.path.getsize(target_path) - item.get('size', 0)) < 1024:
+                    elif not item.get('_deleted_by_plan') and abs(os.path.getsize(target_path) - item.get('size', 0)) < 1024:
                         current_op[0] += 1
                         dl_status[item['name']]['state'] = 'skipped'
                         dl_status[item['name']]['percent'] = 100
@@ -5455,12 +7478,38 @@ class Api:
                         continue
 
                 files_to_download.append(item)
+            session.track(files_to_download)
 
-            # 并行下载到暂存区
-            max_workers = self.cfg_mgr.config.get("parallel_downloads", 3)
+            # 本地文件库命中的文件直接放进暂存区；本地有基准版本的文件只下载差分
+            def mark_staged(item, label):
+                session.set_file_state(item, STATE_VERIFIED)
+                with progress_lock:
+                    current_op[0] += 1
+                    dl_status[item['name']]['state'] = 'skipped'
+                    dl_status[item['name']]['percent'] = 100
+                    dl_status[item['name']]['downloaded'] = item.get('size', 0)
+                report_step(f"{label}: {item['name']}")
+
+            prestaged = prefetched["staged"] if use_prefetched else set()
+            files_to_stage = []
+            for item in files_to_download:
+                if item['_staging_abs'] in prestaged and os.path.isfile(item['_staging_abs']):
+                    self._add_to_content_store(item, item['_staging_abs'])
+                    mark_staged(item, "已预取")
+                elif self._session_file_verified(session, item):
+                    mark_staged(item, "上次已下载")
+                else:
+                    files_to_stage.append(item)
+
+            files_to_fetch = self._stage_from_content_store(files_to_stage, on_hit=lambda item: mark_staged(item, "本地文件库命中"))
+            files_to_fetch = self._stage_from_delta_patches(files_to_fetch, source_type, on_hit=lambda item: mark_staged(item, "差分更新"))
+            files_to_fetch = self._stage_from_local_chunks(files_to_fetch, source_type, on_hit=lambda item: mark_staged(item, "按块拼装"))
+
+            # 并行下载到暂存区（全局调度器决定派发顺序、并发和限速）
+            max_workers = self.download_scheduler.concurrency.limit
             download_errors = []
             total_downloaded_bytes = [0]
-            total_bytes = sum(f.get('size', 0) for f in files_to_download)
+            total_bytes = sum(f.get('size', 0) for f in files_to_fetch)
             dl_start_time = time.time()
 
             def download_single(item):
@@ -5469,6 +7518,7 @@ class Api:
 
                 staging_path = item['_staging_abs']
                 os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+                session.set_file_state(item, STATE_PARTIAL)
 
                 file_dl_state = {'downloaded': 0}
 
@@ -5517,18 +7567,22 @@ class Api:
                                 dl_status[item['name']]['state'] = f'retry {retry}'
                                 push_detailed_payload(min(99, int(total_downloaded_bytes[0] * 100 / total_bytes) if total_bytes > 0 else 0), "--", total_downloaded_bytes[0], total_bytes, "--")
                                 
-                        self._download_with_candidates_resumable(
+                        digest = self._new_download_digest(item)
+                        source_url = self._download_with_hedging(
                             candidates_for_file,
                             staging_path,
                             progress_cb=file_report,
                             connect_timeout=8,
                             stall_timeout=12,
-                            log_context=f"external:{item['name']}"
+                            log_context=f"external:{item['name']}",
+                            digest=digest
                         )
 
                         if expected_sha:
                             self.log(f"开始SHA256校验: {item['name']}")
-                            match, actual = self._verify_sha256(staging_path, expected_sha)
+                            match, actual = self._verify_download_digest(staging_path, expected_sha, digest)
+                            if not match and self._repair_download_chunks(item, staging_path, candidates_for_file, digest, bad_source=source_url):
+                                match = True
                             if not match:
                                 if retry < max_retries:
                                     self.log(f"校验失败 (重试 {retry+1}): {item['name']}")
@@ -5540,6 +7594,8 @@ class Api:
                             else:
                                 self.log(f"SHA256校验通过: {item['name']}")
                                 log_info(f"SHA256校验通过: {item['name']}")
+                                self._add_to_content_store(item, staging_path)
+                        session.set_file_state(item, STATE_VERIFIED)
 
                         with progress_lock:
                             current_op[0] += 1
@@ -5557,25 +7613,28 @@ class Api:
                             raise
                 return False
 
-            if files_to_download:
-                self.log(f"开始下载 {len(files_to_download)} 个文件 (并发: {max_workers})...")
-                log_info(f"并行下载启动: {len(files_to_download)} 个文件, max_workers={max_workers}")
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    futures = {executor.submit(download_single, item): item for item in files_to_download}
-                    for future in as_completed(futures):
-                        item = futures[future]
-                        try:
-                            future.result()
-                        except Exception as e:
-                            download_errors.append(f"{item['name']}: {e}")
-                            self.log(f"下载失败: {item['name']} - {e}")
-                            log_error(f"文件下载失败: {item['name']} - {e}")
+            if files_to_fetch:
+                self.log(f"开始下载 {len(files_to_fetch)} 个文件 (并发: {max_workers})...")
+                log_info(f"并行下载启动: {len(files_to_fetch)} 个文件, max_workers={max_workers}")
+                scheduled = self.download_scheduler.run(
+                    files_to_fetch,
+                    download_single,
+                    size_of=lambda f: f.get('size', 0),
+                    cancel_check=self.cancel_event.is_set
+                )
+                for item, future in scheduled:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        download_errors.append(f"{item['name']}: {e}")
+                        self.log(f"下载失败: {item['name']} - {e}")
+                        log_error(f"文件下载失败: {item['name']} - {e}")
 
             if self.cancel_event.is_set() or any("cancelled" in str(e).lower() for e in download_errors):
-                self.log("更新已被用户取消。清理暂存区...")
+                self.log("更新已被用户取消。已下载的文件保留在暂存区，下次更新同样的版本时继续")
                 if global_window:
                     global_window.evaluate_js("onUpdateCancelled()")
-                return
+                return False
 
             if download_errors:
                 raise Exception(f"以下文件下载失败:\n" + "\n".join(download_errors))
@@ -5583,17 +7642,23 @@ class Api:
             self.update_stage = 2
             if global_window:
                 global_window.evaluate_js("disableCancelButton()")
+            # 进入应用阶段后暂存区会被移空，会话不再可续；中途退出由应用日志恢复
+            session.discard()
+            session = None
 
             self.log("阶段1完成：所有文件已下载并校验通过")
             log_info("阶段1完成: 所有文件下载校验通过")
+            if on_staged:
+                on_staged()
 
             # ======== 阶段2：备份旧文件 → 应用更新 ========
             self.log("=== 阶段2：应用更新 ===")
             if global_window:
                 global_window.evaluate_js("onUpdateApplying()")
 
-            # 收集所有受影响的文件路径（用于备份）
-            affected_paths = self._collect_action_affected_paths(actions)
+            # 收集所有受影响的文件路径（用于备份）；目录只扫描一次，应用阶段沿用同一份快照
+            fs_snapshot = self._build_update_fs_snapshot(actions)
+            affected_paths = self._collect_action_affected_paths(actions, fs_snapshot)
 
             for item in files_to_download:
                 target_path = item['_target_abs']
@@ -5601,29 +7666,38 @@ class Api:
                     affected_paths.append(target_path)
 
             # 创建备份
-            version_str = data.get('version', time.strftime('%y.%m.%d.%H.%M'))
             if affected_paths:
                 backup_dir = self._create_backup(version_str, affected_paths)
 
+            # 改动游戏目录前写应用日志，进程中途退出时下次启动据此继续完成或回滚
+            files_to_install = [item for item in files_to_download if os.path.exists(item['_staging_abs'])]
+            journal = self._begin_apply_journal(
+                version_str, [m["version"] for m in manifests], backup_dir, work_dirs, save_paths,
+                actions, fs_snapshot, files_to_install
+            )
+
             try:
                 # 执行 Actions
-                for action in actions:
+                for index, action in enumerate(actions):
                     current_op[0] += 1
                     report_step(self._get_update_action_label(action))
-                    self._apply_update_action(action)
+                    self._apply_update_action(action, fs_snapshot)
+                    if journal: journal.mark_done(index)
 
                 # 从暂存区移动文件到目标位置
-                for item in files_to_download:
-                    staging_path = item['_staging_abs']
+                for index, item in enumerate(files_to_install, len(actions)):
                     target_path = item['_target_abs']
-                    if os.path.exists(staging_path):
-                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                        shutil.move(staging_path, target_path)
-                        self.log(f"已安装: {item['name']}")
-                        log_info(f"文件安装完成: {item['name']} -> {item['path']}")
+                    move_replacing(item['_staging_abs'], target_path)
+                    self._record_installed_file(item, target_path)
+                    if journal: journal.mark_done(index)
+                    self.log(f"已安装: {item['name']}")
+                    log_info(f"文件安装完成: {item['name']} -> {item['path']}")
 
+                if journal: journal.commit()
                 self.log("阶段2完成：更新已成功应用")
                 log_info("阶段2完成: 更新成功应用")
+                self._trim_content_store()
+                return True
 
             except Exception as e:
                 self.log(f"更新应用失败: {e}，正在自动回滚...")
@@ -5633,13 +7707,25 @@ class Api:
                 raise
 
         finally:
-            for d in [temp_dir, staging_dir]:
-                if os.path.exists(d):
-                    try: shutil.rmtree(d)
+            self._flush_local_indexes()
+            if session is not None and session.manifests is not None:
+                # 阶段1没走完（取消、下载失败或程序退出）：保留工作目录和 .part，下次更新同样的版本时继续
+                session.flush(force=True)
+            else:
+                if session is not None:
+                    session.discard()
+                for d in [temp_dir, staging_dir]:
+                    if os.path.exists(d):
+                        try: shutil.rmtree(d)
+                        except: pass
+                for save_path in save_paths:
+                    if os.path.exists(save_path):
+                        try: os.remove(save_path)
+                        except: pass
+                    try: discard_part(save_path)
                     except: pass
-            if os.path.exists(save_path):
-                try: os.remove(save_path)
-                except: pass
+            if journal:
+                journal.discard()
 
     # 供前端调用：记录跳过的版本
     def add_skipped_version(self, version):
@@ -5649,9 +7735,18 @@ class Api:
             self.cfg_mgr.save_config({"skipped_versions": skipped})
             self.log(f"已标记跳过: {version}")
 
+    def _migrate_cached_history(self):
+        """旧版本把完整历史存在 launcher_settings.json 的 cached_history 里，首次启动时搬进历史索引"""
+        legacy = self.cfg_mgr.config.pop("cached_history", None)
+        if legacy is None:
+            return
+        if isinstance(legacy, list) and legacy and self.history_index.is_empty():
+            self.history_index.update_head([item for item in legacy if isinstance(item, dict)])
+        self.cfg_mgr.save_config({})
+
     def get_cached_history(self):
-        """从本地缓存读取更新历史记录，供更新日志时间线视图使用"""
-        cached = self.cfg_mgr.config.get("cached_history", [])
+        """从本地历史索引读取更新历史记录，供更新日志时间线视图使用"""
+        cached = self.history_index.history()
         if cached:
             # 按版本号从新到旧排序
             cached_sorted = sort_versioned_items(cached, reverse=True)
@@ -5691,7 +7786,11 @@ class Api:
                 global_window.evaluate_js("alert('获取历史版本列表失败，请检查网络连接。')")
             return
 
-        history = data.get('history', [])
+        history = self._sync_history_feed(data, success_urls)
+        if history is None:
+            if global_window:
+                global_window.evaluate_js("alert('部分历史版本分页获取失败，请检查网络连接。')")
+            return
         if not history:
             if global_window:
                 global_window.evaluate_js("alert('未找到任何历史版本记录。')")
@@ -5703,6 +7802,187 @@ class Api:
         if global_window:
             global_window.evaluate_js(f"showForceUpdateModal({json.dumps(history_sorted)})")
 
+    # ── 完整性校验与修复 ─────────────────────────────────────────────────────
+
+    def verify_client_install(self):
+        """按当前版本的完整安装清单校验客户端（后台线程），结果通过 onInstallVerifyResult 推给前端"""
+        if self.update_stage != 0:
+            return {"success": False, "error": "正在更新，请稍后再校验"}
+        threading.Thread(target=self._verify_install_thread, daemon=True).start()
+        return {"success": True}
+
+    def _resolve_install_manifest_url(self):
+        configured = str(self.cfg_mgr.config.get("install_manifest_url", "") or "").strip()
+        if configured:
+            return configured
+        local_ver = self.get_local_version()
+        for item in self.history_index.history():
+            if str(item.get("version")) == local_ver and item.get("install_manifest_url"):
+                return item["install_manifest_url"]
+        return None
+
+    def _verify_install_thread(self):
+        def push(payload):
+            if global_window:
+                try:
+                    global_window.evaluate_js(f"onInstallVerifyResult({json.dumps(payload, ensure_ascii=False)})")
+                except Exception:
+                    pass
+
+        try:
+            url = self._resolve_install_manifest_url()
+            if not url:
+                raise Exception(f"版本 {self.get_local_version()} 没有提供完整安装清单 (install_manifest_url)")
+            self.log("正在获取完整安装清单...")
+            data, _, _ = self._fetch_json_from_urls(self._build_download_candidates(url, 'cn'), fetch_label="完整安装清单")
+            if data is None:
+                raise Exception("完整安装清单获取失败，请检查网络连接")
+            manifest = parse_install_manifest(data)
+
+            started_at = time.time()
+            self.log(f"开始校验 {len(manifest['files'])} 个文件...")
+            report = scan_install(self.game_root, manifest, resolve_relative_path, self.file_hash_cache.hash_many)
+            self.file_hash_cache.flush()
+            self._install_report = {"manifest": manifest, "report": report}
+
+            broken = report["missing"] + report["modified"]
+            repairable = [item for item in broken if item.get("url")]
+            self.log(
+                f"校验完成（{time.time() - started_at:.1f}s）：正常 {report['ok']}，缺失 {len(report['missing'])}，"
+                f"被改动 {len(report['modified'])}，多余 {len(report['extra'])}，可修复 {len(repairable)}"
+            )
+            push({
+                "ok": True,
+                "version": manifest.get("version") or self.get_local_version(),
+                "ok_count": report["ok"],
+                "missing": [item["path"] for item in report["missing"]][:INSTALL_REPORT_LIST_LIMIT],
+                "modified": [item["path"] for item in report["modified"]][:INSTALL_REPORT_LIST_LIMIT],
+                "extra": report["extra"][:INSTALL_REPORT_LIST_LIMIT],
+                "missing_count": len(report["missing"]),
+                "modified_count": len(report["modified"]),
+                "extra_count": len(report["extra"]),
+                "repairable_count": len(repairable),
+            })
+        except Exception as e:
+            self.log(f"完整性校验失败: {e}")
+            log_error(f"完整性校验异常: {traceback.format_exc()}")
+            push({"ok": False, "error": str(e)})
+
+    def repair_client_install(self, source_type='global', remove_extras=False):
+        """只下载上次校验发现缺失或被改动的文件并替换（后台线程），可选同时删除多余文件"""
+        if self.update_stage != 0:
+            return {"success": False, "error": "正在更新，请稍后再修复"}
+        if not self._install_report:
+            return {"success": False, "error": "请先校验客户端完整性"}
+        threading.Thread(target=self._repair_install_thread, args=(source_type, bool(remove_extras)), daemon=True).start()
+        return {"success": True}
+
+    def _repair_install_thread(self, source_type, remove_extras):
+        report = self._install_report["report"]
+        manifest = self._install_report["manifest"]
+        staging_dir = os.path.join(self.game_root, "temp_repair_staging")
+        backup_dir = None
+        items = []
+        for entry in report["missing"] + report["modified"]:
+            if not entry.get("url"):
+                self.log(f"无法修复（清单未提供下载地址）: {entry['path']}")
+                continue
+            item = dict(entry, name=os.path.basename(entry["_target_abs"]))
+            item["_staging_abs"] = resolve_relative_path(staging_dir, os.path.relpath(entry["_target_abs"], self.game_root))
+            items.append(item)
+        extras = [resolve_relative_path(self.game_root, rel) for rel in report["extra"]] if remove_extras else []
+
+        try:
+            if os.path.exists(staging_dir):
+                shutil.rmtree(staging_dir)
+            os.makedirs(staging_dir, exist_ok=True)
+            self.update_stage = 1
+            self.cancel_event.clear()
+
+            files_to_fetch = self._stage_from_content_store(items, on_hit=lambda item: self.log(f"本地文件库命中: {item['name']}"))
+            files_to_fetch = self._stage_from_local_chunks(files_to_fetch, source_type)
+            self.log(f"开始修复：需下载 {len(files_to_fetch)} 个文件，本地文件库命中 {len(items) - len(files_to_fetch)} 个")
+
+            def fetch_single(item):
+                def report_cancel(block_num, block_size, total_size):
+                    if self.cancel_event.is_set():
+                        raise Exception("Update cancelled by user")
+
+                os.makedirs(os.path.dirname(item['_staging_abs']), exist_ok=True)
+                candidates_for_file = self._build_download_candidates(item['url'], source_type)
+                digest = self._new_download_digest(item)
+                source_url = self._download_with_hedging(
+                    candidates_for_file,
+                    item['_staging_abs'],
+                    progress_cb=report_cancel,
+                    connect_timeout=8,
+                    stall_timeout=12,
+                    log_context=f"repair:{item['name']}",
+                    digest=digest
+                )
+                match, actual = self._verify_download_digest(item['_staging_abs'], item['sha256'], digest)
+                if not match and self._repair_download_chunks(item, item['_staging_abs'], candidates_for_file, digest, bad_source=source_url):
+                    match = True
+                if not match:
+                    raise Exception(f"SHA256校验失败: {item['name']}")
+                self._add_to_content_store(item, item['_staging_abs'])
+                self.log(f"已下载: {item['name']}")
+
+            errors = []
+            scheduled = self.download_scheduler.run(
+                files_to_fetch,
+                fetch_single,
+                size_of=lambda f: f.get('size', 0),
+                cancel_check=self.cancel_event.is_set
+            )
+            for item, future in scheduled:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(f"{item['name']}: {e}")
+            if self.cancel_event.is_set():
+                raise Exception("Update cancelled by user")
+            if errors:
+                raise Exception("以下文件下载失败:\n" + "\n".join(errors))
+
+            self.update_stage = 2
+            affected_paths = [item['_target_abs'] for item in items if os.path.exists(item['_target_abs'])] + extras
+            if affected_paths:
+                backup_dir = self._create_backup(f"repair_{manifest.get('version') or self.get_local_version()}", affected_paths)
+            try:
+                for item in items:
+                    move_replacing(item['_staging_abs'], item['_target_abs'])
+                    self._record_installed_file(item, item['_target_abs'])
+                    self.log(f"已修复: {item['path']}")
+                for path in extras:
+                    os.remove(path)
+                    self.log(f"已删除多余文件: {os.path.relpath(path, self.game_root)}")
+            except Exception as e:
+                self.log(f"修复应用失败: {e}，正在自动回滚...")
+                if backup_dir:
+                    self._restore_backup(backup_dir)
+                raise
+            self._trim_content_store()
+            self._install_report = None
+            message = f"修复完成：替换 {len(items)} 个文件" + (f"，删除 {len(extras)} 个多余文件" if extras else "")
+            self.log(message)
+            self._add_activity_log("install_repaired", {"files": len(items), "extras_removed": len(extras)})
+            self._safe_js_alert(message)
+        except Exception as e:
+            if self.cancel_event.is_set() or "cancelled" in str(e).lower():
+                self.log("修复已取消")
+            else:
+                self.log(f"修复失败: {e}")
+                log_error(f"完整性修复异常: {traceback.format_exc()}")
+                self._safe_js_alert(f"修复失败: {e}")
+        finally:
+            self.update_stage = 0
+            self._flush_local_indexes()
+            self._release_idle_connections()
+            if os.path.exists(staging_dir):
+                try: shutil.rmtree(staging_dir)
+                except: pass
+
     # ── Modrinth Mod Search ──────────────────────────────────────────────────
 
     def _get_installed_mod_filenames(self):
@@ -5873,7 +8153,8 @@ class Api:
                     file_url,
                     headers={"User-Agent": f"TCYClientUpdater/{LAUNCHER_INTERNAL_VERSION} (tcymc.space)"},
                 )
-                with self._urlopen_with_policy(req, timeout=15, url=file_url) as resp:
+                # 与更新下载共用全局调度器的并发槽位和限速
+                with self.download_scheduler.slot(), self._urlopen_with_policy(req, timeout=15, url=file_url) as resp:
                     try:
                         total_size = int(resp.headers.get("Content-Length", -1))
                     except Exception:
@@ -5882,10 +8163,11 @@ class Api:
                     start_ts = time.time()
                     with open(dest_path, "wb") as out:
                         while True:
-                            chunk = resp.read(64 * 1024)
+                            chunk = resp.read(DOWNLOAD_BLOCK_SIZE)
                             if not chunk:
                                 break
                             out.write(chunk)
+                            self.download_scheduler.throttle(len(chunk))
                             downloaded += len(chunk)
                             percent = int(downloaded * 100 / total_size) if total_size > 0 else -1
                             elapsed = time.time() - start_ts
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# 应用阶段（阶段2）的预写日志。开始改动游戏目录之前，先把本次要执行的全部步骤写进日志并 fsync：
+# 每一步是按目录快照展开好的基本操作（rm 删除 / mkdir 建目录 / copy 复制 / move 从暂存区移入），
+# 另外记下备份目录、工作目录和要清理的下载文件。每完成一步追加一行 done 记录，按批 fsync；
+# 基本操作可以重复执行，最后几条 done 没落盘只会让这几步在恢复时再做一次。全部完成后写 commit 记录。
+# 进程在阶段2中途退出时日志留在磁盘上，下次启动由更新器读取：暂存文件都还在就继续完成剩余步骤，否则从备份回滚。
+import json
+import os
+import time
+
+
+JOURNAL_FORMAT_VERSION = 1
+SYNC_EVERY_STEPS = 32
+SYNC_INTERVAL_SECONDS = 0.5
+
+
+class ApplyJournal:
+    """一次应用阶段的日志文件，按行追加 JSON 记录"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = 0.0
+
+    def begin(self, plan):
+        """写入计划并落盘，返回之后才能开始执行步骤。plan 至少包含 steps: [{"label", "ops"}]"""
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._append(dict(plan, type="begin", version=JOURNAL_FORMAT_VERSION))
+        self._sync()
+
+    def mark_done(self, step):
+        self._append({"type": "done", "step": step})
+        self._unsynced += 1
+        if self._unsynced >= SYNC_EVERY_STEPS or time.monotonic() - self._last_sync >= SYNC_INTERVAL_SECONDS:
+            self._sync()
+
+    def commit(self):
+        self._append({"type": "commit"})
+        self._sync()
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def discard(self):
+        """应用结束（成功或已在进程内回滚）并清理完工作目录后删除日志"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+
+def load_journal(path):
+    """
+    读取上次留下的日志，返回 {"plan", "done": 已完成步骤的集合, "committed"}。
+    没有日志、缺少 begin 记录或格式版本不认识时返回 None；末尾写了一半的行及其后的内容忽略。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return None
+    plan = None
+    done = set()
+    committed = False
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        if not isinstance(record, dict):
+            break
+        record_type = record.get("type")
+        if record_type == "begin":
+            if record.get("version") != JOURNAL_FORMAT_VERSION or not isinstance(record.get("steps"), list):
+                return None
+            plan = record
+        elif plan is None:
+            break
+        elif record_type == "done" and isinstance(record.get("step"), int):
+            done.add(record["step"])
+        elif record_type == "commit":
+            committed = True
+    if plan is None:
+        return None
+    return {"plan": plan, "done": done, "committed": committed}
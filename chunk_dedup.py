@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# 按内容切块去重（类似 casync）：外部文件的 chunks 块表按内容切分时，相同内容在不同版本、不同文件里会切出同样的块。
+# 更新器先从本地已有文件（旧版本的目标文件、本地文件库对象、哈希索引里记得的文件）中按块哈希找齐能复用的块，
+# 在暂存区拼出新文件，只用 Range 请求下载本地没有的块。
+# 本地文件由哪些块组成记在 chunk_index.json（按整文件 sha256 记录块表和最近一次安装到的路径），装入过带块表的文件后才有记录。
+# 块表由发布端按内容切分生成，见 publish_tools.create_chunk_table。
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+MAX_RUN_BYTES = 8 * 1024 * 1024
+MAX_INDEX_FILES = 5000
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+def locate_local_chunks(sources):
+    """sources 为 [(本地文件路径, 该文件的块表)]，返回 {块 sha256: (路径, 偏移, 大小)}，同一个块取第一个来源"""
+    located = {}
+    for path, chunks in sources:
+        for chunk in chunks:
+            located.setdefault(chunk["sha256"], (path, chunk["offset"], chunk["size"]))
+    return located
+
+
+def plan_chunk_assembly(chunks, located):
+    """
+    对照本地可用块规划拼装：返回 {"local": [(块, 路径, 源偏移)], "missing": [块], "reused_bytes", "missing_bytes"}。
+    大小对不上的同哈希块不复用。
+    """
+    local = []
+    missing = []
+    for chunk in chunks:
+        hit = located.get(chunk["sha256"])
+        if hit and hit[2] == chunk["size"]:
+            local.append((chunk, hit[0], hit[1]))
+        else:
+            missing.append(chunk)
+    return {
+        "local": local,
+        "missing": missing,
+        "reused_bytes": sum(chunk["size"] for chunk, _, _ in local),
+        "missing_bytes": sum(chunk["size"] for chunk in missing),
+    }
+
+
+def chunk_runs(chunks, max_run_bytes=MAX_RUN_BYTES):
+    """把在目标文件中首尾相接的块合并成连续区间，每个区间用一次 Range 请求取回"""
+    runs = []
+    for chunk in sorted(chunks, key=lambda c: c["offset"]):
+        if runs:
+            last = runs[-1][-1]
+            run_bytes = last["offset"] + last["size"] - runs[-1][0]["offset"]
+            if last["offset"] + last["size"] == chunk["offset"] and run_bytes + chunk["size"] <= max_run_bytes:
+                runs[-1].append(chunk)
+                continue
+        runs.append([chunk])
+    return runs
+
+
+def copy_verified_chunk(src_path, src_offset, out, chunk):
+    """从本地文件读出一块写到 out 的块偏移处，内容与块哈希一致时返回 True"""
+    digest = hashlib.sha256()
+    remaining = chunk["size"]
+    out.seek(chunk["offset"])
+    with open(src_path, "rb") as src:
+        src.seek(src_offset)
+        while remaining > 0:
+            data = src.read(min(COPY_BLOCK_SIZE, remaining))
+            if not data:
+                return False
+            digest.update(data)
+            out.write(data)
+            remaining -= len(data)
+    return digest.hexdigest() == chunk["sha256"]
+
+
+class ChunkIndex:
+    """本地块索引：整文件 sha256 -> 块表和最近安装到的路径，独立于 launcher_settings.json。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = self._load()
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        files = data.get("files") if isinstance(data, dict) else None
+        if not isinstance(files, dict):
+            return {}
+        return {k: v for k, v in files.items() if isinstance(v, dict) and isinstance(v.get("chunks"), list)}
+
+    def record(self, sha256, chunks, path=None):
+        """记下某个已校验文件的块表；path 是它现在所在的位置"""
+        sha256 = str(sha256 or "").strip().lower()
+        if not sha256 or not chunks:
+            return
+        with self._lock:
+            entry = self._files.get(sha256)
+            paths = list(entry.get("paths", [])) if entry else []
+            if path:
+                path = os.path.abspath(path)
+                paths = [path] + [p for p in paths if p != path]
+            self._files[sha256] = {
+                "chunks": [[c["offset"], c["size"], c["sha256"]] for c in chunks],
+                "paths": paths[:4],
+                "recorded_at": time.time(),
+            }
+            self._dirty = True
+
+    def entries(self):
+        """返回 [(sha256, 块表, 路径列表)]"""
+        with self._lock:
+            snapshot = list(self._files.items())
+        return [
+            (sha256, [{"offset": o, "size": s, "sha256": h} for o, s, h in entry["chunks"]], list(entry.get("paths", [])))
+            for sha256, entry in snapshot
+        ]
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return False
+            if len(self._files) > MAX_INDEX_FILES:
+                ordered = sorted(self._files.items(), key=lambda kv: kv[1].get("recorded_at", 0), reverse=True)
+                self._files = dict(ordered[:MAX_INDEX_FILES])
+            snapshot = dict(self._files)
+            self._dirty = False
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "files": snapshot}, f)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            return False
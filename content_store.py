@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+
+STORE_DIR_NAME = ".tcy_content_store"
+INDEX_FILE_NAME = "index.json"
+DEFAULT_BUDGET_BYTES = 4 * 1024 * 1024 * 1024
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def normalize_sha256(value):
+    value = str(value or "").strip().lower()
+    return value if _SHA256_RE.match(value) else None
+
+
+def link_or_copy(src, dest):
+    """优先硬链接（同盘零拷贝），跨盘或文件系统不支持时退回复制。返回 'link' 或 'copy'。"""
+    parent = os.path.dirname(dest)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+        return "link"
+    except OSError:
+        shutil.copy2(src, dest)
+        return "copy"
+
+
+def _sibling_temp_path(dest):
+    return f"{dest}.tcytmp"
+
+
+def link_replacing(src, dest):
+    """把 src 以硬链接（不支持时复制）放到 dest，已有的 dest 整体替换而不是原地改写。返回 'link'、'copy' 或 'same'。"""
+    try:
+        if os.path.samefile(src, dest):
+            return "same"
+    except OSError:
+        pass
+    tmp_path = _sibling_temp_path(dest)
+    mode = link_or_copy(src, tmp_path)
+    os.replace(tmp_path, dest)
+    return mode
+
+
+def copy_replacing(src, dest):
+    """复制到 dest 旁边的临时文件再替换，不改写 dest 原来的数据（它可能是备份或文件库的硬链接）"""
+    parent = os.path.dirname(dest)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    tmp_path = _sibling_temp_path(dest)
+    shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dest)
+    return dest
+
+
+def move_replacing(src, dest):
+    """移动文件并整体替换已有的 dest；跨盘时退回复制后替换"""
+    parent = os.path.dirname(dest)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    try:
+        os.replace(src, dest)
+    except OSError:
+        copy_replacing(src, dest)
+        os.remove(src)
+
+
+class ContentStore:
+    """按 sha256 寻址的本地文件库，跨版本、跨回滚复用已下载过的外部文件。
+
+    对象文件与安装后的文件可能是同一个硬链接，所以索引里记下入库时的大小和 mtime，
+    取用时两者对不上就视为已被改写并丢弃，不会把改过的内容当成缓存命中。
+    索引改动只在内存里标记，由调用方在一次更新结束时 flush() 写盘。
+    """
+
+    def __init__(self, root, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.root = root
+        self.budget_bytes = max(0, int(budget_bytes))
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+        self._dirty = False
+
+    def _index_path(self):
+        return os.path.join(self.root, INDEX_FILE_NAME)
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        entries = data.get("objects") if isinstance(data, dict) else None
+        if not isinstance(entries, dict):
+            return {}
+        return {k: v for k, v in entries.items() if normalize_sha256(k) and isinstance(v, dict)}
+
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self._index_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "objects": self._index}, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _entry_is_intact(self, sha256, entry):
+        try:
+            st = os.stat(self.object_path(sha256))
+        except OSError:
+            return False
+        return st.st_size == entry.get("size") and st.st_mtime_ns == entry.get("mtime_ns")
+
+    def _drop(self, sha256):
+        self._index.pop(sha256, None)
+        self._dirty = True
+        try:
+            os.remove(self.object_path(sha256))
+        except OSError:
+            pass
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(int(e.get("size", 0)) for e in self._index.values())
+
+    def lookup(self, sha256):
+        """返回完好对象的路径，不存在或已被改写时返回 None"""
+        sha256 = normalize_sha256(sha256)
+        if not sha256:
+            return None
+        with self._lock:
+            entry = self._index.get(sha256)
+            if entry is None or not self._entry_is_intact(sha256, entry):
+                return None
+            entry["last_used"] = time.time()
+            self._dirty = True
+            return self.object_path(sha256)
+
+    def materialize(self, sha256, dest_path):
+        """命中时把对象放到 dest_path 并返回 'link'/'copy'，未命中返回 None"""
+        sha256 = normalize_sha256(sha256)
+        if not sha256:
+            return None
+        with self._lock:
+            entry = self._index.get(sha256)
+            if entry is None:
+                return None
+            if not self._entry_is_intact(sha256, entry):
+                self._drop(sha256)
+                return None
+            mode = link_or_copy(self.object_path(sha256), dest_path)
+            entry["last_used"] = time.time()
+            self._dirty = True
+            return mode
+
+    def add(self, sha256, src_path):
+        """把已校验过的文件收入库中；已存在时只刷新最近使用时间"""
+        sha256 = normalize_sha256(sha256)
+        if not sha256 or not os.path.isfile(src_path):
+            return False
+        with self._lock:
+            entry = self._index.get(sha256)
+            if entry is not None and self._entry_is_intact(sha256, entry):
+                entry["last_used"] = time.time()
+                self._dirty = True
+                return True
+            obj_path = self.object_path(sha256)
+            tmp_path = f"{obj_path}.tmp"
+            os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+            link_or_copy(src_path, tmp_path)
+            os.replace(tmp_path, obj_path)
+            st = os.stat(obj_path)
+            self._index[sha256] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "last_used": time.time()}
+            self._dirty = True
+            return True
+
+    def enforce_budget(self, budget_bytes=None):
+        """按最近使用时间淘汰对象直到总大小不超过预算，返回淘汰数量"""
+        budget = self.budget_bytes if budget_bytes is None else max(0, int(budget_bytes))
+        evicted = 0
+        with self._lock:
+            for sha256, entry in list(self._index.items()):
+                if not self._entry_is_intact(sha256, entry):
+                    self._drop(sha256)
+                    evicted += 1
+            total = sum(int(e.get("size", 0)) for e in self._index.values())
+            for sha256, entry in sorted(self._index.items(), key=lambda kv: kv[1].get("last_used", 0)):
+                if total <= budget:
+                    break
+                total -= int(entry.get("size", 0))
+                self._drop(sha256)
+                evicted += 1
+        return evicted
+
+    def flush(self):
+        """有改动时写盘，返回是否写了；写失败时保留改动标记，下次再试"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            try:
+                self._save_index()
+            except OSError:
+                return False
+            self._dirty = False
+            return True
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# TCYDELTA1 二进制差分格式：
+# 文件头为 MAGIC + 基准文件大小(u64) + 目标文件大小(u64)，其后是 zlib 压缩的指令流，
+# COPY(偏移 u64, 长度 u32) 从基准文件复制一段，ADD(长度 u32, 数据) 写入新数据，END 结束。
+# jar/zip 中未改动的条目在新旧版本里字节相同只是位置平移，按块匹配就能编码成 COPY。
+# 这里只有客户端需要的应用和补丁挑选；生成差分在发布端，见 publish_tools.create_delta。
+import hashlib
+import struct
+import zlib
+
+
+MAGIC = b"TCYDELTA1"
+FORMAT_NAME = "tcydelta1"
+READ_BLOCK_SIZE = 1024 * 1024
+
+_OP_END = 0
+_OP_COPY = 1
+_OP_ADD = 2
+_HEADER = struct.Struct(">QQ")
+_COPY = struct.Struct(">QI")
+_LENGTH = struct.Struct(">I")
+
+
+class DeltaPatchError(Exception):
+    pass
+
+
+class _InflateReader:
+    def __init__(self, f):
+        self._f = f
+        self._inflater = zlib.decompressobj()
+        self._buffer = bytearray()
+
+    def read_exact(self, size):
+        while len(self._buffer) < size:
+            # 每次最多解出 READ_BLOCK_SIZE，高压缩比的数据不会一下子撑大缓冲区
+            raw = self._inflater.unconsumed_tail or self._f.read(READ_BLOCK_SIZE)
+            if raw:
+                self._buffer.extend(self._inflater.decompress(raw, READ_BLOCK_SIZE))
+                continue
+            tail = self._inflater.flush()
+            if not tail:
+                raise DeltaPatchError("差分文件被截断")
+            self._buffer.extend(tail)
+        out = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return out
+
+
+def apply_delta(base_path, patch_path, output_path):
+    """把差分应用到 base_path，结果写入 output_path，返回结果的 sha256"""
+    digest = hashlib.sha256()
+    with open(patch_path, "rb") as patch, open(base_path, "rb") as base, open(output_path, "wb") as out:
+        if patch.read(len(MAGIC)) != MAGIC:
+            raise DeltaPatchError("不是 TCYDELTA1 差分文件")
+        header = patch.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise DeltaPatchError("差分文件头不完整")
+        base_size, target_size = _HEADER.unpack(header)
+        base.seek(0, 2)
+        if base.tell() != base_size:
+            raise DeltaPatchError("基准文件大小与差分不符")
+
+        reader = _InflateReader(patch)
+        written = 0
+        while True:
+            op = reader.read_exact(1)[0]
+            if op == _OP_END:
+                break
+            if op == _OP_COPY:
+                offset, length = _COPY.unpack(reader.read_exact(_COPY.size))
+                if offset + length > base_size:
+                    raise DeltaPatchError("COPY 超出基准文件范围")
+                base.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    chunk = base.read(min(READ_BLOCK_SIZE, remaining))
+                    if not chunk:
+                        raise DeltaPatchError("基准文件读取不完整")
+                    out.write(chunk)
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                written += length
+            elif op == _OP_ADD:
+                (length,) = _LENGTH.unpack(reader.read_exact(_LENGTH.size))
+                if written + length > target_size:
+                    raise DeltaPatchError("差分输出超出目标大小")
+                remaining = length
+                while remaining > 0:
+                    chunk = reader.read_exact(min(READ_BLOCK_SIZE, remaining))
+                    out.write(chunk)
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                written += length
+            else:
+                raise DeltaPatchError(f"未知差分指令: {op}")
+            if written > target_size:
+                raise DeltaPatchError("差分输出超出目标大小")
+        if written != target_size:
+            raise DeltaPatchError("差分输出大小与目标不符")
+    return digest.hexdigest()
+
+
+def select_patch(patches, available_base_hashes):
+    """从 manifest 的 patches 列表里挑第一个基准哈希本地可用、格式受支持的补丁"""
+    if not isinstance(patches, list):
+        return None
+    for patch in patches:
+        if not isinstance(patch, dict) or not patch.get("url"):
+            continue
+        if str(patch.get("format", FORMAT_NAME)).lower() != FORMAT_NAME:
+            continue
+        base_sha = str(patch.get("base_sha256", "")).lower()
+        if base_sha and base_sha in available_base_hashes:
+            return patch
+    return None
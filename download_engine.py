@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import re
+import time
+
+
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+PART_SUFFIX = ".part"
+SIDECAR_SUFFIX = ".part.json"
+HEDGE_SUFFIX = ".hedge"
+DEFAULT_SEGMENT_COUNT = 4
+MAX_SEGMENT_COUNT = 16
+MIN_SEGMENT_BYTES = 4 * 1024 * 1024
+HASH_READ_BLOCK_SIZE = 1024 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r"^\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$", re.IGNORECASE)
+
+
+def parse_content_range(value):
+    match = _CONTENT_RANGE_RE.match(str(value or ""))
+    if not match:
+        return None
+    total = match.group(3)
+    return int(match.group(1)), int(match.group(2)), (int(total) if total != "*" else None)
+
+
+def should_use_segmented_download(probe, segment_count, min_size_bytes):
+    if int(segment_count or 1) < 2 or not isinstance(probe, dict):
+        return False
+    if not probe.get("ok") or not probe.get("range_supported"):
+        return False
+    remote_size = probe.get("remote_size")
+    if not isinstance(remote_size, int) or remote_size < max(int(min_size_bytes or 0), 1):
+        return False
+    content_encoding = (probe.get("content_encoding") or "").lower()
+    return not content_encoding or content_encoding == "identity"
+
+
+def plan_segments(total_size, segment_count, min_segment_bytes=MIN_SEGMENT_BYTES):
+    total = int(total_size or 0)
+    if total <= 0:
+        return []
+
+    count = max(1, min(int(segment_count or 1), MAX_SEGMENT_COUNT))
+    if min_segment_bytes:
+        count = max(1, min(count, total // int(min_segment_bytes) or 1))
+
+    base, extra = divmod(total, count)
+    segments = []
+    start = 0
+    for index in range(count):
+        length = base + (1 if index < extra else 0)
+        segments.append({"index": index, "start": start, "end": start + length - 1, "done": 0})
+        start += length
+    return segments
+
+
+def segment_remaining(segment):
+    return max(0, segment["end"] - segment["start"] + 1 - segment["done"])
+
+
+def segments_downloaded_bytes(segments):
+    return sum(int(item.get("done", 0)) for item in segments or [])
+
+
+def contiguous_prefix_bytes(segments):
+    total = 0
+    for item in segments or []:
+        total += int(item.get("done", 0))
+        if segment_remaining(item) > 0:
+            break
+    return total
+
+
+class StaleResumeError(Exception):
+    pass
+
+
+class DownloadAbortedError(Exception):
+    """并行下载中这一路已被叫停（另一路先完成或整体失败），不应再换下载源重试"""
+
+
+def should_start_hedge(elapsed_seconds, transferred_bytes, delay_seconds, min_bytes_per_second):
+    if elapsed_seconds < max(float(delay_seconds or 0), 0.0):
+        return False
+    if elapsed_seconds <= 0:
+        return False
+    return transferred_bytes / elapsed_seconds < float(min_bytes_per_second or 0)
+
+
+def hedge_path(dest_path):
+    return f"{dest_path}{HEDGE_SUFFIX}"
+
+
+def part_path(dest_path):
+    return f"{dest_path}{PART_SUFFIX}"
+
+
+def sidecar_path(dest_path):
+    return f"{dest_path}{SIDECAR_SUFFIX}"
+
+
+def resume_validator(etag, last_modified):
+    # If-Range 只接受强 ETag；弱 ETag 时退回 Last-Modified
+    etag = str(etag or "").strip()
+    if etag and not etag.startswith("W/"):
+        return etag
+    return str(last_modified or "").strip() or None
+
+
+def resume_validator_from_probe(probe):
+    if not isinstance(probe, dict):
+        return None
+    content_encoding = (probe.get("content_encoding") or "").lower()
+    if content_encoding and content_encoding != "identity":
+        return None
+    return resume_validator(probe.get("etag"), probe.get("last_modified"))
+
+
+def new_part_state(url, size, etag=None, last_modified=None, segments=None):
+    return {
+        "version": 1,
+        "url": url,
+        "size": size,
+        "etag": etag,
+        "last_modified": last_modified,
+        "mode": "segmented" if segments else "single",
+        "segments": segments or [],
+    }
+
+
+def _segments_are_valid(segments, total_size):
+    if not isinstance(segments, list) or not segments:
+        return False
+    expected_start = 0
+    for item in segments:
+        if not isinstance(item, dict):
+            return False
+        start, end, done = item.get("start"), item.get("end"), item.get("done")
+        if not all(isinstance(v, int) for v in (start, end, done)):
+            return False
+        if start != expected_start or end < start or not 0 <= done <= end - start + 1:
+            return False
+        expected_start = end + 1
+    return expected_start == total_size
+
+
+def load_part_state(dest_path):
+    state_file = sidecar_path(dest_path)
+    data_file = part_path(dest_path)
+    if not os.path.exists(state_file) or not os.path.exists(data_file):
+        return None
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except Exception:
+        return None
+
+    if not isinstance(state, dict) or not state.get("url"):
+        return None
+    size = state.get("size")
+    if not isinstance(size, int) or size <= 0:
+        return None
+    if not resume_validator(state.get("etag"), state.get("last_modified")):
+        return None
+
+    local_size = os.path.getsize(data_file)
+    if state.get("mode") == "segmented":
+        if local_size != size or not _segments_are_valid(state.get("segments"), size):
+            return None
+    elif not 0 < local_size <= size:
+        # 单流分片等于总大小说明上次已收完、只是没来得及转正，仍然有效
+        return None
+    return state
+
+
+def save_part_state(dest_path, state):
+    state = dict(state)
+    state["segments"] = [
+        {"index": item["index"], "start": item["start"], "end": item["end"], "done": item["done"]}
+        for item in state.get("segments") or []
+    ]
+    state["updated_at"] = time.time()
+    tmp_path = f"{sidecar_path(dest_path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, sidecar_path(dest_path))
+
+
+def discard_part(dest_path):
+    for path in (part_path(dest_path), sidecar_path(dest_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def finalize_part(dest_path):
+    os.replace(part_path(dest_path), dest_path)
+    try:
+        os.remove(sidecar_path(dest_path))
+    except FileNotFoundError:
+        pass
+
+
+def preallocate_file(path, size):
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    mode = "r+b" if os.path.exists(path) else "wb"
+    with open(path, mode) as f:
+        f.truncate(int(size))
+
+
+class StreamingDigest:
+    """边下载边计算摘要。字节必须按文件顺序喂入；乱序写入的部分用 catch_up_from_file 从磁盘补齐。"""
+
+    def __init__(self, algorithm="sha256"):
+        self.algorithm = algorithm
+        self.reset()
+
+    def reset(self):
+        self._hash = hashlib.new(self.algorithm)
+        self.size = 0
+
+    def update(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+
+    def catch_up_from_file(self, path, end_offset):
+        if end_offset <= self.size:
+            return
+        with open(path, "rb") as f:
+            f.seek(self.size)
+            remaining = end_offset - self.size
+            while remaining > 0:
+                chunk = f.read(min(HASH_READ_BLOCK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.update(chunk)
+                remaining -= len(chunk)
+
+    def adopt(self, other):
+        self._hash = other._hash.copy()
+        self.size = other.size
+
+    def spawn(self):
+        """返回同样配置的新摘要对象，供并行下载的另一路使用"""
+        return StreamingDigest(self.algorithm)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def covers_file(self, path):
+        try:
+            return os.path.getsize(path) == self.size
+        except OSError:
+            return False
+
+
+def normalize_chunk_table(chunks, total_size=None):
+    """
+    把 manifest 条目的 chunks 字段整理成 [{"offset", "size", "sha256"}]，格式不对时返回空列表（只做整文件校验）。
+    支持固定大小分块 {"size": 字节数, "sha256": [...]}，以及逐块列出的 [{"offset", "size", "sha256"}]（如按内容切分的块）。
+    各块必须从 0 开始首尾相接；给了 total_size 时还必须正好覆盖整个文件。
+    """
+    table = []
+    if isinstance(chunks, dict):
+        try:
+            chunk_size = int(chunks.get("size") or 0)
+            total = int(total_size or 0)
+        except (TypeError, ValueError):
+            return []
+        hashes = chunks.get("sha256")
+        if chunk_size <= 0 or total <= 0 or not isinstance(hashes, list):
+            return []
+        if len(hashes) != (total + chunk_size - 1) // chunk_size:
+            return []
+        for index, sha in enumerate(hashes):
+            offset = index * chunk_size
+            table.append({"offset": offset, "size": min(chunk_size, total - offset), "sha256": str(sha).strip().lower()})
+    elif isinstance(chunks, list):
+        offset = 0
+        for entry in chunks:
+            if not isinstance(entry, dict) or not entry.get("sha256"):
+                return []
+            try:
+                size = int(entry.get("size") or 0)
+                entry_offset = int(entry.get("offset", offset))
+            except (TypeError, ValueError):
+                return []
+            if size <= 0 or entry_offset != offset:
+                return []
+            table.append({"offset": offset, "size": size, "sha256": str(entry["sha256"]).strip().lower()})
+            offset += size
+        if total_size and offset != int(total_size):
+            return []
+    return table
+
+
+def chunk_table_size(chunks):
+    return chunks[-1]["offset"] + chunks[-1]["size"] if chunks else 0
+
+
+def find_damaged_chunks(path, chunks):
+    """逐块读盘校验，返回哈希不符或因文件过短而不完整的块"""
+    damaged = []
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return list(chunks)
+    with f:
+        for chunk in chunks:
+            f.seek(chunk["offset"])
+            digest = hashlib.sha256()
+            remaining = chunk["size"]
+            while remaining > 0:
+                data = f.read(min(HASH_READ_BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                digest.update(data)
+                remaining -= len(data)
+            if remaining > 0 or digest.hexdigest() != chunk["sha256"]:
+                damaged.append(chunk)
+    return damaged
+
+
+class ChunkedStreamingDigest(StreamingDigest):
+    """在整文件摘要之外按块表逐块校验：每收满一块就比对一次，记下哈希不符的块，下载结束后可只重取这些区间。"""
+
+    def __init__(self, chunks, algorithm="sha256"):
+        self.chunks = list(chunks)
+        super().__init__(algorithm)
+
+    def reset(self):
+        super().reset()
+        self._chunk_index = 0
+        self._chunk_hash = hashlib.sha256()
+        self._chunk_filled = 0
+        self.bad_chunks = []
+
+    def update(self, data):
+        super().update(data)
+        view = memoryview(data)
+        while len(view) and self._chunk_index < len(self.chunks):
+            chunk = self.chunks[self._chunk_index]
+            take = min(len(view), chunk["size"] - self._chunk_filled)
+            self._chunk_hash.update(view[:take])
+            self._chunk_filled += take
+            view = view[take:]
+            if self._chunk_filled == chunk["size"]:
+                if self._chunk_hash.hexdigest() != chunk["sha256"]:
+                    self.bad_chunks.append(self._chunk_index)
+                self._chunk_index += 1
+                self._chunk_hash = hashlib.sha256()
+                self._chunk_filled = 0
+
+    def adopt(self, other):
+        super().adopt(other)
+        if isinstance(other, ChunkedStreamingDigest):
+            self._chunk_index = other._chunk_index
+            self._chunk_hash = other._chunk_hash.copy()
+            self._chunk_filled = other._chunk_filled
+            self.bad_chunks = list(other.bad_chunks)
+
+    def spawn(self):
+        return ChunkedStreamingDigest(self.chunks, self.algorithm)
+
+    def damaged_chunks(self):
+        """数据喂完后调用：哈希不符的块，加上文件结束时还没收满的块（响应体被截断）"""
+        indexes = list(self.bad_chunks) + list(range(self._chunk_index, len(self.chunks)))
+        return [self.chunks[i] for i in indexes]
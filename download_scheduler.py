@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+SMALL_FILE_BYTES = 2 * 1024 * 1024
+ADAPTIVE_MAX_WORKERS = 8
+ADAPTIVE_WINDOW_SECONDS = 2.0
+ADAPTIVE_GAIN_THRESHOLD = 1.1
+ADAPTIVE_COOLDOWN_WINDOWS = 5
+
+
+def order_download_jobs(items, size_of, small_threshold=SMALL_FILE_BYTES):
+    # 大文件按从大到小先启动，决定总耗时的长任务不会排到最后；
+    # 每个大文件后穿插一个小文件，保持完成数和进度持续推进
+    large = sorted((i for i in items if size_of(i) >= small_threshold), key=size_of, reverse=True)
+    small = sorted((i for i in items if size_of(i) < small_threshold), key=size_of)
+    ordered = []
+    while large or small:
+        if large:
+            ordered.append(large.pop(0))
+        if small:
+            ordered.append(small.pop(0))
+    return ordered
+
+
+class TokenBucket:
+    """全局限速。rate 为 0 时不限速；允许短时透支，透支部分由调用线程睡眠偿还。"""
+
+    def __init__(self, rate_bytes_per_second=0):
+        self._lock = threading.Lock()
+        self._rate = 0.0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate_bytes_per_second)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate_bytes_per_second):
+        with self._lock:
+            self._rate = max(0.0, float(rate_bytes_per_second or 0))
+            self._tokens = min(self._tokens, self._rate)
+            self._last = time.monotonic()
+
+    def consume(self, nbytes, cancel_check=None):
+        with self._lock:
+            rate = self._rate
+            if rate <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(rate, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= nbytes
+            deficit = -self._tokens
+        if deficit <= 0:
+            return
+        deadline = time.monotonic() + deficit / rate
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancel_check and cancel_check()):
+                return
+            time.sleep(min(remaining, 0.25))
+
+
+class AdaptiveConcurrency:
+    """按实测总吞吐调整并发上限：所有槽位都忙时逐个试探加并发，吞吐没有明显提升就退回并冷却一段时间。"""
+
+    def __init__(self, initial=3, minimum=1, maximum=ADAPTIVE_MAX_WORKERS, adaptive=True):
+        self._cond = threading.Condition()
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.limit = min(self.maximum, max(self.minimum, int(initial)))
+        self.adaptive = bool(adaptive)
+        self.active = 0
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._saturated = True
+        self._probe_rate = None
+        self._cooldown = 0
+
+    def configure(self, initial, maximum, adaptive):
+        with self._cond:
+            self.maximum = max(self.minimum, int(maximum))
+            self.limit = min(self.maximum, max(self.minimum, int(initial)))
+            self.adaptive = bool(adaptive)
+            self._probe_rate = None
+            self._cooldown = 0
+            self._cond.notify_all()
+
+    def try_acquire(self):
+        with self._cond:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def acquire(self, cancel_check=None):
+        with self._cond:
+            while self.active >= self.limit:
+                if cancel_check and cancel_check():
+                    return False
+                self._cond.wait(0.25)
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active = max(0, self.active - 1)
+            self._cond.notify_all()
+
+    def wait_for_slot(self, timeout):
+        with self._cond:
+            if self.active >= self.limit:
+                self._cond.wait(timeout)
+
+    def record(self, nbytes):
+        with self._cond:
+            self._window_bytes += nbytes
+            if self.active < self.limit:
+                self._saturated = False
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed < ADAPTIVE_WINDOW_SECONDS:
+                return
+            rate = self._window_bytes / elapsed
+            saturated = self._saturated
+            self._window_start = now
+            self._window_bytes = 0
+            self._saturated = True
+            if self.adaptive and saturated:
+                self._adjust(rate)
+
+    def _adjust(self, rate):
+        if self._probe_rate is not None:
+            if rate < self._probe_rate * ADAPTIVE_GAIN_THRESHOLD:
+                # 多开的连接没有带来吞吐，说明带宽或服务器已到瓶颈
+                self.limit = max(self.minimum, self.limit - 1)
+                self._cooldown = ADAPTIVE_COOLDOWN_WINDOWS
+                self._probe_rate = None
+                return
+            self._probe_rate = None
+        if self._cooldown > 0:
+            self._cooldown -= 1
+            return
+        if self.limit < self.maximum:
+            self._probe_rate = rate
+            self.limit += 1
+            self._cond.notify_all()
+
+
+class DownloadScheduler:
+    """所有下载路径共用的调度器：统一的并发槽位、全局限速和按文件大小排序的派发。"""
+
+    def __init__(self, workers=3, rate_limit_bytes_per_second=0, adaptive=True, max_workers=ADAPTIVE_MAX_WORKERS):
+        self.bucket = TokenBucket(rate_limit_bytes_per_second)
+        self.concurrency = AdaptiveConcurrency(
+            initial=workers,
+            maximum=max(int(workers), int(max_workers)) if adaptive else workers,
+            adaptive=adaptive,
+        )
+
+    def configure(self, workers, rate_limit_bytes_per_second, adaptive, max_workers=ADAPTIVE_MAX_WORKERS):
+        self.bucket.set_rate(rate_limit_bytes_per_second)
+        self.concurrency.configure(
+            initial=workers,
+            maximum=max(int(workers), int(max_workers)) if adaptive else workers,
+            adaptive=adaptive,
+        )
+
+    def throttle(self, nbytes, cancel_check=None):
+        self.concurrency.record(nbytes)
+        self.bucket.consume(nbytes, cancel_check=cancel_check)
+
+    def slot(self, cancel_check=None):
+        return _SchedulerSlot(self.concurrency, cancel_check)
+
+    def run(self, items, fn, size_of=None, cancel_check=None):
+        """按调度顺序执行 fn(item)，完成一个就 yield (item, future)；取消后不再派发新任务。"""
+        queue = deque(order_download_jobs(items, size_of) if size_of else items)
+        in_flight = {}
+
+        def run_job(item):
+            try:
+                return fn(item)
+            finally:
+                self.concurrency.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency.maximum) as executor:
+            while queue or in_flight:
+                cancelled = bool(cancel_check and cancel_check())
+                if cancelled:
+                    queue.clear()
+                while queue and self.concurrency.try_acquire():
+                    item = queue.popleft()
+                    in_flight[executor.submit(run_job, item)] = item
+                if not in_flight:
+                    self.concurrency.wait_for_slot(0.25)
+                    continue
+                done, _ = wait(list(in_flight), timeout=0.25, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future
+
+
+class _SchedulerSlot:
+    def __init__(self, concurrency, cancel_check):
+        self._concurrency = concurrency
+        self._cancel_check = cancel_check
+        self._held = False
+
+    def __enter__(self):
+        self._held = self._concurrency.acquire(self._cancel_check)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._held:
+            self._concurrency.release()
+        return False
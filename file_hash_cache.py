@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_HASH_WORKERS = 4
+MAX_CACHE_ENTRIES = 50000
+HASH_READ_BLOCK_SIZE = 1024 * 1024
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_READ_BLOCK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat_signature(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class FileHashCache:
+    """持久化的文件 SHA256 索引，按 (路径, 大小, mtime_ns, inode) 判断文件是否动过，没动过直接返回上次的摘要。
+
+    只用于判断“本地已有文件是否与 manifest 一致”；刚下载的文件仍应按下载时的摘要或完整读盘校验。
+    """
+
+    def __init__(self, path, workers=DEFAULT_HASH_WORKERS):
+        self.path = path
+        self.workers = max(1, int(workers))
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        entries = data.get("files") if isinstance(data, dict) else None
+        if not isinstance(entries, dict):
+            return {}
+        return {k: v for k, v in entries.items() if isinstance(v, dict) and isinstance(v.get("stat"), list)}
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def lookup(self, path):
+        """文件自上次计算后没有变化时返回缓存的摘要，否则返回 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+        if entry is not None and entry["stat"] == _stat_signature(st):
+            return entry.get("sha256")
+        return None
+
+    def record(self, path, sha256):
+        """记下已知内容的文件（如刚从校验过的暂存区移入目标位置的文件）"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._entries[self._key(path)] = {
+                "stat": _stat_signature(st),
+                "sha256": str(sha256).lower(),
+                "checked_at": time.time(),
+            }
+            self._dirty = True
+
+    def hash_file(self, path):
+        """返回文件的 SHA256，优先用缓存；读取失败时返回空字符串"""
+        cached = self.lookup(path)
+        if cached:
+            return cached
+        try:
+            st_before = os.stat(path)
+            actual = sha256_file(path)
+            st_after = os.stat(path)
+        except OSError:
+            return ""
+        # 计算过程中文件被改写时结果不可靠，不写入缓存
+        if _stat_signature(st_before) == _stat_signature(st_after):
+            with self._lock:
+                self._entries[self._key(path)] = {
+                    "stat": _stat_signature(st_after),
+                    "sha256": actual,
+                    "checked_at": time.time(),
+                }
+                self._dirty = True
+        return actual
+
+    def hash_many(self, paths, cancel_check=None):
+        """并行计算一批文件的摘要（命中缓存的不读盘），返回 {path: sha256}，读取失败的为空字符串"""
+        results = {}
+        misses = []
+        for path in dict.fromkeys(paths):
+            cached = self.lookup(path)
+            if cached:
+                results[path] = cached
+            elif os.path.isfile(path):
+                misses.append(path)
+
+        def run(path):
+            if cancel_check and cancel_check():
+                return path, ""
+            return path, self.hash_file(path)
+
+        if misses:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(misses))) as executor:
+                for path, actual in executor.map(run, misses):
+                    results[path] = actual
+        return results
+
+    def flush(self):
+        """有新条目时写盘；条目过多时丢掉最久没校验过的"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            if len(self._entries) > MAX_CACHE_ENTRIES:
+                ordered = sorted(self._entries.items(), key=lambda kv: kv[1].get("checked_at", 0), reverse=True)
+                self._entries = dict(ordered[:MAX_CACHE_ENTRIES])
+            snapshot = dict(self._entries)
+            self._dirty = False
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "files": snapshot}, f)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            return False
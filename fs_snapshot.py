@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# 更新应用阶段的目录快照：按 manifest 的 actions 把涉及的目录各扫描一次（os.scandir），
+# delete_keyword 的匹配结果和 copy_folder 目标目录的文件清单都在快照里算好，
+# 备份收集和应用两个阶段共用同一份结果，备份的文件集合与实际删除/覆盖的集合一致。
+# copy_folder/copy_file 按 rsync 的方式做差异计划：大小不同直接算改动，大小和 mtime 都相同视为未变，
+# 其余情况比较内容哈希；只有真正会改变的文件才复制、才交给备份。
+import os
+from collections import deque
+
+from file_hash_cache import sha256_file
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多模式匹配：扫描一遍小写文件名，找出其中出现的全部关键字"""
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(str(k).lower() for k in keywords if k))
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        for keyword in self.keywords:
+            node = 0
+            for ch in keyword:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node].add(keyword)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._out[child] |= self._out[self._fail[child]]
+
+    def find(self, text):
+        """返回 text 中出现的关键字集合（不区分大小写）"""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        node = 0
+        found = set()
+        for ch in str(text).lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+def scan_tree(root):
+    """用 os.scandir 递归列出 root 下的全部文件，返回 {路径: (大小, mtime_ns)}；不跟随目录符号链接"""
+    files = {}
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        files[entry.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+    return files
+
+
+def _files_copied_into(action, folder):
+    """copy_folder/copy_file 执行后会直接落在 folder 下（不含子目录）的文件路径"""
+    action_type = action.get('type')
+    if action_type == 'copy_file':
+        dest = action.get('_dest_abs', '')
+        return [dest] if dest and _key(os.path.dirname(dest)) == _key(folder) else []
+    if action_type != 'copy_folder':
+        return []
+    src_root = action.get('_src_abs', '')
+    dest_root = action.get('_dest_abs', '')
+    if not src_root or not dest_root:
+        return []
+    try:
+        rel = os.path.relpath(folder, dest_root)
+    except ValueError:
+        return []
+    if rel == os.pardir or rel.startswith(os.pardir + os.sep) or os.path.isabs(rel):
+        return []
+    src_dir = src_root if rel == os.curdir else os.path.join(src_root, rel)
+    try:
+        entries = os.scandir(src_dir)
+    except OSError:
+        return []
+    copied = []
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    copied.append(os.path.join(folder, entry.name))
+            except OSError:
+                continue
+    return copied
+
+
+class UpdateFsSnapshot:
+    """一次更新的目录快照。delete_keyword 匹配它执行时目录里会有的文件：建快照时已存在的，加上排在它前面的复制新放进来的。
+
+    hash_dest(path) 用来取目标位置已安装文件的哈希（通常是持久化哈希索引），不给时大小和 mtime 不能判定的文件一律复制。
+    """
+
+    def __init__(self, hash_dest=None):
+        self._keyword_matches = {}
+        self._trees = {}
+        self._copy_plans = {}
+        self._unchanged_files = set()
+        self._hash_dest = hash_dest
+
+    @classmethod
+    def from_actions(cls, actions, hash_dest=None):
+        snapshot = cls(hash_dest)
+        keywords_by_folder = {}
+        folder_paths = {}
+        # (目录, 关键字) 最后一次出现的 action 位置；排在它前面的复制放进目录的文件也要被它删掉
+        last_delete_index = {}
+        for index, action in enumerate(actions):
+            action_type = action.get('type')
+            if action_type == 'delete_keyword':
+                folder = action.get('_folder_abs', '')
+                keyword = action.get('keyword', '')
+                if folder and keyword:
+                    keywords_by_folder.setdefault(_key(folder), []).append(keyword)
+                    folder_paths.setdefault(_key(folder), folder)
+                    last_delete_index[(_key(folder), str(keyword).lower())] = index
+            elif action_type == 'copy_folder':
+                dest = action.get('_dest_abs', '')
+                if dest and _key(dest) not in snapshot._trees:
+                    snapshot._trees[_key(dest)] = scan_tree(dest) if os.path.isdir(dest) else {}
+
+        for folder_key, keywords in keywords_by_folder.items():
+            matcher = KeywordMatcher(keywords)
+            matches = {keyword: [] for keyword in matcher.keywords}
+            try:
+                entries = os.scandir(folder_paths[folder_key])
+            except OSError:
+                entries = None
+            if entries is not None:
+                with entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                continue
+                        except OSError:
+                            continue
+                        for keyword in matcher.find(entry.name):
+                            matches[keyword].append(entry.path)
+            # 按 action 顺序补上复制新放进目录的文件，与逐个 action 执行时现场列目录的结果一致
+            seen = {(keyword, _key(path)) for keyword, paths in matches.items() for path in paths}
+            for index, action in enumerate(actions):
+                for path in _files_copied_into(action, folder_paths[folder_key]):
+                    for keyword in matcher.find(os.path.basename(path)):
+                        if last_delete_index.get((folder_key, keyword), -1) > index and (keyword, _key(path)) not in seen:
+                            seen.add((keyword, _key(path)))
+                            matches[keyword].append(path)
+            snapshot._keyword_matches[folder_key] = matches
+        snapshot._plan_copies(actions)
+        return snapshot
+
+    def _same_content(self, src, dest_signature):
+        dest, size, mtime_ns = dest_signature
+        try:
+            st = os.stat(src)
+        except OSError:
+            return False
+        if st.st_size != size:
+            return False
+        if st.st_mtime_ns == mtime_ns:
+            return True
+        if self._hash_dest is None:
+            return False
+        try:
+            return sha256_file(src) == self._hash_dest(dest)
+        except OSError:
+            return False
+
+    def _plan_copies(self, actions):
+        """按 action 顺序规划复制：被前面的删除删掉、或被前面的复制写过的目标不能按快照判定为未变"""
+        touched = set()
+        for action in actions:
+            action_type = action.get('type')
+            if action_type == 'delete':
+                if action.get('_path_abs'):
+                    touched.add(_key(action['_path_abs']))
+            elif action_type == 'delete_keyword':
+                touched.update(_key(p) for p in self.keyword_matches(action.get('_folder_abs', ''), action.get('keyword', '')))
+            elif action_type == 'copy_folder':
+                src_root = action.get('_src_abs', '')
+                dest_root = action.get('_dest_abs', '')
+                if not src_root or not dest_root or not os.path.isdir(src_root):
+                    continue
+                existing = {_key(p): (p, sig[0], sig[1]) for p, sig in self._trees.get(_key(dest_root), {}).items()}
+                plan = {"dirs": [], "copy": [], "unchanged": 0}
+                for root, dirnames, filenames in os.walk(src_root):
+                    rel_root = os.path.relpath(root, src_root)
+                    dest_dir = dest_root if rel_root == os.curdir else os.path.join(dest_root, rel_root)
+                    plan["dirs"].append(dest_dir)
+                    for name in filenames:
+                        src = os.path.join(root, name)
+                        dest = os.path.join(dest_dir, name)
+                        dest_key = _key(dest)
+                        signature = existing.get(dest_key)
+                        if signature and dest_key not in touched and self._same_content(src, signature):
+                            plan["unchanged"] += 1
+                            continue
+                        plan["copy"].append((src, dest, signature is not None and dest_key not in touched))
+                        touched.add(dest_key)
+                self._copy_plans[(_key(src_root), _key(dest_root))] = plan
+            elif action_type == 'copy_file':
+                src = action.get('_src_abs', '')
+                dest = action.get('_dest_abs', '')
+                if not src or not dest:
+                    continue
+                dest_key = _key(dest)
+                if dest_key not in touched and os.path.isfile(dest):
+                    st = os.stat(dest)
+                    if self._same_content(src, (dest, st.st_size, st.st_mtime_ns)):
+                        self._unchanged_files.add(dest_key)
+                        continue
+                touched.add(dest_key)
+
+    def keyword_matches(self, folder, keyword):
+        """delete_keyword 在 folder 下命中的路径（按目录列举顺序）"""
+        matches = self._keyword_matches.get(_key(folder))
+        if matches is None:
+            return []
+        return list(matches.get(str(keyword).lower(), []))
+
+    def tree_files(self, root):
+        """copy_folder 目标目录下已有的文件 {路径: (大小, mtime_ns)}"""
+        return dict(self._trees.get(_key(root), {}))
+
+    def folder_copy_plan(self, src_root, dest_root):
+        """copy_folder 的差异计划 {"dirs", "copy": [(源, 目标, 目标是否已存在)], "unchanged"}；源目录不存在时返回 None"""
+        return self._copy_plans.get((_key(src_root), _key(dest_root)))
+
+    def file_unchanged(self, dest):
+        """copy_file 的目标与源内容相同、可以跳过时返回 True"""
+        return _key(dest) in self._unchanged_files
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# 分页版本历史：latest.json 的 history 只保留最近若干个版本，更早的条目归档成不可变的分页文档，
+# 由 history_pages 列出每页的地址和版本范围。归档页发布后不再修改，客户端下载一次就存进本地索引，
+# 检查更新时只拉取包含比本地版本更新条目、且本地还没有的分页。
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urljoin
+
+from updater_utils import compare_versions, sort_versioned_items
+
+
+class HistoryPageError(Exception):
+    pass
+
+
+def page_key(page):
+    return str(page.get("id") or page.get("url") or "").strip()
+
+
+def normalize_pages(pages):
+    """过滤 history_pages 中缺少地址的项，按键去重，保留原顺序"""
+    result = []
+    seen = set()
+    for page in pages if isinstance(pages, list) else []:
+        if not isinstance(page, dict) or not str(page.get("url") or "").strip():
+            continue
+        key = page_key(page)
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(page)
+    return result
+
+
+def pages_newer_than(pages, local_version):
+    """挑出可能包含比 local_version 更新条目的分页；没写 max_version 的分页无法判断，一律保留"""
+    if not local_version:
+        return list(pages)
+    return [
+        page for page in pages
+        if not page.get("max_version") or compare_versions(str(page["max_version"]), local_version) > 0
+    ]
+
+
+def resolve_page_urls(page_url, base_urls):
+    """相对地址按每个成功返回 latest.json 的地址解析，镜像拿到的头文档也从同一镜像取分页"""
+    page_url = str(page_url).strip()
+    candidates = [urljoin(base, page_url) for base in base_urls or []] or [page_url]
+    return list(dict.fromkeys(candidates))
+
+
+def parse_history_page(raw, expected_sha256=None):
+    """解析分页文档（{"history": [...]} 或直接是数组），给了 sha256 时先校验原始字节"""
+    if expected_sha256:
+        actual = hashlib.sha256(raw).hexdigest()
+        if actual != str(expected_sha256).strip().lower():
+            raise HistoryPageError(f"分页哈希不匹配: {actual}")
+    try:
+        data = json.loads(raw.decode("utf-8"))
+    except Exception as exc:
+        raise HistoryPageError(f"分页不是有效的 JSON: {exc}") from exc
+    history = data.get("history") if isinstance(data, dict) else data
+    if not isinstance(history, list):
+        raise HistoryPageError("分页缺少 history 数组")
+    return [item for item in history if isinstance(item, dict)]
+
+
+def merge_history(*sources):
+    """按版本号合并多份历史，同一版本以先出现的为准（头文档优先于归档页），结果从旧到新"""
+    merged = {}
+    for source in sources:
+        for item in source or []:
+            if not isinstance(item, dict):
+                continue
+            version = str(item.get("version") or "").strip()
+            if version and version not in merged:
+                merged[version] = item
+    return sort_versioned_items(list(merged.values()))
+
+
+class HistoryFeedIndex:
+    """本地历史索引：保存最近一次的头文档条目和已下载的归档分页，独立于 launcher_settings.json。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._head, self._pages = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return [], {}
+        if not isinstance(data, dict):
+            return [], {}
+        head = data.get("head") if isinstance(data.get("head"), list) else []
+        pages = data.get("pages") if isinstance(data.get("pages"), dict) else {}
+        return head, {k: v for k, v in pages.items() if isinstance(v, dict) and isinstance(v.get("history"), list)}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "head": self._head, "pages": self._pages}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _save_quietly(self):
+        try:
+            self._save()
+            return True
+        except Exception:
+            return False
+
+    def is_empty(self):
+        with self._lock:
+            return not self._head and not self._pages
+
+    def has_page(self, page):
+        with self._lock:
+            entry = self._pages.get(page_key(page))
+        if entry is None:
+            return False
+        expected = str(page.get("sha256") or "").strip().lower()
+        return not expected or entry.get("sha256") == expected
+
+    def store_page(self, page, history):
+        with self._lock:
+            self._pages[page_key(page)] = {
+                "url": page.get("url"),
+                "min_version": page.get("min_version"),
+                "max_version": page.get("max_version"),
+                "sha256": str(page.get("sha256") or "").strip().lower() or None,
+                "history": history,
+                "fetched_at": time.time(),
+            }
+            return self._save_quietly()
+
+    def update_head(self, history, pages=None):
+        """记录头文档条目；给出 pages 时顺带丢掉服务器已不再列出的分页。返回是否写盘。"""
+        with self._lock:
+            changed = history != self._head
+            self._head = list(history)
+            if pages is not None:
+                listed = {page_key(page) for page in pages}
+                for key in [k for k in self._pages if k not in listed]:
+                    del self._pages[key]
+                    changed = True
+            if not changed:
+                return False
+            return self._save_quietly()
+
+    def history(self):
+        with self._lock:
+            return merge_history(self._head, *(entry["history"] for entry in self._pages.values()))
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import http.client
+import io
+import logging
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+
+POOLABLE_METHODS = ("GET", "HEAD")
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+DRAIN_LIMIT_BYTES = 64 * 1024
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+# 挂在更新器的 TCYUpdater 日志下，写进同一个 launcher_debug.log
+logger = logging.getLogger("TCYUpdater.http_pool")
+
+_ssl_context_lock = threading.Lock()
+_ssl_contexts = {}
+
+
+def get_ssl_context(mode):
+    if mode not in ("strict", "compat"):
+        return None
+    with _ssl_context_lock:
+        context = _ssl_contexts.get(mode)
+        if context is None:
+            if mode == "compat":
+                context = ssl._create_unverified_context()
+            else:
+                context = ssl.create_default_context()
+            _ssl_contexts[mode] = context
+        return context
+
+
+def uses_system_proxy(url):
+    parts = urlsplit(url)
+    proxies = urllib.request.getproxies()
+    if not proxies.get(parts.scheme.lower()):
+        return False
+    try:
+        return not urllib.request.proxy_bypass(parts.hostname or "")
+    except Exception:
+        return True
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used", "requests", "disposable")
+
+    def __init__(self, conn, disposable=False):
+        now = time.time()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.requests = 0
+        self.disposable = disposable
+
+
+class PooledResponse:
+    """与 urlopen 返回值兼容的响应包装，关闭时把读完的连接归还连接池。"""
+
+    def __init__(self, pool, key, slot, raw, url, method):
+        self._pool = pool
+        self._key = key
+        self._slot = slot
+        self._raw = raw
+        self._method = method
+        self._closed = False
+        self.url = url
+        self.status = raw.status
+        self.code = raw.status
+        self.reason = raw.reason
+        self.headers = raw.headers
+        self.msg = raw.reason
+
+    def read(self, amt=None):
+        return self._raw.read(amt)
+
+    def readinto(self, buffer):
+        return self._raw.readinto(buffer)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def getheader(self, name, default=None):
+        return self._raw.getheader(name, default)
+
+    def getheaders(self):
+        return self._raw.getheaders()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        reusable = False
+        try:
+            if not self._raw.isclosed():
+                remaining = self._raw.length
+                if self._method == "HEAD" or (remaining is not None and remaining <= DRAIN_LIMIT_BYTES):
+                    self._raw.read()
+            reusable = self._raw.isclosed() and not self._raw.will_close
+        except Exception:
+            reusable = False
+        self._pool._release(self._key, self._slot, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class HttpConnectionPool:
+    """按 (scheme, host, port, ssl 模式) 复用 HTTP/1.1 keep-alive 连接。
+
+    每个主机可复用的连接数受 max_per_host 限制，名额用满时请求排队等待；等满一个超时仍没有空位，
+    就开一条用完即关的临时连接并记一条警告，临时连接不占名额，所以高峰时实际连接数可能超过 max_per_host。
+    空闲超过 idle_timeout 秒或已服务 max_requests_per_conn 次的连接在下次取用时回收。只有 GET/HEAD 会走连接池，
+    配置了系统代理的地址直接交给 urllib 处理。
+    """
+
+    def __init__(self, max_per_host=6, idle_timeout=30, max_requests_per_conn=200, user_agent="TCYClientUpdater/1.0"):
+        self.max_per_host = max(1, int(max_per_host))
+        self.idle_timeout = float(idle_timeout)
+        self.max_requests_per_conn = max(1, int(max_requests_per_conn))
+        self.user_agent = user_agent
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._open_counts = {}
+        self._host_conditions = {}
+        self.stats = {"opened": 0, "reused": 0, "recycled": 0, "overflow": 0}
+
+    def _condition_for(self, key):
+        condition = self._host_conditions.get(key)
+        if condition is None:
+            condition = threading.Condition(self._lock)
+            self._host_conditions[key] = condition
+        return condition
+
+    def _is_expired(self, slot, now):
+        return now - slot.last_used > self.idle_timeout or slot.requests >= self.max_requests_per_conn
+
+    def _new_connection(self, key, timeout, context):
+        scheme, host, port, _ = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return _PooledConnection(conn)
+
+    def _acquire(self, key, timeout, context):
+        deadline = time.time() + max(float(timeout or 0), 1.0)
+        expired = []
+        with self._lock:
+            condition = self._condition_for(key)
+            while True:
+                now = time.time()
+                idle = self._idle.setdefault(key, [])
+                while idle:
+                    slot = idle.pop()
+                    if self._is_expired(slot, now):
+                        expired.append(slot)
+                        self._open_counts[key] -= 1
+                        self.stats["recycled"] += 1
+                        continue
+                    self.stats["reused"] += 1
+                    slot.conn.timeout = timeout
+                    if slot.conn.sock is not None:
+                        slot.conn.sock.settimeout(timeout)
+                    break
+                else:
+                    slot = None
+                if slot is not None:
+                    break
+                if self._open_counts.get(key, 0) < self.max_per_host:
+                    self._open_counts[key] = self._open_counts.get(key, 0) + 1
+                    self.stats["opened"] += 1
+                    slot = self._new_connection(key, timeout, context)
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    # 等待超时仍无空位：开一条不回池、不占名额的临时连接，避免调用方被永久阻塞
+                    slot = self._new_connection(key, timeout, context)
+                    slot.disposable = True
+                    self.stats["opened"] += 1
+                    self.stats["overflow"] += 1
+                    logger.warning(f"连接池已满 ({key[1]}:{key[2]} 上限 {self.max_per_host})，改用临时连接")
+                    break
+                condition.wait(remaining)
+        for item in expired:
+            item.conn.close()
+        return slot
+
+    def _release(self, key, slot, reusable):
+        with self._lock:
+            slot.last_used = time.time()
+            # 临时连接不占名额，关掉即可，不用唤醒排队的请求
+            if not slot.disposable:
+                if reusable and slot.requests < self.max_requests_per_conn:
+                    self._idle.setdefault(key, []).append(slot)
+                    slot = None
+                else:
+                    self._open_counts[key] = max(0, self._open_counts.get(key, 0) - 1)
+                self._condition_for(key).notify()
+        if slot is not None:
+            slot.conn.close()
+
+    def close_idle(self, max_idle=0):
+        now = time.time()
+        to_close = []
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep = []
+                for slot in idle:
+                    if now - slot.last_used >= max_idle:
+                        to_close.append(slot)
+                        self._open_counts[key] -= 1
+                    else:
+                        keep.append(slot)
+                self._idle[key] = keep
+                self._condition_for(key).notify_all()
+        for slot in to_close:
+            slot.conn.close()
+        return len(to_close)
+
+    def _send(self, key, url, method, headers, timeout, context):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        for attempt in range(2):
+            slot = self._acquire(key, timeout, context)
+            reused = slot.requests > 0
+            try:
+                slot.conn.request(method, path, headers=headers)
+                raw = slot.conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                self._release(key, slot, False)
+                # 复用的 keep-alive 连接可能已被服务器关闭，换新连接重发一次
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                self._release(key, slot, False)
+                raise
+            slot.requests += 1
+            return PooledResponse(self, key, slot, raw, url, method)
+
+    def urlopen(self, req, timeout, ssl_mode="none", pooled=True):
+        """pooled=False 时绕过连接池，每次新建连接（例如测速时需要计入握手开销）"""
+        method = req.get_method().upper()
+        url = req.full_url
+        if not pooled or method not in POOLABLE_METHODS or req.data is not None or uses_system_proxy(url):
+            context = get_ssl_context(ssl_mode)
+            if context is None:
+                return urllib.request.urlopen(req, timeout=timeout)
+            return urllib.request.urlopen(req, timeout=timeout, context=context)
+
+        headers = {key.title(): value for key, value in req.header_items()}
+        headers.setdefault("User-Agent", self.user_agent)
+        headers["Connection"] = "keep-alive"
+
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ("http", "https"):
+                raise urllib.error.URLError(f"unsupported scheme: {scheme}")
+            port = parts.port or (443 if scheme == "https" else 80)
+            context = get_ssl_context(ssl_mode) if scheme == "https" else None
+            if scheme == "https" and context is None:
+                context = get_ssl_context("strict")
+            key = (scheme, (parts.hostname or "").lower(), port, ssl_mode if scheme == "https" else "none")
+
+            try:
+                resp = self._send(key, url, method, headers, timeout, context)
+            except socket.timeout:
+                raise
+            except (OSError, http.client.HTTPException) as e:
+                raise urllib.error.URLError(e)
+
+            if resp.status in REDIRECT_CODES and resp.headers.get("Location"):
+                location = urljoin(url, resp.headers.get("Location"))
+                resp.close()
+                if resp.status == 303:
+                    method = "GET"
+                url = location
+                continue
+            if resp.status >= 300:
+                # 错误响应先读出正文并归还连接，HTTPError 只带内存里的副本，调用方不关闭也不会占着连接名额
+                try:
+                    body = resp.read(DRAIN_LIMIT_BYTES)
+                except (OSError, http.client.HTTPException):
+                    body = b""
+                finally:
+                    resp.close()
+                raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+            return resp
+
+        raise urllib.error.URLError("too many redirects")
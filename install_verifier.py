@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# 完整安装清单格式（由 latest.json 中版本条目的 install_manifest_url 指向）：
+# {"version": "...", "roots": ["mods", "config"], "ignore": ["config/xaero/*"],
+#  "files": [{"path": "mods/a.jar", "size": 123, "sha256": "...", "url": "https://..."}]}
+# files 列出该版本客户端的每个受管文件；roots 是检查多余文件的目录，ignore 是不算作多余文件的通配规则。
+import fnmatch
+import os
+
+
+DISABLED_SUFFIX = ".disabled"
+
+
+class InstallManifestError(Exception):
+    pass
+
+
+def parse_install_manifest(data):
+    if not isinstance(data, dict) or not isinstance(data.get("files"), list):
+        raise InstallManifestError("完整安装清单缺少 files 数组")
+    files = []
+    for item in data["files"]:
+        if not isinstance(item, dict) or not item.get("path") or not item.get("sha256"):
+            raise InstallManifestError("完整安装清单的条目必须包含 path 和 sha256")
+        files.append(item)
+    roots = [str(r).strip("/\\") for r in data.get("roots", []) or [] if str(r).strip("/\\")]
+    ignore = [str(p) for p in data.get("ignore", []) or [] if p]
+    return {"version": data.get("version"), "files": files, "roots": roots, "ignore": ignore}
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def scan_install(game_root, manifest, resolve_path, hash_many, cancel_check=None):
+    """
+    按清单检查 game_root，返回 {"ok", "missing", "modified", "extra"}。
+    missing/modified 是清单条目的副本，带 _target_abs（实际检查的位置）；extra 是相对路径列表。
+    被禁用的 mod（文件名多了 .disabled）按原文件校验，不算缺失也不算多余。
+    """
+    missing = []
+    modified = []
+    expected = set()
+    to_hash = []
+    for item in manifest["files"]:
+        target = resolve_path(game_root, item["path"])
+        if not os.path.isfile(target) and os.path.isfile(target + DISABLED_SUFFIX):
+            target = target + DISABLED_SUFFIX
+        expected.add(_key(target))
+        entry = dict(item, _target_abs=target)
+        if not os.path.isfile(target):
+            missing.append(entry)
+            continue
+        size = item.get("size")
+        if isinstance(size, int) and os.path.getsize(target) != size:
+            modified.append(entry)
+            continue
+        to_hash.append(entry)
+
+    digests = hash_many([entry["_target_abs"] for entry in to_hash], cancel_check=cancel_check)
+    ok = 0
+    for entry in to_hash:
+        if digests.get(entry["_target_abs"], "") == str(entry["sha256"]).lower():
+            ok += 1
+        else:
+            modified.append(entry)
+
+    extra = []
+    for root in manifest["roots"]:
+        root_abs = resolve_path(game_root, root)
+        for dirpath, dirnames, filenames in os.walk(root_abs):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                if _key(full) in expected:
+                    continue
+                rel = os.path.relpath(full, game_root).replace(os.sep, "/")
+                if any(fnmatch.fnmatch(rel, pattern) for pattern in manifest["ignore"]):
+                    continue
+                extra.append(rel)
+
+    return {"ok": ok, "missing": missing, "modified": modified, "extra": sorted(extra)}
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+
+
+class ConditionalJsonCache:
+    """按 URL 保存 JSON 文档及其 ETag/Last-Modified，用于条件请求；命中 304 时直接返回上次的解析结果。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        entries = data.get("entries") if isinstance(data, dict) else None
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def request_headers(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+        if not isinstance(entry, dict) or "data" not in entry:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def cached_data(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+        return entry.get("data") if isinstance(entry, dict) else None
+
+    def store(self, url, etag, last_modified, data):
+        """记录新的文档和校验信息；服务器没给校验信息时删掉旧条目。返回是否写盘。"""
+        with self._lock:
+            if not etag and not last_modified:
+                if self._entries.pop(url, None) is None:
+                    return False
+            else:
+                entry = self._entries.get(url)
+                if (isinstance(entry, dict) and entry.get("etag") == etag
+                        and entry.get("last_modified") == last_modified and entry.get("data") == data):
+                    return False
+                self._entries[url] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "data": data,
+                    "fetched_at": time.time(),
+                }
+            try:
+                self._save()
+            except Exception:
+                return False
+            return True
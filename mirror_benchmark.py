@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import time
+
+
+BENCHMARK_RANGE_BYTES = 2 * 1024 * 1024
+BENCHMARK_TIME_LIMIT_SECONDS = 8
+MIN_THROUGHPUT_SAMPLE_BYTES = 256 * 1024
+EWMA_ALPHA = 0.3
+REFERENCE_TRANSFER_BYTES = 1024 * 1024 * 1024
+MIN_SUCCESS_RATE = 0.05
+
+
+def ewma(previous, sample, alpha=EWMA_ALPHA):
+    if previous is None:
+        return float(sample)
+    return float(previous) + alpha * (float(sample) - float(previous))
+
+
+def update_mirror_history(history, mirror, ok, latency_ms=None, throughput_bps=None, now=None, alpha=EWMA_ALPHA):
+    entry = dict(history.get(mirror) or {})
+    entry["samples"] = int(entry.get("samples", 0)) + 1
+    entry["failure_rate"] = round(ewma(entry.get("failure_rate"), 0.0 if ok else 1.0, alpha), 4)
+    if ok and latency_ms is not None and latency_ms >= 0:
+        entry["latency_ms"] = round(ewma(entry.get("latency_ms"), latency_ms, alpha), 1)
+    if ok and throughput_bps:
+        entry["throughput_bps"] = round(ewma(entry.get("throughput_bps"), throughput_bps, alpha), 1)
+    entry["last_ok"] = bool(ok)
+    entry["updated_at"] = now if now is not None else time.time()
+    history[mirror] = entry
+    return entry
+
+
+def estimate_transfer_seconds(entry, size_bytes=REFERENCE_TRANSFER_BYTES):
+    # 预计拉取 size_bytes 所需时间：首包延迟 + 持续吞吐，再按失败率折算重试成本
+    if not isinstance(entry, dict) or entry.get("latency_ms") is None:
+        return None
+    throughput = entry.get("throughput_bps")
+    if not throughput:
+        return None
+    seconds = entry["latency_ms"] / 1000.0 + size_bytes / float(throughput)
+    success_rate = max(MIN_SUCCESS_RATE, 1.0 - float(entry.get("failure_rate") or 0.0))
+    return seconds / success_rate
+
+
+def _rank_key(entry):
+    seconds = estimate_transfer_seconds(entry)
+    if seconds is not None:
+        return (0, seconds)
+    # 没有吞吐样本的镜像排在后面，彼此之间按延迟和失败率比较
+    success_rate = max(MIN_SUCCESS_RATE, 1.0 - float(entry.get("failure_rate") or 0.0))
+    return (1, entry["latency_ms"] / success_rate)
+
+
+def rank_mirrors(history, mirrors):
+    usable = [
+        m for m in mirrors
+        if isinstance(history.get(m), dict) and history[m].get("latency_ms") is not None
+    ]
+    return sorted(usable, key=lambda m: _rank_key(history[m]))
+
+
+def prune_mirror_history(history, mirrors):
+    keep = set(mirrors)
+    return {m: entry for m, entry in (history or {}).items() if m in keep and isinstance(entry, dict)}
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# 发布端工具：为 manifest 生成外部文件的 TCYDELTA1 差分和按内容切分的块表。
+# 只给发布流程（VersionJsonEditor 或手工脚本）使用，更新器本身不导入这个模块，打包时也不会进 exe；
+# 客户端只负责应用差分和用本地块拼装，见 delta_patch.py 和 chunk_dedup.py。
+import hashlib
+import zlib
+
+from delta_patch import MAGIC, _COPY, _HEADER, _LENGTH, _OP_ADD, _OP_COPY, _OP_END
+
+
+MATCH_BLOCK_SIZE = 64
+MAX_OP_LENGTH = 0xFFFFFFFF
+DEFAULT_MIN_CHUNK_BYTES = 64 * 1024
+DEFAULT_AVG_CHUNK_BYTES = 256 * 1024
+DEFAULT_MAX_CHUNK_BYTES = 1024 * 1024
+
+_GEAR = [int.from_bytes(hashlib.sha256(b"tcy-gear-%d" % i).digest()[:8], "little") for i in range(256)]
+_MASK64 = (1 << 64) - 1
+
+
+def cut_points(data, min_size=DEFAULT_MIN_CHUNK_BYTES, avg_size=DEFAULT_AVG_CHUNK_BYTES, max_size=DEFAULT_MAX_CHUNK_BYTES):
+    """Gear 滚动哈希切块，返回每块的结束位置。avg_size 必须是 2 的幂；每块前 min_size 字节不检查切点。"""
+    mask = (avg_size - 1) << (64 - avg_size.bit_length() + 1)
+    gear = _GEAR
+    total = len(data)
+    cuts = []
+    start = 0
+    while start < total:
+        end = min(start + max_size, total)
+        pos = min(start + min_size, end)
+        h = 0
+        cut = end
+        while pos < end:
+            h = ((h << 1) + gear[data[pos]]) & _MASK64
+            pos += 1
+            if not h & mask:
+                cut = pos
+                break
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def create_chunk_table(data, min_size=DEFAULT_MIN_CHUNK_BYTES, avg_size=DEFAULT_AVG_CHUNK_BYTES, max_size=DEFAULT_MAX_CHUNK_BYTES):
+    """为文件内容生成 manifest 用的块表 [{"offset", "size", "sha256"}]"""
+    table = []
+    start = 0
+    view = memoryview(data)
+    for cut in cut_points(data, min_size, avg_size, max_size):
+        table.append({"offset": start, "size": cut - start, "sha256": hashlib.sha256(view[start:cut]).hexdigest()})
+        start = cut
+    return table
+
+
+def create_delta(base, target, block_size=MATCH_BLOCK_SIZE):
+    """生成从 base 到 target 的差分，输入为 bytes"""
+    index = {}
+    for offset in range(0, len(base) - block_size + 1, block_size):
+        index.setdefault(base[offset:offset + block_size], offset)
+
+    ops = []
+    pending_add = bytearray()
+
+    def flush_add():
+        while pending_add:
+            chunk = bytes(pending_add[:MAX_OP_LENGTH])
+            ops.append(bytes([_OP_ADD]) + _LENGTH.pack(len(chunk)) + chunk)
+            del pending_add[:len(chunk)]
+
+    i = 0
+    target_len = len(target)
+    while i < target_len:
+        base_offset = index.get(target[i:i + block_size]) if i + block_size <= target_len else None
+        if base_offset is None:
+            pending_add.append(target[i])
+            i += 1
+            continue
+        length = block_size
+        max_length = min(target_len - i, len(base) - base_offset, MAX_OP_LENGTH)
+        while (length + block_size <= max_length
+               and target[i + length:i + length + block_size] == base[base_offset + length:base_offset + length + block_size]):
+            length += block_size
+        while length < max_length and target[i + length] == base[base_offset + length]:
+            length += 1
+        flush_add()
+        ops.append(bytes([_OP_COPY]) + _COPY.pack(base_offset, length))
+        i += length
+    flush_add()
+    ops.append(bytes([_OP_END]))
+    return MAGIC + _HEADER.pack(len(base), target_len) + zlib.compress(b"".join(ops), 9)
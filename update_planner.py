@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# 多版本合并更新：把按顺序排列的多个 manifest 折算成一次更新的净效果。
+# 逐版本应用时，每个路径的最终内容只取决于最后一次写入它的操作（外部文件、copy_file 或展开后的 copy_folder），
+# 写入之后又被删除的路径则不需要写入。去掉这些被覆盖的写入后，剩下的写入都不受任何删除影响，
+# 所以合并结果可以先按原顺序执行全部删除，再执行每个路径唯一的一次写入，结构与单个版本的 manifest 相同。
+import os
+
+
+DELETE_ACTION_TYPES = ("delete", "delete_keyword")
+
+
+def _path_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def delete_covers(action, path_key):
+    """判断删除类 action 是否会删掉 path_key 指向的文件（与 _apply_update_action 的匹配规则一致）"""
+    action_type = action.get("type")
+    if action_type == "delete":
+        return bool(action.get("_path_abs")) and _path_key(action["_path_abs"]) == path_key
+    if action_type == "delete_keyword":
+        keyword = str(action.get("keyword") or "").lower()
+        folder = action.get("_folder_abs")
+        return (bool(keyword) and bool(folder)
+                and _path_key(folder) == os.path.dirname(path_key)
+                and keyword in os.path.basename(path_key).lower())
+    return False
+
+
+def expand_copy_folder(action):
+    """把 copy_folder 展开成逐文件的 copy_file，便于和其他版本的同名文件合并"""
+    src_root = action.get("_src_abs", "")
+    dest_root = action.get("_dest_abs", "")
+    if not os.path.isdir(src_root):
+        return []
+    label_src = str(action.get("src") or "").rstrip("/\\")
+    label_dest = str(action.get("dest") or "").rstrip("/\\")
+    expanded = []
+    for root, dirs, files in os.walk(src_root):
+        dirs.sort()
+        for name in sorted(files):
+            rel = os.path.relpath(os.path.join(root, name), src_root)
+            rel_label = rel.replace(os.sep, "/")
+            expanded.append({
+                "type": "copy_file",
+                "src": f"{label_src}/{rel_label}" if label_src else rel_label,
+                "dest": f"{label_dest}/{rel_label}" if label_dest else rel_label,
+                "_src_abs": os.path.join(root, name),
+                "_dest_abs": os.path.join(dest_root, rel),
+            })
+    return expanded
+
+
+def squash_update_manifests(manifests):
+    """
+    manifests 按版本从旧到新排列，每项为 {"version", "actions", "external_files"}，路径已解析成绝对路径。
+    返回 {"actions", "external_files", "superseded_files", "dropped_writes"}：
+    actions 是全部删除类（及未知类型）action 加上每个目标路径最后一次的 copy_file，
+    external_files 是每个目标路径最后一次的外部文件；superseded_files 统计因此免去下载的外部文件数。
+    被计划中更早的删除覆盖的外部文件带 _deleted_by_plan 标记，即使本地已有相同哈希也必须重新放回。
+    """
+    ordered_actions = []
+    deletes = []
+    writes = {}
+    superseded_files = 0
+    dropped_writes = 0
+
+    def put_write(path_abs, kind, entry):
+        nonlocal superseded_files, dropped_writes
+        key = _path_key(path_abs)
+        previous = writes.pop(key, None)
+        if previous is not None:
+            dropped_writes += 1
+            if previous[0] == "file":
+                superseded_files += 1
+        if kind == "file" and any(delete_covers(d, key) for d in deletes):
+            entry = dict(entry, _deleted_by_plan=True)
+        writes[key] = (kind, entry)
+
+    for manifest in manifests:
+        for action in manifest.get("actions", []):
+            action_type = action.get("type")
+            if action_type in DELETE_ACTION_TYPES:
+                ordered_actions.append(action)
+                deletes.append(action)
+                for key in [k for k in writes if delete_covers(action, k)]:
+                    kind, _ = writes.pop(key)
+                    dropped_writes += 1
+                    if kind == "file":
+                        superseded_files += 1
+            elif action_type == "copy_folder":
+                for expanded in expand_copy_folder(action):
+                    put_write(expanded["_dest_abs"], "action", expanded)
+            elif action_type == "copy_file":
+                put_write(action.get("_dest_abs", ""), "action", action)
+            else:
+                ordered_actions.append(action)
+        for item in manifest.get("external_files", []):
+            put_write(item["_target_abs"], "file", item)
+
+    copy_actions = [entry for kind, entry in writes.values() if kind == "action"]
+    external_files = [entry for kind, entry in writes.values() if kind == "file"]
+    return {
+        "actions": ordered_actions + copy_actions,
+        "external_files": external_files,
+        "superseded_files": superseded_files,
+        "dropped_writes": dropped_writes,
+    }
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# 可跨重启续传的更新会话，保存在 update_session.json。
+# 记录本次更新的目标版本、工作目录（骨架包解压目录和暂存目录）、解析好的 manifest，
+# 以及每个外部文件在暂存区的状态：pending 未开始 / partial 已开始下载（暂存路径旁有 .part 可续传）/ verified 已校验。
+# 下次更新同样的版本时沿用工作目录：已校验的文件直接使用，下载到一半的文件从 .part 继续。
+import json
+import os
+import threading
+import time
+
+
+SESSION_FORMAT_VERSION = 1
+FLUSH_INTERVAL_SECONDS = 1.0
+
+STATE_PENDING = "pending"
+STATE_PARTIAL = "partial"
+STATE_VERIFIED = "verified"
+
+
+class UpdateSession:
+    """一次在线更新的下载进度。状态改动先记在内存里，按间隔写盘；写盘是整体替换，中途退出不会留下半个文件。"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self._data = data
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._dirty = True
+        self._discarded = False
+        self._last_flush = 0.0
+
+    @classmethod
+    def create(cls, path, versions, work_dirs):
+        now = time.time()
+        return cls(path, {
+            "version": SESSION_FORMAT_VERSION,
+            "versions": [str(v) for v in versions if v],
+            "work_dirs": list(work_dirs),
+            "save_paths": [],
+            "manifests": None,
+            "files": {},
+            "created_at": now,
+            "updated_at": now,
+        })
+
+    @classmethod
+    def load(cls, path):
+        """读取上次保存的会话，没有或格式不对时返回 None"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return None
+        if (not isinstance(data, dict) or data.get("version") != SESSION_FORMAT_VERSION
+                or not isinstance(data.get("versions"), list) or not isinstance(data.get("files"), dict)):
+            return None
+        session = cls(path, data)
+        session._dirty = False
+        return session
+
+    @property
+    def versions(self):
+        return list(self._data["versions"])
+
+    @property
+    def work_dirs(self):
+        return tuple(self._data.get("work_dirs") or ())
+
+    @property
+    def save_paths(self):
+        return list(self._data.get("save_paths") or [])
+
+    @property
+    def manifests(self):
+        """解析好的 manifest 列表（路径已是绝对路径）；骨架包还没取完时为 None"""
+        return self._data.get("manifests")
+
+    def matches(self, versions, work_dirs):
+        return self.versions == [str(v) for v in versions if v] and self.work_dirs == tuple(work_dirs)
+
+    def set_manifests(self, manifests, save_paths):
+        with self._lock:
+            # 存一份拷贝，后续流程往条目里写的临时字段不会混进会话
+            self._data["manifests"] = json.loads(json.dumps(manifests, ensure_ascii=False))
+            self._data["save_paths"] = list(save_paths)
+            self._dirty = True
+        self.flush(force=True)
+
+    def file_state(self, staging_path):
+        with self._lock:
+            entry = self._data["files"].get(staging_path)
+            return dict(entry) if entry else None
+
+    def track(self, items):
+        """登记本次需要放进暂存区的外部文件，已有记录的保持原状态"""
+        with self._lock:
+            files = self._data["files"]
+            for item in items:
+                if item["_staging_abs"] not in files:
+                    files[item["_staging_abs"]] = {
+                        "name": item.get("name"),
+                        "sha256": str(item.get("sha256") or "").lower(),
+                        "size": item.get("size", 0),
+                        "state": STATE_PENDING,
+                    }
+                    self._dirty = True
+        self.flush(force=True)
+
+    def set_file_state(self, item, state):
+        """记录某个外部文件的状态；verified 时一并记下暂存文件的大小和 mtime，续传时据此判断文件没被动过"""
+        staging_path = item["_staging_abs"]
+        entry = {"name": item.get("name"), "sha256": str(item.get("sha256") or "").lower(), "size": item.get("size", 0), "state": state}
+        if state == STATE_VERIFIED:
+            try:
+                st = os.stat(staging_path)
+                entry["stat"] = [st.st_size, st.st_mtime_ns]
+            except OSError:
+                entry["state"] = STATE_PENDING
+        with self._lock:
+            self._data["files"][staging_path] = entry
+            self._data["updated_at"] = time.time()
+            self._dirty = True
+        self.flush()
+
+    def progress(self):
+        """返回 {"total", "verified", "partial", "verified_bytes", "total_bytes"}；骨架包还没取完时 total 为 0"""
+        with self._lock:
+            entries = list(self._data["files"].values())
+        verified = [e for e in entries if e.get("state") == STATE_VERIFIED]
+        return {
+            "total": len(entries),
+            "verified": len(verified),
+            "partial": sum(1 for e in entries if e.get("state") == STATE_PARTIAL),
+            "verified_bytes": sum(int(e.get("size") or 0) for e in verified),
+            "total_bytes": sum(int(e.get("size") or 0) for e in entries),
+        }
+
+    def flush(self, force=False):
+        """有改动时写盘；非 force 时至少间隔 FLUSH_INTERVAL_SECONDS，避免每个文件都写一次"""
+        with self._write_lock:
+            with self._lock:
+                if self._discarded or not self._dirty:
+                    return False
+                if not force and time.monotonic() - self._last_flush < FLUSH_INTERVAL_SECONDS:
+                    return False
+                snapshot = json.dumps(self._data, ensure_ascii=False)
+                self._dirty = False
+                self._last_flush = time.monotonic()
+            try:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(snapshot)
+                os.replace(tmp_path, self.path)
+                return True
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                return False
+
+    def discard(self):
+        with self._write_lock:
+            self._discarded = True
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
@@ -74,21 +74,41 @@ def bounded_worker_count(total_count, max_workers, min_workers=1):
     return min(max(total, lower), upper)
 
 
-def summarize_url_fetch_results(url_list, results_by_url):
-    success_urls = []
-    failed_urls = []
-    first_data = None
-
+def pick_freshest_document(url_list, results_by_url):
+    best_data = None
+    best_url = None
     for url in url_list or []:
         outcome = results_by_url.get(url) if isinstance(results_by_url, dict) else None
-        if outcome and outcome.get("ok"):
-            success_urls.append(url)
-            if first_data is None:
-                first_data = outcome.get("data")
-        else:
-            failed_urls.append(url)
-
-    return first_data, success_urls, failed_urls
+        if not outcome or not outcome.get("ok"):
+            continue
+        data = outcome.get("data")
+        if best_url is None:
+            best_data, best_url = data, url
+        elif isinstance(data, dict) and isinstance(best_data, dict) and is_version_newer(
+            str(data.get("version", "")), str(best_data.get("version", ""))
+        ):
+            best_data, best_url = data, url
+    return best_data, best_url
+
+
+def record_url_health(health, url, outcome, alpha=0.3):
+    """每个请求只记一次：ok / failed（含 timeout）/ abandoned（被放弃且没等到结果）"""
+    entry = health.setdefault(url, {"ok": 0, "failed": 0, "timeout": 0, "abandoned": 0, "avg_ms": None, "last_error": None})
+    if outcome.get("abandoned"):
+        entry["abandoned"] = entry.get("abandoned", 0) + 1
+        return entry
+    if outcome.get("ok"):
+        entry["ok"] += 1
+    else:
+        entry["failed"] += 1
+        entry["last_error"] = outcome.get("error")
+        if outcome.get("timeout"):
+            entry["timeout"] += 1
+    elapsed_ms = outcome.get("elapsed_ms")
+    if isinstance(elapsed_ms, (int, float)):
+        previous = entry["avg_ms"]
+        entry["avg_ms"] = int(elapsed_ms if previous is None else previous + alpha * (elapsed_ms - previous))
+    return entry
 
 
 def summarize_elapsed_ms(values):
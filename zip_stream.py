@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+import zlib
+
+
+LOCAL_HEADER_SIG = b"PK\x03\x04"
+CENTRAL_HEADER_SIG = b"PK\x01\x02"
+END_OF_CENTRAL_SIG = b"PK\x05\x06"
+ZIP64_END_SIG = b"PK\x06\x06"
+DATA_DESCRIPTOR_SIG = b"PK\x07\x08"
+
+_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+_DESCRIPTOR = struct.Struct("<III")
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+WRITE_BLOCK_SIZE = 256 * 1024
+
+
+class ZipStreamUnsupported(Exception):
+    """压缩包结构无法只靠本地文件头顺序解出，需要退回先落盘再按中央目录解压。"""
+    pass
+
+
+def _decode_name(raw, flags):
+    return raw.decode("utf-8" if flags & FLAG_UTF8 else "cp437")
+
+
+class StreamingZipExtractor:
+    """边接收边解压 zip：按本地文件头顺序解出条目，最后用中央目录核对条目清单。
+
+    resolve_path(dest_dir, name) 负责路径校验，非法路径直接抛出，不会退回其他模式。
+    on_entry(name, path) 在每个文件条目写完并通过 CRC 校验后调用。
+    """
+
+    def __init__(self, dest_dir, resolve_path, on_entry=None):
+        self.dest_dir = dest_dir
+        self.resolve_path = resolve_path
+        self.on_entry = on_entry
+        self.local_names = []
+        self.central_names = []
+        self.complete = False
+        self._buffer = bytearray()
+        self._state = "signature"
+        self._entry = None
+
+    def feed(self, data):
+        if data:
+            self._buffer.extend(data)
+        while True:
+            handler = getattr(self, f"_on_{self._state}")
+            if not handler():
+                return
+
+    def finish(self):
+        if self._entry is not None:
+            self._close_entry_file()
+        if not self.complete:
+            raise ZipStreamUnsupported("压缩包在中央目录结束前中断")
+        if sorted(self.local_names) != sorted(self.central_names):
+            raise ZipStreamUnsupported("本地文件头与中央目录的条目不一致")
+
+    def abort(self):
+        if self._entry is not None:
+            self._close_entry_file()
+
+    def _on_signature(self):
+        if len(self._buffer) < 4:
+            return False
+        sig = bytes(self._buffer[:4])
+        if sig == LOCAL_HEADER_SIG:
+            self._state = "local_header"
+        elif sig == CENTRAL_HEADER_SIG:
+            self._state = "central_header"
+        elif sig in (END_OF_CENTRAL_SIG, ZIP64_END_SIG):
+            self.complete = True
+            self._state = "trailer"
+        else:
+            raise ZipStreamUnsupported("无法识别的 zip 记录")
+        return True
+
+    def _on_trailer(self):
+        self._buffer.clear()
+        return False
+
+    def _on_local_header(self):
+        if len(self._buffer) < _LOCAL_HEADER.size:
+            return False
+        (_, _, flags, method, _, _, crc, csize, usize, name_len, extra_len) = _LOCAL_HEADER.unpack_from(self._buffer)
+        header_len = _LOCAL_HEADER.size + name_len + extra_len
+        if len(self._buffer) < header_len:
+            return False
+        name = _decode_name(bytes(self._buffer[_LOCAL_HEADER.size:_LOCAL_HEADER.size + name_len]), flags)
+        del self._buffer[:header_len]
+
+        if flags & FLAG_ENCRYPTED:
+            raise ZipStreamUnsupported(f"加密条目: {name}")
+        if csize == 0xFFFFFFFF or usize == 0xFFFFFFFF:
+            raise ZipStreamUnsupported(f"ZIP64 条目: {name}")
+        has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        if method == METHOD_STORED and has_descriptor:
+            raise ZipStreamUnsupported(f"无长度信息的存储条目: {name}")
+        if method not in (METHOD_STORED, METHOD_DEFLATED):
+            raise ZipStreamUnsupported(f"不支持的压缩方式 {method}: {name}")
+
+        try:
+            target_path = self.resolve_path(self.dest_dir, name)
+        except ValueError as exc:
+            raise ValueError(f"更新包包含非法路径: {name}") from exc
+
+        self.local_names.append(name)
+        is_dir = name.endswith("/")
+        if is_dir:
+            os.makedirs(target_path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        self._entry = {
+            "name": name,
+            "path": target_path,
+            "is_dir": is_dir,
+            "method": method,
+            "has_descriptor": has_descriptor,
+            "crc": crc,
+            "csize": csize,
+            "usize": usize,
+            "remaining": csize,
+            "actual_crc": 0,
+            "written": 0,
+            "file": None if is_dir else open(target_path, "wb"),
+            "inflater": zlib.decompressobj(-15) if method == METHOD_DEFLATED else None,
+        }
+        self._state = "entry_data"
+        return True
+
+    def _write(self, data):
+        entry = self._entry
+        if not data:
+            return
+        entry["actual_crc"] = zlib.crc32(data, entry["actual_crc"])
+        entry["written"] += len(data)
+        if entry["file"] is not None:
+            entry["file"].write(data)
+        elif data:
+            raise ValueError(f"目录条目包含数据: {entry['name']}")
+
+    def _on_entry_data(self):
+        entry = self._entry
+        if entry["inflater"] is None or not entry["has_descriptor"]:
+            # 长度已知：按压缩后长度截取
+            if entry["remaining"] > 0:
+                if not self._buffer:
+                    return False
+                take = min(entry["remaining"], len(self._buffer), WRITE_BLOCK_SIZE)
+                chunk = bytes(self._buffer[:take])
+                del self._buffer[:take]
+                entry["remaining"] -= take
+                if entry["inflater"] is not None:
+                    self._write(entry["inflater"].decompress(chunk))
+                else:
+                    self._write(chunk)
+                if entry["remaining"] > 0:
+                    return True
+            if entry["inflater"] is not None:
+                self._write(entry["inflater"].flush())
+                if not entry["inflater"].eof:
+                    raise ZipStreamUnsupported(f"压缩数据不完整: {entry['name']}")
+            self._state = "descriptor" if entry["has_descriptor"] else "entry_done"
+            return True
+
+        # 带数据描述符的 deflate 条目：长度要等数据结束才知道，deflate 流自身能标出结尾
+        if not self._buffer:
+            return False
+        chunk = bytes(self._buffer[:WRITE_BLOCK_SIZE])
+        del self._buffer[:len(chunk)]
+        self._write(entry["inflater"].decompress(chunk))
+        if entry["inflater"].eof:
+            leftover = entry["inflater"].unused_data
+            if leftover:
+                self._buffer[:0] = leftover
+            self._state = "descriptor"
+        return True
+
+    def _on_descriptor(self):
+        entry = self._entry
+        if len(self._buffer) < 4:
+            return False
+        offset = 4 if bytes(self._buffer[:4]) == DATA_DESCRIPTOR_SIG else 0
+        if len(self._buffer) < offset + _DESCRIPTOR.size:
+            return False
+        crc, _, usize = _DESCRIPTOR.unpack_from(self._buffer, offset)
+        del self._buffer[:offset + _DESCRIPTOR.size]
+        entry["crc"] = crc
+        entry["usize"] = usize
+        self._state = "entry_done"
+        return True
+
+    def _close_entry_file(self):
+        entry = self._entry
+        if entry and entry["file"] is not None:
+            entry["file"].close()
+            entry["file"] = None
+
+    def _on_entry_done(self):
+        entry = self._entry
+        self._close_entry_file()
+        if entry["actual_crc"] != entry["crc"] or entry["written"] != entry["usize"]:
+            raise ZipStreamUnsupported(f"条目校验失败: {entry['name']}")
+        self._entry = None
+        self._state = "signature"
+        if self.on_entry and not entry["is_dir"]:
+            self.on_entry(entry["name"], entry["path"])
+        return True
+
+    def _on_central_header(self):
+        if len(self._buffer) < _CENTRAL_HEADER.size:
+            return False
+        fields = _CENTRAL_HEADER.unpack_from(self._buffer)
+        flags, name_len, extra_len, comment_len = fields[3], fields[10], fields[11], fields[12]
+        record_len = _CENTRAL_HEADER.size + name_len + extra_len + comment_len
+        if len(self._buffer) < record_len:
+            return False
+        raw_name = bytes(self._buffer[_CENTRAL_HEADER.size:_CENTRAL_HEADER.size + name_len])
+        self.central_names.append(_decode_name(raw_name, flags))
+        del self._buffer[:record_len]
+        self._state = "signature"
+        return True